@@ -0,0 +1,160 @@
+"""Client for the admin interface of the upstream icecast server.
+
+Requests go over a small pool of keep-alive connections, and identical
+requests made within `ttl` seconds of each other share a single upstream
+fetch: the first caller fetches, the others wait for and reuse its result.
+"""
+import time
+import socket
+import logging
+import threading
+import collections
+
+
+logger = logging.getLogger('server.adminclient')
+
+Response = collections.namedtuple('Response', ['status', 'content_type', 'body'])
+
+
+class AdminError(IOError):
+    """Raised when the upstream server can't be reached."""
+    pass
+
+
+class AdminClient(object):
+    def __init__(self, host, port, password, size=4, timeout=5.0, ttl=1.0):
+        """Keeps up to `size` idle connections to `host`:`port`, requests
+        time out after `timeout` seconds and results are shared for `ttl`
+        seconds."""
+        super(AdminClient, self).__init__()
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.ttl = ttl
+        self.auth = 'Basic ' + '{:s}:{:s}'.format('source', password)\
+                                   .encode('base64').strip()
+
+        self.lock = threading.Lock()
+        # : Idle connections, most recently used last.
+        self.idle = []
+        # : Mapping of request path to its :class:`_Fetch`.
+        self.fetches = {}
+
+        self.requests = 0
+        self.fetched = 0
+        self.connections = 0
+
+    def get(self, path, useragent=None):
+        """Returns the :class:`Response` to a GET of `path`, which includes
+        the query string. Raises :class:`AdminError` on connection errors."""
+        with self.lock:
+            self.requests += 1
+            now = time.time()
+            fetch = self.fetches.get(path)
+            if fetch is None or (fetch.done.is_set() and fetch.expires <= now):
+                fetch = _Fetch()
+                self.fetches[path] = fetch
+                leader = True
+                for key, other in self.fetches.items():
+                    if other.done.is_set() and other.expires <= now:
+                        del self.fetches[key]
+            else:
+                leader = False
+
+        if leader:
+            try:
+                fetch.response = self._fetch(path, useragent)
+            except Exception as err:
+                if not isinstance(err, AdminError):
+                    logger.exception("Failed to fetch %s from icecast.", path)
+                    err = AdminError("Failed to fetch {:s}: {!s}".format(path,
+                                                                        err))
+                fetch.error = err
+            finally:
+                # Whatever happened, the others waiting have to be woken.
+                if fetch.response is None:
+                    if fetch.error is None:
+                        fetch.error = AdminError("Fetching {:s} was "
+                                                 "interrupted.".format(path))
+                    with self.lock:
+                        # Don't hand the error to later callers.
+                        if self.fetches.get(path) is fetch:
+                            del self.fetches[path]
+                fetch.expires = time.time() + self.ttl
+                fetch.done.set()
+        elif not fetch.done.wait(self.timeout * 2):
+            raise AdminError("Timed out waiting for the upstream server.")
+
+        if fetch.error is not None:
+            raise fetch.error
+        return fetch.response
+
+    def close(self):
+        """Closes all idle connections."""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+    def _fetch(self, path, useragent):
+        """Internal method
+
+        Does the actual request, retrying once on a fresh connection if a
+        reused one turns out to be closed by the server."""
+        # Imported here since it pulls in ssl, which is slow to load.
+        import httplib
+        for attempt in (0, 1):
+            connection, reused = self._acquire(fresh=attempt > 0)
+            try:
+                connection.request('GET', path, headers={
+                    'Authorization': self.auth,
+                    'User-Agent': useragent or 'icecast-proxy',
+                    })
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error) as err:
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                logger.warning("Failed to fetch %s from icecast: %s", path, err)
+                raise AdminError("Failed to fetch {:s}: {:s}".format(path, err))
+            self.fetched += 1
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            return Response(response.status,
+                            response.getheader('Content-Type', 'text/xml'),
+                            body)
+
+    def _acquire(self, fresh=False):
+        """Internal method
+
+        Returns an idle connection, or a new one, and whether it was used
+        before."""
+        import httplib
+        if not fresh:
+            with self.lock:
+                if self.idle:
+                    return self.idle.pop(), True
+        self.connections += 1
+        return httplib.HTTPConnection(self.host, self.port,
+                                      timeout=self.timeout), False
+
+    def _release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+
+class _Fetch(object):
+    """A single upstream request shared by the callers waiting for it."""
+    def __init__(self):
+        super(_Fetch, self).__init__()
+        self.done = threading.Event()
+        self.expires = 0.0
+        self.response = None
+        self.error = None
@@ -0,0 +1,63 @@
+"""Reconnect pacing for the upstream connection.
+
+After a failed connect we wait exponentially longer before the next
+attempt, with random jitter so that the mounts of a proxy don't all hit a
+restarting server at the same moment. After :attr:`Backoff.failures` failed
+attempts in a row the circuit opens and we only try again, once, after
+:attr:`Backoff.reset` seconds.
+"""
+import random
+import time
+
+
+#: Circuit states, see :attr:`Backoff.state`.
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class Backoff(object):
+    def __init__(self, initial=1.0, maximum=60.0, factor=2.0, jitter=0.5,
+                 failures=10, reset=300.0):
+        """Waits `initial` seconds after the first failure, `factor` times
+        longer after every next one up to `maximum`. Each delay is shortened
+        by a random fraction up to `jitter`. A `failures` of 0 never opens
+        the circuit."""
+        super(Backoff, self).__init__()
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.failures = failures
+        self.reset = reset
+
+        # : Failed attempts since the last success.
+        self.count = 0
+        # : Time at which the circuit opened, :const:`None` when closed.
+        self.opened = None
+
+    @property
+    def state(self):
+        """One of :const:`CLOSED`, :const:`OPEN` or :const:`HALF_OPEN`, the
+        latter when an open circuit is due for another attempt."""
+        if self.opened is None:
+            return CLOSED
+        if time.time() - self.opened >= self.reset:
+            return HALF_OPEN
+        return OPEN
+
+    def failure(self):
+        """Records a failed attempt and returns the seconds to wait before
+        the next one."""
+        self.count += 1
+        if self.failures and self.count >= self.failures:
+            self.opened = time.time()
+            return self.reset
+        delay = min(self.maximum,
+                    self.initial * self.factor ** (self.count - 1))
+        return delay * (1.0 - self.jitter * random.random())
+
+    def success(self):
+        """Records a successful attempt, closing the circuit."""
+        self.count = 0
+        self.opened = None
@@ -0,0 +1,328 @@
+"""Serves the audio of a mount to listeners connecting to the proxy itself.
+
+A :class:`Broadcast` is a ring holding the last few seconds of what a mount
+sent upstream. It is written once per chunk and every :class:`Listener`
+follows it by offset, copying at most :data:`SEND_SIZE` bytes out of the
+ring at a time to send. A new listener starts `burst` bytes back so players
+can fill their buffer right away, and one that falls more than the ring
+behind skips ahead instead of holding anything up.
+
+Chunks come from :meth:`manager.IcyContext.read` and start on a frame
+boundary when `align_frames` is on, listeners only ever start on those. Of
+Ogg mounts the header pages of the current stream are kept, a listener
+starting after them gets them first.
+"""
+import collections
+import threading
+import struct
+import logging
+import metrics
+from . import frames
+
+
+logger = logging.getLogger('audio.broadcast')
+
+#: icy-metaint icecast uses, and we use by default.
+METAINT = 16000
+#: Most bytes a listener copies out of the ring for a single send.
+SEND_SIZE = 64 * 1024
+#: Ogg page header flag marking the first page of a logical stream.
+OGG_BOS = 0x02
+#: Longest Ogg page header, with all 255 segments.
+MAX_OGG_HEADER = 27 + 255
+
+
+class Broadcast(object):
+    def __init__(self, mount, capacity=1024 * 1024, burst=64 * 1024,
+                 format=frames.MP3):
+        """A ring of `capacity` bytes for `mount`, which is used for
+        metrics. New listeners get about `burst` bytes right away. `format`
+        is the `icecast_format` of the mount."""
+        super(Broadcast, self).__init__()
+        self.mount = mount
+        self.format = format
+        self.capacity = capacity
+        self.burst = min(burst, capacity)
+        self.storage = bytearray(capacity)
+        self.view = memoryview(self.storage)
+        self.lock = threading.Lock()
+        # : Notified on every write and close.
+        self.changed = threading.Condition(self.lock)
+        # : Total amount of bytes ever written, the offset of the next one.
+        self.end = 0
+        # : Offsets at which chunks start, oldest first.
+        self.marks = collections.deque()
+        # : Incremented by :meth:`close`, listeners of an older stream stop.
+        self.generation = 0
+        self.closed = True
+        # : Current metadata as unicode and a counter changing with it.
+        self.metadata = u''
+        self.metadata_version = 0
+        # : Called without arguments after every write and close, from the
+        # : thread doing it.
+        self.callbacks = []
+        # : Amount of :class:`Listener` objects not closed yet.
+        self.listeners = 0
+        # : Header pages of the current Ogg stream and the offset they
+        # : started at, empty until all of them were written.
+        self.headers = b''
+        self.headers_start = 0
+        # : Header pages seen so far while they are still coming in.
+        self._new_headers = None
+        self._new_headers_start = 0
+        # : Start of an Ogg page that didn't fit in the last chunk.
+        self._ogg_rest = b''
+
+    @property
+    def start(self):
+        """Offset of the oldest byte still in the ring."""
+        return max(self.end - self.capacity, 0)
+
+    def write(self, data):
+        """Adds the chunk `data` to the ring, reopening it if closed."""
+        size = len(data)
+        if not size:
+            return
+        with self.lock:
+            if self.format == frames.OGG:
+                self._scan_pages(data)
+            if size > self.capacity:
+                # Only the tail fits, and it won't start on a boundary.
+                data = data[size - self.capacity:]
+                self.end += size - self.capacity
+                size = self.capacity
+            if self.closed:
+                self.closed = False
+            position = self.end % self.capacity
+            first = min(size, self.capacity - position)
+            self.view[position:position + first] = data[:first]
+            if first < size:
+                self.view[0:size - first] = data[first:]
+            self.marks.append(self.end)
+            self.end += size
+            start = self.start
+            while self.marks and self.marks[0] < start:
+                self.marks.popleft()
+            self.changed.notify_all()
+        self._notify()
+
+    def close(self):
+        """Ends the stream for everyone listening to it now."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.generation += 1
+            self.headers = b''
+            self._new_headers = None
+            self._ogg_rest = b''
+            self.changed.notify_all()
+        self._notify()
+
+    def set_metadata(self, metadata):
+        """Sets the title sent to listeners asking for ICY metadata."""
+        with self.lock:
+            if metadata == self.metadata:
+                return
+            self.metadata = metadata
+            self.metadata_version += 1
+
+    def listener(self, metaint=0):
+        """Returns a :class:`Listener` starting about :attr:`burst` bytes
+        back, with metadata every `metaint` bytes if that isn't 0."""
+        listener = Listener(self, metaint)
+        with self.lock:
+            self.listeners += 1
+        return listener
+
+    def resume_position(self):
+        """Internal method, should be called with :attr:`lock` held.
+
+        Returns the first chunk start at least :attr:`burst` bytes back,
+        or the end if there is none."""
+        target = self.end - self.burst
+        for mark in reversed(self.marks):
+            if mark <= target:
+                return mark
+        return self.marks[0] if self.marks else self.end
+
+    def _scan_pages(self, data):
+        """Internal method, should be called with :attr:`lock` held before
+        `data` is added.
+
+        Picks the header pages out of the Ogg stream: the pages starting a
+        logical stream and those after them with granule position 0."""
+        start = self.end - len(self._ogg_rest)
+        data = self._ogg_rest + data
+        offset = 0
+        while True:
+            page = frames.parse_ogg_header(data, offset)
+            if page is None:
+                if (data[offset:offset + 4] == b'OggS' and
+                        len(data) - offset < MAX_OGG_HEADER):
+                    # Incomplete header.
+                    break
+                offset = data.find(b'OggS', offset + 1)
+                if offset == -1:
+                    # Keep what could be the start of the next one.
+                    offset = max(len(data) - 3, 0)
+                    break
+                continue
+            if offset + page.length > len(data):
+                break
+            if page.header_type & OGG_BOS:
+                if self._new_headers is None:
+                    self._new_headers = []
+                    self._new_headers_start = start + offset
+                self._new_headers.append(data[offset:offset + page.length])
+            elif self._new_headers is not None:
+                if page.granule == 0:
+                    self._new_headers.append(data[offset:offset + page.length])
+                else:
+                    self.headers = b''.join(self._new_headers)
+                    self.headers_start = self._new_headers_start
+                    self._new_headers = None
+            offset += page.length
+        self._ogg_rest = data[offset:]
+
+    def _notify(self):
+        for callback in list(self.callbacks):
+            try:
+                callback()
+            except Exception:
+                logger.exception("Exception in broadcast callback.")
+
+
+class Listener(object):
+    """Where one listener is in a :class:`Broadcast`."""
+    def __init__(self, broadcast, metaint=0):
+        super(Listener, self).__init__()
+        self.broadcast = broadcast
+        self.metaint = metaint
+        with broadcast.lock:
+            # A closed broadcast reopens in the same generation, so this
+            # waits for the next stream in that case.
+            self.generation = broadcast.generation
+            if broadcast.closed:
+                self.position = broadcast.end
+            else:
+                self.position = broadcast.resume_position()
+            # : Audio to send before what's in the ring.
+            self.prefix = b''
+            headers = broadcast.headers
+            if headers and self.position > broadcast.headers_start:
+                self.prefix = headers
+                self.position = max(self.position,
+                                    broadcast.headers_start + len(headers))
+        self.ended = False
+        self.closed = False
+        # : Audio bytes left before the next metadata block.
+        self.until_metadata = metaint
+        # : Rest of a metadata block that was only partly sent.
+        self.pending = b''
+        self._metadata_version = -1
+        self.sent_bytes = 0
+        self.dropped_bytes = 0
+
+    def wait(self, timeout=None):
+        """Waits for something to send. Returns False on timeout."""
+        broadcast = self.broadcast
+        with broadcast.lock:
+            if not self._idle():
+                return True
+            broadcast.changed.wait(timeout)
+            return not self._idle()
+
+    def send(self, send):
+        """Sends what there is with `send`, which should work like
+        :meth:`socket.socket.send` and can send less than asked or nothing
+        at all. Returns False once the stream ended."""
+        while True:
+            if self.pending:
+                sent = send(self.pending)
+                self.pending = self.pending[sent:]
+                if self.pending:
+                    return True
+            data = self._next()
+            if data is None:
+                return not self.ended
+            sent = send(data)
+            if self.prefix:
+                self.prefix = self.prefix[sent:]
+            else:
+                self.position += sent
+            self.sent_bytes += sent
+            metrics.listener_bytes.inc(sent, mount=self.broadcast.mount)
+            if self.metaint:
+                self.until_metadata -= sent
+                if not self.until_metadata:
+                    self.until_metadata = self.metaint
+                    self.pending = self._metadata_block()
+            if not sent:
+                return True
+
+    def close(self):
+        """Call this when the listener is gone."""
+        if not self.closed:
+            self.closed = True
+            with self.broadcast.lock:
+                self.broadcast.listeners -= 1
+
+    def _idle(self):
+        """Internal method, should be called with the broadcast lock held."""
+        broadcast = self.broadcast
+        if broadcast.generation != self.generation:
+            self.ended = True
+        return not self.ended and not self.pending and not self.prefix and \
+            self.position >= broadcast.end
+
+    def _next(self):
+        """Internal method
+
+        Returns a copy of the next bytes to send, or :const:`None` if there
+        is nothing to send. Copied with the lock held, a writer can lap us
+        any time after that."""
+        broadcast = self.broadcast
+        with broadcast.lock:
+            if broadcast.generation != self.generation:
+                self.ended = True
+            if self.ended:
+                return None
+            if self.prefix:
+                size = len(self.prefix)
+                if self.metaint:
+                    size = min(size, self.until_metadata)
+                return self.prefix[:size]
+            if self.position < broadcast.start:
+                # We fell too far behind, skip to recent audio.
+                position = broadcast.resume_position()
+                self.dropped_bytes += position - self.position
+                metrics.listener_dropped_bytes.inc(position - self.position,
+                                                   mount=broadcast.mount)
+                self.position = position
+            size = broadcast.end - self.position
+            if not size:
+                return None
+            offset = self.position % broadcast.capacity
+            size = min(size, broadcast.capacity - offset, SEND_SIZE)
+            if self.metaint:
+                size = min(size, self.until_metadata)
+            return broadcast.view[offset:offset + size].tobytes()
+
+    def _metadata_block(self):
+        """Internal method
+
+        Returns the ICY metadata block to send next, a single zero byte
+        when the metadata didn't change since the last one."""
+        broadcast = self.broadcast
+        with broadcast.lock:
+            if broadcast.metadata_version == self._metadata_version:
+                return b'\x00'
+            self._metadata_version = broadcast.metadata_version
+            metadata = broadcast.metadata
+        # Cut on a character, not in the middle of one.
+        title = metadata.encode('utf-8', 'replace')[:4000].decode(
+                                        'utf-8', 'ignore').encode('utf-8')
+        block = b"StreamTitle='" + title + b"';"
+        length = (len(block) + 15) // 16
+        return struct.pack('B', length) + block.ljust(length * 16, b'\x00')
@@ -0,0 +1,127 @@
+"""Sends the audio of one source to several icecast servers.
+
+A :class:`FanOut` hands every chunk it reads from its source to each of its
+:class:`Branch` objects, which are read by one :class:`audio.icecast.Icecast`
+each. Chunks are shared between the branches, not copied. Whichever branch
+runs out of data first reads the next chunk for all of them, so there is no
+thread of its own. A branch that falls more than `backlog` bytes behind
+loses its oldest chunks instead of holding the others up.
+"""
+import threading
+import logging
+import collections
+import metrics
+
+
+logger = logging.getLogger('audio.fanout')
+
+
+class FanOut(object):
+    def __init__(self, source, backlog=512 * 1024):
+        """Reads from `source`, which has to have a `read(size, timeout)`
+        method like :meth:`manager.IcyContext.read`."""
+        super(FanOut, self).__init__()
+        self.source = source
+        self.backlog = backlog
+        self.branches = []
+        # : Held by the branch reading from :attr:`source`.
+        self.lock = threading.Lock()
+        self.eof = False
+
+    def branch(self, name):
+        """Returns a new :class:`Branch` called `name`, for logs and
+        metrics."""
+        branch = Branch(self, name)
+        self.branches.append(branch)
+        return branch
+
+    def reset(self):
+        """Empties all branches and forgets about EOF, for a new stream."""
+        with self.lock:
+            self.eof = False
+            for branch in self.branches:
+                branch.clear()
+
+    def pull(self, branch, size, timeout):
+        """Reads a chunk from :attr:`source` for all branches. Returns False
+        when there is nothing for `branch` yet and it should give up."""
+        if not self.lock.acquire(timeout is None):
+            # Someone else is reading already.
+            return False
+        try:
+            if branch.chunks or self.eof:
+                # Delivered while we were waiting for the lock.
+                return True
+            data = self.source.read(size, timeout=timeout)
+            if data:
+                for other in self.branches:
+                    other.put(data)
+                return True
+            if timeout is None or getattr(self.source, 'eof', True):
+                self.eof = True
+                return True
+            return False
+        finally:
+            self.lock.release()
+
+
+class Branch(object):
+    """The part of a :class:`FanOut` read by a single upstream."""
+    def __init__(self, fanout, name):
+        super(Branch, self).__init__()
+        self.fanout = fanout
+        self.name = name
+        self.lock = threading.Lock()
+        # : Chunks not read yet, oldest first.
+        self.chunks = collections.deque()
+        # : Bytes in :attr:`chunks`.
+        self.length = 0
+        self.dropped_bytes = 0
+        self._labels = {'mount': getattr(fanout.source, 'mount', ''),
+                        'upstream': name}
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def eof(self):
+        return self.fanout.eof and not self.chunks
+
+    def put(self, chunk):
+        with self.lock:
+            self.chunks.append(chunk)
+            self.length += len(chunk)
+            dropped = 0
+            while self.length > self.fanout.backlog and len(self.chunks) > 1:
+                old = self.chunks.popleft()
+                self.length -= len(old)
+                dropped += len(old)
+            length = self.length
+        metrics.upstream_lag_bytes.set(length, **self._labels)
+        if dropped:
+            if not self.dropped_bytes:
+                logger.warning("%s: Upstream %s fell behind, dropping audio.",
+                               self._labels['mount'], self.name)
+            self.dropped_bytes += dropped
+            metrics.upstream_dropped_bytes.inc(dropped, **self._labels)
+
+    def clear(self):
+        with self.lock:
+            self.chunks.clear()
+            self.length = 0
+        metrics.upstream_lag_bytes.set(0, **self._labels)
+
+    def read(self, size=4096, timeout=None):
+        """Returns the next chunk, which can be larger than `size`. Waits
+        like :meth:`manager.IcyContext.read`, except that a `timeout` other
+        than :const:`None` doesn't wait on another branch reading."""
+        while True:
+            with self.lock:
+                if self.chunks:
+                    chunk = self.chunks.popleft()
+                    self.length -= len(chunk)
+                    return chunk
+                if self.fanout.eof:
+                    return b''
+            if not self.fanout.pull(self, size, timeout):
+                return b''
@@ -0,0 +1,126 @@
+"""Filler audio that keeps a mount alive while it has no source.
+
+Feeds are read like a source buffer but hand out whole frames no faster
+than real time, so the upstream server receives a normal stream.
+"""
+import time
+import logging
+from . import frames
+
+
+logger = logging.getLogger('audio.filler')
+
+#: An MPEG 1 layer 3, 128kbps, 44.1kHz mono frame with no audio data,
+#: which decodes to silence.
+SILENT_MP3_FRAME = b'\xff\xfb\x90\xc4' + b'\x00' * 413
+SILENT_MP3_DURATION = 1152 / 44100.0
+
+
+def silent_frame(header):
+    """Returns `(data, duration)` of a frame with no audio data like the
+    one with the 4 byte MP3 `header`: same version, layer, bitrate,
+    samplerate and channel mode, without CRC or padding. Returns
+    :const:`None` if `header` isn't valid."""
+    if header is None or len(header) != 4:
+        return None
+    header = bytes(header)
+    header = (header[0] + chr(ord(header[1]) | 0x01) +
+              chr(ord(header[2]) & ~0x02 & 0xff) + header[3])
+    frame = frames.parse_mp3_header(header)
+    if frame is None:
+        return None
+    return (header + b'\x00' * (frame.length - 4),
+            float(frame.samples) / frame.samplerate)
+
+
+class Feed(object):
+    """Base class of filler feeds, subclasses implement :meth:`frames`."""
+    def __init__(self):
+        super(Feed, self).__init__()
+        self._frames = self.frames()
+        # : Wall clock time at which the media clock started.
+        self.started = None
+        # : Seconds of audio handed out since :attr:`started`.
+        self.position = 0.0
+
+    def frames(self):
+        """Yields `(data, duration)` tuples forever."""
+        raise NotImplementedError
+
+    def read(self, size=4096, timeout=None):
+        """Returns whole frames adding up to at least `size` bytes, blocking
+        until the first of them is due to be played. If that is more than
+        `timeout` seconds away an empty string is returned instead."""
+        now = time.time()
+        if self.started is None or now > self.started + self.position + 1.0:
+            # We weren't read from for a while, restart the media clock.
+            self.started = now
+            self.position = 0.0
+        due = self.started + self.position
+        if timeout is not None and due - now > timeout:
+            return b''
+
+        chunks = []
+        length = 0
+        while length < size:
+            data, duration = next(self._frames)
+            chunks.append(data)
+            length += len(data)
+            self.position += duration
+
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return b''.join(chunks)
+
+
+class SilenceFeed(Feed):
+    """Endless MP3 silence, in frames like the last one `scanner` saw if
+    given so the stream keeps its samplerate, channels and bitrate."""
+    def __init__(self, scanner=None):
+        self.scanner = scanner
+        super(SilenceFeed, self).__init__()
+
+    def frames(self):
+        header = None
+        frame = SILENT_MP3_FRAME, SILENT_MP3_DURATION
+        while True:
+            if self.scanner is not None and self.scanner.header != header:
+                header = self.scanner.header
+                frame = (silent_frame(header) or
+                         (SILENT_MP3_FRAME, SILENT_MP3_DURATION))
+            yield frame
+
+
+class FileFeed(Feed):
+    """Loops the MP3 or Ogg file at `path` forever."""
+    def __init__(self, path, format):
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.chunks = [(data[offset:offset + length], duration)
+                       for offset, length, duration
+                       in frames.iter_frames(data, format)]
+        if not self.chunks or not sum(d for _, d in self.chunks):
+            raise ValueError("No playable audio found in '{:s}'.".format(path))
+        super(FileFeed, self).__init__()
+
+    def frames(self):
+        while True:
+            for chunk in self.chunks:
+                yield chunk
+
+
+def create_feed(path, format, scanner=None):
+    """Returns the filler :class:`Feed` to use for a mount of `format`,
+    looping the file at `path` if given. Silence is made to match what the
+    :class:`audio.frames.FrameScanner` `scanner` of the mount saw. Returns
+    :const:`None` if there is nothing suitable, we can't generate Ogg
+    silence."""
+    if path:
+        try:
+            return FileFeed(path, format)
+        except (IOError, ValueError):
+            logger.exception("Can't use '%s' as fallback audio.", path)
+    if format == frames.MP3:
+        return SilenceFeed(scanner)
+    return None
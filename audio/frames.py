@@ -0,0 +1,245 @@
+"""Helpers to find MP3 frame and Ogg page boundaries in raw stream data.
+
+The format constants match the `icecast_format` configuration values.
+All functions accept byte strings, :class:`bytearray` is converted by the
+caller where needed.
+"""
+import collections
+import struct
+
+
+#: `icecast_format` value of an Ogg stream.
+OGG = 0
+#: `icecast_format` value of an MP3 stream.
+MP3 = 1
+
+MP3Frame = collections.namedtuple('MP3Frame', ['length', 'samples',
+                                               'samplerate', 'bitrate'])
+OggPage = collections.namedtuple('OggPage', ['length', 'granule', 'serial',
+                                             'header_type'])
+
+# Bitrates in kbit/s indexed by (MPEG version 1 or 2, layer) and then the
+# 4 bit bitrate index of the header. MPEG 2.5 shares the MPEG 2 tables.
+_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Samplerates indexed by the 2 bit version field of the header.
+_SAMPLERATES = {0: (11025, 12000, 8000),   # MPEG 2.5
+                2: (22050, 24000, 16000),  # MPEG 2
+                3: (44100, 48000, 32000)}  # MPEG 1
+
+_OGG_HEADER = struct.Struct('<4sBBqIIIB')
+
+
+def parse_mp3_header(data, offset=0):
+    """Parses the 4 byte MP3 frame header at `offset` in `data`.
+
+    Returns a :class:`MP3Frame` or :const:`None` if there is no valid
+    header at that position.
+    """
+    if len(data) < offset + 4:
+        return None
+    b0, b1, b2 = ord(data[offset]), ord(data[offset + 1]), ord(data[offset + 2])
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    samplerate_index = (b2 >> 2) & 0x03
+    padding = (b2 >> 1) & 0x01
+    if (version == 1 or layer == 4 or bitrate_index in (0, 15)
+            or samplerate_index == 3):
+        # Reserved values, or free format which we can't measure.
+        return None
+
+    bitrate = _BITRATES[(1 if version == 3 else 2, layer)][bitrate_index] * 1000
+    samplerate = _SAMPLERATES[version][samplerate_index]
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // samplerate + padding) * 4
+    elif layer == 3 and version != 3:
+        samples = 576
+        length = 72 * bitrate // samplerate + padding
+    else:
+        samples = 1152
+        length = 144 * bitrate // samplerate + padding
+    return MP3Frame(length, samples, samplerate, bitrate)
+
+
+def parse_ogg_header(data, offset=0):
+    """Parses the Ogg page header at `offset` in `data`.
+
+    Returns an :class:`OggPage` or :const:`None` if there is no complete
+    page header at that position.
+    """
+    if data[offset:offset + 4] != b'OggS':
+        return None
+    end = offset + _OGG_HEADER.size
+    if len(data) < end:
+        return None
+    (_, version, header_type, granule, serial,
+     _, _, segments) = _OGG_HEADER.unpack_from(data, offset)
+    if version != 0 or len(data) < end + segments:
+        return None
+    length = _OGG_HEADER.size + segments + sum(bytearray(data[end:end + segments]))
+    return OggPage(length, granule, serial, header_type)
+
+
+def parse_header(data, offset, format):
+    """Parses the frame or page header of `format` at `offset`."""
+    if format == MP3:
+        return parse_mp3_header(data, offset)
+    return parse_ogg_header(data, offset)
+
+
+def find_boundary(data, format, start=0):
+    """Returns the offset of the first frame (MP3) or page (Ogg) that starts
+    at or after `start` in `data`, or -1 if none could be found.
+
+    MP3 frames are only accepted if the next frame header directly follows
+    them, unless that header isn't in `data` yet, to avoid syncing onto
+    random 0xFF bytes in the audio data.
+    """
+    if format == OGG:
+        return data.find(b'OggS', start)
+
+    offset = data.find(b'\xff', start)
+    while offset != -1:
+        frame = parse_mp3_header(data, offset)
+        if frame is not None:
+            following = offset + frame.length
+            if (len(data) < following + 4
+                    or parse_mp3_header(data, following) is not None):
+                return offset
+        offset = data.find(b'\xff', offset + 1)
+    return -1
+
+
+def ogg_samplerate(data, offset=0):
+    """Returns the samplerate of the Vorbis or Opus stream whose first page
+    starts at `offset`, or :const:`None` if it isn't recognized. Opus
+    granule positions always count 48kHz samples."""
+    page = parse_ogg_header(data, offset)
+    if page is None:
+        return None
+    segments = ord(data[offset + _OGG_HEADER.size - 1])
+    packet = offset + _OGG_HEADER.size + segments
+    if data[packet:packet + 7] == b'\x01vorbis':
+        return struct.unpack_from('<I', data, packet + 12)[0]
+    elif data[packet:packet + 8] == b'OpusHead':
+        return 48000
+    return None
+
+
+def iter_frames(data, format):
+    """Yields `(offset, length, duration)` of every whole frame or page in
+    `data`, duration is in seconds. Garbage between frames is skipped.
+
+    The duration of an Ogg page is derived from the granule position so
+    pages without any finished packet have a duration of 0.
+    """
+    samplerate = None
+    granule = 0
+    offset = find_boundary(data, format)
+    while offset != -1:
+        header = parse_header(data, offset, format)
+        if header is None or offset + header.length > len(data):
+            break
+        if format == MP3:
+            duration = float(header.samples) / header.samplerate
+        else:
+            if header.header_type & 0x02:
+                # Beginning of a (new) logical stream.
+                samplerate = ogg_samplerate(data, offset)
+                granule = 0
+            duration = 0.0
+            if header.granule >= 0 and samplerate:
+                duration = float(max(header.granule - granule, 0)) / samplerate
+                granule = header.granule
+        yield offset, header.length, duration
+        offset = find_boundary(data, format, offset + header.length)
+
+
+class FrameScanner(object):
+    """Incrementally splits a stream of `format` into whole frames (MP3) or
+    pages (Ogg).
+
+    Only frame headers are parsed, an incomplete frame at the end of the
+    data is kept until the rest of it is fed in.
+    """
+    def __init__(self, format):
+        super(FrameScanner, self).__init__()
+        self.format = format
+        # : Start of a frame that isn't complete yet.
+        self.pending = b''
+        # : False until the first frame boundary was found.
+        self.synced = False
+        # : Amount of bytes skipped to find a frame boundary.
+        self.skipped = 0
+        # : The 4 byte header of the last whole MP3 frame seen, kept over
+        # : :meth:`reset` as the best guess of what the stream looks like.
+        self.header = None
+
+    def feed(self, data):
+        """Adds `data` and returns all frames completed by it as a single
+        string, which can be empty."""
+        if self.pending:
+            data = self.pending + data
+        chunks = []
+        position = 0
+        search_from = 0
+        while True:
+            if not self.synced:
+                boundary = find_boundary(data, self.format, search_from)
+                if boundary == -1:
+                    # Keep a few bytes in case a header starts at the end.
+                    keep = min(len(data) - position, 3)
+                    self.skipped += len(data) - position - keep
+                    position = len(data) - keep
+                    break
+                self.skipped += boundary - position
+                position = boundary
+                self.synced = True
+
+            start = last = position
+            while True:
+                header = parse_header(data, position, self.format)
+                if header is None or position + header.length > len(data):
+                    break
+                last = position
+                position += header.length
+            if position > start:
+                chunks.append(data[start:position])
+                if self.format == MP3:
+                    self.header = data[last:last + 4]
+            if header is None and not self._incomplete(data, position):
+                # Lost sync, look for the next boundary after this one.
+                self.synced = False
+                search_from = position + 1
+                continue
+            break
+
+        self.pending = data[position:]
+        return b''.join(chunks)
+
+    def reset(self):
+        """Forgets any partial frame, call this when the stream changes."""
+        self.pending = b''
+        self.synced = False
+
+    def _incomplete(self, data, offset):
+        """Returns True if `data` ends before the header at `offset` does."""
+        remaining = len(data) - offset
+        if self.format == MP3:
+            return remaining < 4
+        if remaining < _OGG_HEADER.size:
+            return b'OggS'.startswith(data[offset:offset + 4])
+        if data[offset:offset + 4] != b'OggS':
+            return False
+        segments = ord(data[offset + _OGG_HEADER.size - 1])
+        return remaining < _OGG_HEADER.size + segments
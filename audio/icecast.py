@@ -2,28 +2,151 @@ import threading
 import time
 import pylibshout
 import logging
+import metrics
+from .pacing import Pacer
+from .backoff import Backoff
+from .metadata import MetadataQueue
+from . import frames
 
 
 logger = logging.getLogger('audio.icecast')
 
+#: Returned by libshout while a nonblocking operation is in progress.
+SHOUTERR_BUSY = getattr(pylibshout, 'SHOUTERR_BUSY', -10)
+#: Connect errors that leave the libshout object fit to try again with,
+#: anything else gets us a new one.
+REUSABLE_ERRORS = (getattr(pylibshout, 'SHOUTERR_NOCONNECT', -2),
+                   getattr(pylibshout, 'SHOUTERR_NOLOGIN', -3),
+                   getattr(pylibshout, 'SHOUTERR_SOCKET', -4),
+                   getattr(pylibshout, 'SHOUTERR_UNCONNECTED', -8))
+#: Settings that take a new connection to change, see :meth:`Icecast.reconfigure`.
+CONNECTION_SETTINGS = ('host', 'port', 'password', 'format', 'protocol',
+                       'mount')
+
 class Icecast(object):
     connecting_timeout = 5.0
-    def __init__(self, source, config):
+    #: Seconds between source reads when we are driven by a scheduler and
+    #: the source had no data for us.
+    idle_interval = 0.05
+    def __init__(self, source, config, pacing_lead=None, scheduler=None,
+                 backoff=None, metadata_debounce=0.5):
+        """`pacing_lead` is the amount of seconds we may send ahead of real
+        time, :const:`None` sends as fast as the source delivers.
+
+        With a :class:`audio.scheduler.Scheduler` as `scheduler` we use
+        nonblocking libshout and let it call :meth:`step`, instead of
+        running our own thread.
+
+        `backoff` is the :class:`audio.backoff.Backoff` deciding when to
+        reconnect, a default one is used if :const:`None`.
+
+        Metadata is sent `metadata_debounce` seconds after the first update
+        of a burst, see :class:`audio.metadata.MetadataQueue`."""
         super(Icecast, self).__init__()
         self.config = (config if isinstance(config, IcecastConfig)
                        else IcecastConfig(config))
         self.source = source
+        self.scheduler = scheduler
+
+        self.pacer = None
+        if pacing_lead is not None:
+            self.pacer = Pacer(self.config.get('format', frames.MP3),
+                               lead=pacing_lead)
+
+        self._should_run = threading.Event()
+        self._should_run.set()
+        #: Incremented on every start and close, see :meth:`step`.
+        self.generation = 0
+        #: Held by the :class:`audio.scheduler.Scheduler` while it steps us
+        #: and by :meth:`start` and :meth:`close`, so they wait for a step
+        #: in progress and no two threads step us at once.
+        self.step_lock = threading.RLock()
+        #: Data read from the source waiting for its turn, and its due time.
+        self._pending = None
+        self._pending_due = 0.0
+        #: Time a nonblocking connect was started, if one is in progress.
+        self._connecting_since = None
+        #: Time of the next reconnect attempt, if we are disconnected.
+        self._reconnect_at = None
+        self._nonblocking = scheduler is not None
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.metadata = MetadataQueue(self._send_metadata,
+                                      self.config.get('mount'),
+                                      debounce=metadata_debounce)
+        #: Set when the libshout object should be replaced before the next
+        #: connect instead of reused.
+        self._rebuild = False
+        #: Settings given to :meth:`reconfigure` while running, applied by
+        #: :meth:`step`.
+        self._new_config = None
 
         self._shout = self.setup_libshout()
+        if self._nonblocking:
+            self._nonblocking = self.nonblocking(True)
 
     def connect(self):
-        """Connect the libshout object to the configured server."""
+        """Connect the libshout object to the configured server. In
+        nonblocking mode this only starts connecting, :meth:`step` finishes
+        it."""
+        start = time.time()
         try:
             self._shout.open()
-            logger.info("Connected to Icecast on " + self.config['mount'])
         except (pylibshout.ShoutException) as err:
+            if self._nonblocking and err[0] == SHOUTERR_BUSY:
+                self._connecting_since = start
+                return
+            metrics.upstream_connect_seconds.observe(
+                    time.time() - start, **self._labels())
+            if err[0] not in REUSABLE_ERRORS:
+                self._rebuild = True
             logger.exception("Failed to connect to Icecast server.")
+            self._connect_failed()
             raise IcecastError("Failed to connect to icecast server.")
+        else:
+            self._connect_succeeded(start)
+
+    def _labels(self):
+        """Internal method
+
+        Returns the labels of our metrics, the main server and the relays
+        of a mount share the mount and are told apart by `upstream`."""
+        return {'mount': self.config.get('mount'),
+                'upstream': '{!s}:{!s}'.format(self.config.get('host'),
+                                               self.config.get('port'))}
+
+    def _connect_succeeded(self, start):
+        """Internal method
+
+        Records a connect that started at `start` and closes the circuit."""
+        metrics.upstream_connect_seconds.observe(
+                time.time() - start, **self._labels())
+        logger.info("Connected to Icecast on " + self.config['mount'])
+        if self.backoff.opened is not None:
+            logger.info("%s: Upstream circuit closed.", self.config['mount'])
+        self.backoff.success()
+        metrics.upstream_circuit_open.set(0, **self._labels())
+        # A new connection starts out without a title.
+        self.metadata.resend()
+
+    def _connect_failed(self):
+        """Internal method
+
+        Records a failed connect, or a lost connection, and schedules the
+        next attempt according to :attr:`backoff`. Returns the seconds until
+        that attempt."""
+        metrics.upstream_connect_failures.inc(**self._labels())
+        was_open = self.backoff.opened is not None
+        delay = self.backoff.failure()
+        if self.backoff.opened is not None:
+            if not was_open:
+                logger.error("%s: Upstream circuit open after %d failed "
+                             "connects.", self.config['mount'],
+                             self.backoff.count)
+            metrics.upstream_circuit_open.set(1, **self._labels())
+        logger.info("%s: Reconnecting to Icecast in %.1f seconds.",
+                    self.config['mount'], delay)
+        self._reconnect_at = time.time() + delay
+        return delay
 
     def connected(self):
         """Returns True if the libshout object is currently connected to
@@ -37,57 +160,173 @@ class Icecast(object):
         raise NotImplementedError("Icecast does not support reading.")
 
     def nonblocking(self, state):
-        pass
+        """Switches the libshout object between blocking and nonblocking
+        mode, returns False if the library doesn't support it."""
+        try:
+            self._shout.nonblocking = state
+        except (AttributeError, pylibshout.ShoutException) as err:
+            logger.warning("libshout doesn't support nonblocking mode.")
+            return False
+        return True
 
     def close(self):
         """Closes the libshout object and tries to join the thread if we are
         not calling this from our own thread."""
         self._should_run.set()
-        try:
-            self._shout.close()
-            logger.info("Disconnected from Icecast on " + self.config['mount'])
-        except (pylibshout.ShoutException) as err:
-            if err[0] == pylibshout.SHOUTERR_UNCONNECTED:
-                pass
-            else:
-                logger.exception("Exception in pylibshout close call.")
-                raise IcecastError("Exception in pylibshout close.")
+        with self.step_lock:
+            self.generation += 1
+            self._pending = None
+            self._connecting_since = None
+            self.metadata.clear()
+            if self._new_config is not None:
+                self.config, self._new_config = self._new_config, None
+                self._rebuild = True
+            try:
+                self._shout.close()
+                logger.info("Disconnected from Icecast on " +
+                            self.config['mount'])
+            except (pylibshout.ShoutException) as err:
+                if err[0] == pylibshout.SHOUTERR_UNCONNECTED:
+                    pass
+                else:
+                    logger.exception("Exception in pylibshout close call.")
+                    raise IcecastError("Exception in pylibshout close.")
         try:
             self._thread.join(5.0)
-        except (RuntimeError) as err:
+        except (AttributeError, RuntimeError) as err:
             pass
 
     def run(self):
-        while not self._should_run.is_set():
-            while self.connected():
-                if hasattr(self, '_saved_meta'):
-                    self.set_metadata(self._saved_meta)
-                    del self._saved_meta
-
-                buff = self.source.read(8192)
-                if buff == b'':
-                    # EOF received
-                    self.close()
-                    logger.error("Source EOF, closing ourself.")
-                    break
-                else:
-                    try:
-                        self._shout.send(buff)
-                        #self._shout.sync()
-                    except (pylibshout.ShoutException) as err:
-                        logger.exception("Failed sending stream data.")
-                        self.reboot_libshout()
+        """Drives :meth:`step` from our own thread."""
+        while True:
+            delay = self.step(timeout=None)
+            if delay is None:
+                break
+            if delay and self._should_run.wait(delay):
+                break
 
-            if not self._should_run.is_set():
-                time.sleep(self.connecting_timeout)
-                self.reboot_libshout()
+    def step(self, timeout=0):
+        """Does one round of work: (re)connecting, reading from the source
+        or sending to icecast. Never waits longer than `timeout` seconds for
+        source data, :const:`None` waits until data or EOF arrives.
+
+        Returns the amount of seconds after which it wants to be called
+        again, or :const:`None` when we are closed.
+        """
+        if self._should_run.is_set():
+            return None
+        if self._new_config is not None:
+            return self._apply_config()
+        now = time.time()
+
+        if self._connecting_since is not None:
+            if self.connected():
+                self._connect_succeeded(self._connecting_since)
+                self._connecting_since = None
+            elif now - self._connecting_since > self.connecting_timeout:
+                logger.error("Timed out connecting to Icecast on " +
+                             self.config['mount'])
+                metrics.upstream_connect_seconds.observe(
+                        now - self._connecting_since,
+                        **self._labels())
+                self._connecting_since = None
+                return self._connect_failed()
+            else:
+                return self.idle_interval
 
-    def start(self):
-        """Starts the thread that reads from source and feeds it to icecast."""
         if not self.connected():
-            self.connect()
-        self._should_run = threading.Event()
+            if self._reconnect_at is None:
+                # We lost the connection, don't rush back all at once.
+                return self._connect_failed()
+            if now < self._reconnect_at:
+                return self._reconnect_at - now
+            self._reconnect_at = None
+            self.reboot_libshout()
+            return 0.0
+
+        if self._pending is None:
+            buff = self.source.read(8192, timeout=timeout)
+            if buff == b'':
+                if timeout is not None and not getattr(self.source, 'eof', True):
+                    # Nothing there yet.
+                    return self.idle_interval
+                # EOF received
+                self.close()
+                logger.error("Source EOF, closing ourself.")
+                return None
+            self._pending = buff
+            self._pending_due = now
+            if self.pacer is not None:
+                self._pending_due += self.pacer.delay(buff)
+            if self._pending_due > now:
+                return self._pending_due - now
+        elif self._pending_due > now:
+            return self._pending_due - now
+
+        buff, self._pending = self._pending, None
+        try:
+            start = time.time()
+            self._shout.send(buff)
+            metrics.upstream_send_seconds.observe(
+                    time.time() - start, **self._labels())
+            metrics.upstream_bytes.inc(len(buff), **self._labels())
+            #self._shout.sync()
+        except (pylibshout.ShoutException) as err:
+            if self._nonblocking and err[0] == SHOUTERR_BUSY:
+                # libshout queued what it couldn't send yet, give the
+                # socket time to drain before we add more.
+                metrics.upstream_bytes.inc(len(buff), **self._labels())
+                return self.idle_interval
+            logger.exception("Failed sending stream data.")
+            try:
+                self._shout.close()
+            except (pylibshout.ShoutException) as err:
+                pass
+            return self._connect_failed()
+        return 0.0
 
+    def running(self):
+        """Returns True between :meth:`start` and :meth:`close`, connected
+        or not."""
+        return not self._should_run.is_set()
+
+    def start(self):
+        """Starts feeding the source to icecast, either on a new thread or
+        on our scheduler. If we can't connect right away, or are waiting
+        before the next attempt, we keep trying in the background, see
+        :attr:`backoff`."""
+        # Waits for a step of the previous generation that is still going.
+        with self.step_lock:
+            self._should_run = threading.Event()
+            self.generation += 1
+            self._pending = None
+            if self.pacer is not None:
+                self.pacer.reset()
+            if self._rebuild and not self.connected():
+                self._shout = self.setup_libshout()
+                self._rebuild = False
+                if self._nonblocking:
+                    self._nonblocking = self.nonblocking(True)
+            if self.connected():
+                self._reconnect_at = None
+            elif self._reconnect_at is not None and \
+                    self._reconnect_at > time.time():
+                # Still backing off, or the circuit is open, the next
+                # attempt is up to step when it's due.
+                logger.info("%s: Connecting to Icecast in %.1f seconds.",
+                            self.config['mount'],
+                            self._reconnect_at - time.time())
+            else:
+                self._reconnect_at = None
+                try:
+                    self.connect()
+                except IcecastError:
+                    logger.warning("%s: Will retry connecting in the "
+                                   "background.", self.config['mount'])
+
+        if self.scheduler is not None:
+            self.scheduler.add(self)
+            return
         self._thread = threading.Thread(target=self.run)
         self._thread.name = "Icecast"
         self._thread.daemon = True
@@ -96,19 +335,57 @@ class Icecast(object):
     def switch_source(self, new_source):
         """Tries to change the source without disconnect from icecast."""
         self._should_run.set()  # Gracefully try to get rid of the thread
-        try:
-            self._thread.join(5.0)
-        except RuntimeError as err:
-            logger.exception("Got called from my own thread.")
+        if self.scheduler is None:
+            try:
+                self._thread.join(5.0)
+            except (AttributeError, RuntimeError) as err:
+                logger.exception("Got called from my own thread.")
         self.source = new_source  # Swap out our source
         self.start()  # Start a new thread (so roundabout)
 
+    def reconfigure(self, config):
+        """Uses the settings in the dict `config` from now on. Reconnects
+        if that changes any of :data:`CONNECTION_SETTINGS`, others such as
+        the stream name are sent on the next connect."""
+        config = IcecastConfig(config)
+        if self.running():
+            # The connection belongs to :meth:`step`.
+            self._new_config = config
+        else:
+            self.config = config
+            self._rebuild = True
+
+    def _apply_config(self):
+        """Internal method
+
+        Switches to the settings given to :meth:`reconfigure`."""
+        config, self._new_config = self._new_config, None
+        reconnect = any(config.get(key) != self.config.get(key)
+                        for key in CONNECTION_SETTINGS)
+        self.config = config
+        self._rebuild = True
+        if reconnect:
+            logger.info("%s: Settings changed, reconnecting to Icecast.",
+                        self.config['mount'])
+            self._connecting_since = None
+            try:
+                self._shout.close()
+            except (pylibshout.ShoutException) as err:
+                pass
+            # Not a failure, so no backoff.
+            self._reconnect_at = time.time()
+        return 0.0
+
     def set_metadata(self, metadata):
-        try:
-            self._shout.metadata = {'song': metadata}  # Stupid library
-        except (pylibshout.ShoutException) as err:
-            logger.exception("Failed sending metadata. No action taken.")
-            self._saved_meta = metadata
+        """Queues `metadata` to be sent to icecast, see
+        :class:`audio.metadata.MetadataQueue`."""
+        self.metadata.put(metadata)
+
+    def _send_metadata(self, metadata):
+        """Internal method
+
+        Sends `metadata` right away, called by :attr:`metadata`."""
+        self._shout.metadata = {'song': metadata}  # Stupid library
 
     def setup_libshout(self):
         """Internal method
@@ -122,13 +399,24 @@ class Icecast(object):
     def reboot_libshout(self):
         """Internal method
         
-        Tries to recreate the libshout object.
+        Tries to reconnect, reusing the configured libshout object unless
+        the last attempt left it in a bad state.
         """
+        metrics.upstream_reconnects.inc(**self._labels())
         try:
-            self._shout = self.setup_libshout()
-        except (IcecastError) as err:
-            logger.exception("Configuration failed.")
-            self.close()
+            self._shout.close()
+        except (pylibshout.ShoutException) as err:
+            pass
+        if self._rebuild:
+            try:
+                self._shout = self.setup_libshout()
+            except IcecastError:
+                logger.exception("Configuration failed.")
+                self.close()
+                return
+            self._rebuild = False
+            if self._nonblocking:
+                self._nonblocking = self.nonblocking(True)
         try:
             self.connect()
         except (IcecastError) as err:
@@ -0,0 +1,159 @@
+"""Sends metadata updates to icecast off the request handler threads.
+
+Every mount has a :class:`MetadataQueue` that keeps only the newest title,
+drops titles that are already on icecast and waits `debounce` seconds after
+the first update of a burst so a client spamming titles costs a single
+request. Failed sends are retried with a growing delay. The actual sending
+happens on the thread of a :class:`MetadataSender` shared by all queues.
+"""
+import heapq
+import itertools
+import threading
+import time
+import logging
+import metrics
+
+
+logger = logging.getLogger('audio.metadata')
+
+
+class MetadataSender(object):
+    """A thread flushing :class:`MetadataQueue` objects when they are due."""
+    def __init__(self):
+        super(MetadataSender, self).__init__()
+        self.lock = threading.Condition()
+        # : Heap of (due time, sequence, queue) tuples.
+        self.timers = []
+        self._sequence = itertools.count()
+
+        self.thread = threading.Thread(target=self.run,
+                                       name="Metadata sender")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def schedule(self, queue, delay):
+        """Flushes `queue` in `delay` seconds."""
+        with self.lock:
+            heapq.heappush(self.timers, (time.time() + delay,
+                                         next(self._sequence), queue))
+            self.lock.notify()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while True:
+                    if not self.timers:
+                        self.lock.wait()
+                        continue
+                    delay = self.timers[0][0] - time.time()
+                    if delay > 0:
+                        self.lock.wait(delay)
+                        continue
+                    _, _, queue = heapq.heappop(self.timers)
+                    break
+            try:
+                queue.flush()
+            except Exception:
+                logger.exception("Unhandled exception sending metadata.")
+
+
+_shared_sender = None
+_shared_lock = threading.Lock()
+
+
+def shared_sender():
+    """Returns the :class:`MetadataSender` used by default, starting it
+    the first time."""
+    global _shared_sender
+    with _shared_lock:
+        if _shared_sender is None:
+            _shared_sender = MetadataSender()
+        return _shared_sender
+
+
+class MetadataQueue(object):
+    def __init__(self, send, mount, sender=None, debounce=0.5,
+                 retry=1.0, max_retry=30.0):
+        """Calls `send(metadata)` from `sender`, which should raise an
+        exception when it fails. `mount` is only used for logging and
+        metrics."""
+        super(MetadataQueue, self).__init__()
+        self.send = send
+        self.mount = mount
+        self.sender = sender if sender is not None else shared_sender()
+        self.debounce = debounce
+        self.retry = retry
+        self.max_retry = max_retry
+
+        self.lock = threading.Lock()
+        # : Newest metadata that still has to be sent, :const:`None` if none.
+        self.pending = None
+        # : Last metadata icecast accepted.
+        self.sent = None
+        # : Failed sends in a row.
+        self.failures = 0
+        self._scheduled = False
+
+    def put(self, metadata):
+        """Queues `metadata` to be sent, replacing anything not sent yet."""
+        with self.lock:
+            if metadata == self.pending or (self.pending is None and
+                                            metadata == self.sent):
+                metrics.metadata_updates.inc(mount=self.mount,
+                                             result='duplicate')
+                return
+            if self.pending is not None:
+                metrics.metadata_updates.inc(mount=self.mount,
+                                             result='coalesced')
+            self.pending = metadata
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.sender.schedule(self, self.debounce)
+
+    def clear(self):
+        """Forgets pending metadata and what was sent, for when the
+        connection to icecast is gone."""
+        with self.lock:
+            self.pending = None
+            self.sent = None
+            self.failures = 0
+
+    def resend(self):
+        """Sends the last metadata again right away, for a new connection.
+        Metadata waiting for a retry is sent right away as well."""
+        with self.lock:
+            if self.pending is None:
+                if self.sent is None:
+                    return
+                self.pending, self.sent = self.sent, None
+            self._scheduled = True
+        self.sender.schedule(self, 0.0)
+
+    def flush(self):
+        """Sends the pending metadata, called by :attr:`sender`."""
+        with self.lock:
+            self._scheduled = False
+            metadata, self.pending = self.pending, None
+        if metadata is None:
+            return
+        try:
+            self.send(metadata)
+        except Exception:
+            logger.exception("%s: Failed sending metadata.", self.mount)
+            metrics.metadata_updates.inc(mount=self.mount, result='failed')
+            with self.lock:
+                self.failures += 1
+                if self.pending is None:
+                    self.pending = metadata
+                if self._scheduled:
+                    return
+                self._scheduled = True
+                delay = min(self.max_retry,
+                            self.retry * 2 ** (self.failures - 1))
+            self.sender.schedule(self, delay)
+        else:
+            metrics.metadata_updates.inc(mount=self.mount, result='sent')
+            with self.lock:
+                self.sent = metadata
+                self.failures = 0
@@ -0,0 +1,94 @@
+"""Releases stream data to the upstream server at real time speed.
+
+A :class:`Pacer` works out how long the data it sees plays from the MP3
+frame headers or Ogg granule positions in it, and tells the caller how
+long to wait so we never run more than `lead` seconds ahead of real time.
+"""
+import time
+from . import frames
+
+
+class Pacer(object):
+    def __init__(self, format, lead=2.0, max_lag=2.0):
+        super(Pacer, self).__init__()
+        self.format = format
+        # : Seconds of audio we are allowed to send ahead of real time.
+        self.lead = lead
+        # : Seconds we can fall behind before the clock is restarted instead
+        # : of catching up by bursting.
+        self.max_lag = max_lag
+
+        self.started = None
+        self.position = 0.0
+
+        # : Bytes of the last frame or page counted that are still to come.
+        self.carry = 0
+        # : Last seen MP3 bitrate, used when we lose track of the frames.
+        self.bitrate = None
+        # : Mapping of Ogg stream serial to (samplerate, last granule).
+        self.ogg_streams = {}
+
+    def reset(self):
+        """Restarts the media clock and forgets partially seen frames."""
+        self.started = None
+        self.position = 0.0
+        self.carry = 0
+
+    def delay(self, data):
+        """Returns the amount of seconds to wait before sending `data`."""
+        now = time.time()
+        if (self.started is None or
+                now - (self.started + self.position) > self.max_lag):
+            # Start over rather than burst to catch up with real time.
+            self.started = now
+            self.position = 0.0
+        due = self.started + self.position - self.lead
+        self.position += self.duration(data)
+        return max(due - now, 0.0)
+
+    def duration(self, data):
+        """Returns how many seconds of audio are in `data`, which has to be
+        the continuation of the data passed in before."""
+        if self.format == frames.MP3:
+            return self._mp3_duration(data)
+        return self._ogg_duration(data)
+
+    def _mp3_duration(self, data):
+        duration = 0.0
+        position = self.carry
+        while position < len(data):
+            header = frames.parse_mp3_header(data, position)
+            if header is None:
+                # Lost track of the frames, estimate the gap by bitrate.
+                boundary = frames.find_boundary(data, frames.MP3, position + 1)
+                end = len(data) if boundary == -1 else boundary
+                if self.bitrate:
+                    duration += (end - position) * 8.0 / self.bitrate
+                position = end
+                continue
+            self.bitrate = header.bitrate
+            duration += float(header.samples) / header.samplerate
+            position += header.length
+        self.carry = position - len(data)
+        return duration
+
+    def _ogg_duration(self, data):
+        duration = 0.0
+        position = self.carry
+        while position < len(data):
+            page = frames.parse_ogg_header(data, position)
+            if page is None:
+                boundary = frames.find_boundary(data, frames.OGG, position + 1)
+                position = len(data) if boundary == -1 else boundary
+                continue
+            if page.header_type & 0x02:
+                # Beginning of a logical stream, it carries the samplerate.
+                self.ogg_streams[page.serial] = (
+                        frames.ogg_samplerate(data, position), 0)
+            samplerate, granule = self.ogg_streams.get(page.serial, (None, 0))
+            if page.granule >= 0 and samplerate:
+                duration += float(max(page.granule - granule, 0)) / samplerate
+                self.ogg_streams[page.serial] = (samplerate, page.granule)
+            position += page.length
+        self.carry = position - len(data)
+        return duration
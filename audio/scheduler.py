@@ -0,0 +1,91 @@
+"""Runs the upstream connections of many mounts on a few threads.
+
+Every :class:`audio.icecast.Icecast` handed to a :class:`Scheduler` has its
+:meth:`~audio.icecast.Icecast.step` method called whenever it is due, and
+tells us by its return value when it wants to be called again. Waiting for
+a reconnect or for the pacer doesn't take up a thread this way.
+"""
+import heapq
+import itertools
+import threading
+import time
+import logging
+
+
+logger = logging.getLogger('audio.scheduler')
+
+
+class Scheduler(object):
+    """A pool of `workers` threads stepping :class:`audio.icecast.Icecast`
+    objects from a heap of timers."""
+    def __init__(self, workers=2):
+        super(Scheduler, self).__init__()
+        self.lock = threading.Condition()
+        # : Heap of (due time, sequence, generation, icecast) tuples.
+        self.timers = []
+        self._sequence = itertools.count()
+        self._closed = False
+
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.run,
+                                      name="Icecast scheduler {:d}".format(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.timers)
+
+    def add(self, icecast, delay=0.0, generation=None):
+        """Calls `icecast.step` in `delay` seconds. The timer is dropped if
+        `icecast` was started or closed again in the meantime."""
+        if generation is None:
+            generation = icecast.generation
+        with self.lock:
+            heapq.heappush(self.timers, (time.time() + delay,
+                                         next(self._sequence),
+                                         generation, icecast))
+            self.lock.notify()
+
+    def close(self):
+        """Stops all worker threads, without closing the connections."""
+        with self.lock:
+            self._closed = True
+            self.lock.notify_all()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(5.0)
+
+    def run(self):
+        """Worker thread main loop."""
+        while True:
+            with self.lock:
+                while True:
+                    if self._closed:
+                        return
+                    if not self.timers:
+                        self.lock.wait()
+                        continue
+                    delay = self.timers[0][0] - time.time()
+                    if delay > 0:
+                        self.lock.wait(delay)
+                        continue
+                    _, _, generation, icecast = heapq.heappop(self.timers)
+                    break
+
+            # Another worker can still be stepping an earlier generation,
+            # the lock makes us wait for it.
+            with icecast.step_lock:
+                if generation != icecast.generation:
+                    # Restarted or closed since this was scheduled.
+                    continue
+                try:
+                    delay = icecast.step()
+                except Exception:
+                    logger.exception("Unhandled exception stepping %s.",
+                                     icecast.config.get('mount'))
+                    delay = icecast.connecting_timeout
+            if delay is not None:
+                self.add(icecast, delay, generation)
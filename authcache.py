@@ -0,0 +1,95 @@
+import os
+import hmac
+import time
+import hashlib
+import threading
+import collections
+
+
+class AuthCache(object):
+    """A size bounded cache of login results that expire after a while.
+
+    Entries are keyed by user, privilege and a keyed digest of the password
+    so plain passwords aren't kept around. Failed logins are cached as well
+    but expire after `negative_ttl` seconds instead of `ttl`, and are kept
+    apart up to `negative_size` of them, so a burst of bad logins can't push
+    out the good ones.
+    """
+    def __init__(self, size=1024, ttl=300.0, negative_ttl=10.0,
+                 negative_size=256):
+        super(AuthCache, self).__init__()
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.negative_size = negative_size
+
+        self.lock = threading.Lock()
+        # : Mapping of key to (result, expiry time), oldest used first.
+        self.entries = collections.OrderedDict()
+        # : Same for failed logins.
+        self.negative_entries = collections.OrderedDict()
+        self._secret = os.urandom(32)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, user, password, privilege):
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        digest = hmac.new(self._secret, password, hashlib.sha256).digest()
+        return (user, digest, privilege)
+
+    def get(self, user, password, privilege):
+        """Returns the cached login result, or :const:`None` if there is
+        no usable entry."""
+        key = self.key(user, password, privilege)
+        with self.lock:
+            for entries in (self.entries, self.negative_entries):
+                if key in entries:
+                    break
+            else:
+                self.misses += 1
+                return None
+            result, expires = entries.pop(key)
+            if expires < time.time():
+                self.misses += 1
+                return None
+            # Reinsert to mark it as most recently used.
+            entries[key] = (result, expires)
+            self.hits += 1
+            return result
+
+    def put(self, user, password, privilege, result):
+        key = self.key(user, password, privilege)
+        if result:
+            entries, size, ttl = self.entries, self.size, self.ttl
+        else:
+            entries, size, ttl = (self.negative_entries, self.negative_size,
+                                  self.negative_ttl)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.negative_entries.pop(key, None)
+            entries[key] = (result, time.time() + ttl)
+            while len(entries) > size:
+                entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user=None):
+        """Forgets all entries of `user`, or everything if `user` is
+        :const:`None`."""
+        with self.lock:
+            for entries in (self.entries, self.negative_entries):
+                if user is None:
+                    entries.clear()
+                    continue
+                for key in [key for key in entries if key[0] == user]:
+                    del entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries),
+                    'negative_size': len(self.negative_entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
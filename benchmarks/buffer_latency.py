@@ -0,0 +1,69 @@
+"""Measures the time between a :meth:`Buffer.write` and the moment a
+blocked reader returns the same data.
+
+Run from the repository root::
+
+    python -m benchmarks.buffer_latency --chunks 200 --interval 0.01
+"""
+import argparse
+import threading
+import time
+from buffers import Buffer
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(int(len(values) * fraction), len(values) - 1)
+    return values[index]
+
+
+def measure(buffer_class, chunks=200, chunk_size=4096, interval=0.01):
+    """Writes `chunks` blocks of `chunk_size` bytes every `interval` seconds
+    and returns a list with the write to read latency of each block."""
+    buffer = buffer_class(max_size=chunk_size * 16)
+    written = []
+    latencies = []
+
+    def reader():
+        for i in xrange(chunks):
+            data = buffer.read(chunk_size)
+            if len(data) != chunk_size:
+                break
+            latencies.append(time.time() - written[i])
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+
+    block = b'\x00' * chunk_size
+    for i in xrange(chunks):
+        time.sleep(interval)
+        written.append(time.time())
+        buffer.write(block)
+    thread.join(5.0)
+    buffer.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=200)
+    parser.add_argument('--chunk-size', type=int, default=4096)
+    parser.add_argument('--interval', type=float, default=0.01)
+    args = parser.parse_args()
+
+    latencies = measure(Buffer, args.chunks, args.chunk_size, args.interval)
+    if not latencies:
+        print "No data was read back."
+        return
+    print "{:s}.{:s}: {:d} reads".format(Buffer.__module__, Buffer.__name__,
+                                          len(latencies))
+    for name, value in (('min', min(latencies)),
+                        ('p50', percentile(latencies, 0.50)),
+                        ('p99', percentile(latencies, 0.99)),
+                        ('max', max(latencies))):
+        print "  {:s}: {:.3f} ms".format(name, value * 1000)
+
+
+if __name__ == '__main__':
+    main()
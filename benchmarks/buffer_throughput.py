@@ -0,0 +1,73 @@
+"""Measures the throughput of every importable :class:`Buffer`
+implementation.
+
+Run from the repository root::
+
+    python -m benchmarks.buffer_throughput --megabytes 64
+
+Implementations failing the conformance checks in :mod:`tests.test_buffers`
+are reported instead of measured, and make it exit with a non-zero status.
+"""
+import argparse
+import sys
+import threading
+import time
+import buffers
+from tests.test_buffers import conformance
+
+
+def throughput(buffer_class, megabytes=64, write_size=4096, read_size=8192):
+    """Pushes `megabytes` through a buffer with one writer and one reader
+    thread, returns a tuple of (MB/s, bytes lost).
+
+    The writer backs off while the buffer is more than half full so that
+    the result isn't dominated by overflowing implementations."""
+    total = megabytes * 1024 * 1024
+    max_size = 24 * 1024 * 2
+    buffer = buffer_class(max_size=max_size)
+    received = [0]
+
+    def reader():
+        while True:
+            data = buffer.read(read_size)
+            if not data:
+                break
+            received[0] += len(data)
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    start = time.time()
+    thread.start()
+    block = b'\x00' * write_size
+    for i in xrange(total // write_size):
+        while len(buffer) > max_size // 2:
+            time.sleep(0.0001)
+        buffer.write(block)
+    buffer.close()
+    thread.join()
+    elapsed = time.time() - start
+    return received[0] / elapsed / 1024 / 1024, total - received[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--megabytes', type=int, default=64)
+    args = parser.parse_args()
+
+    failed = False
+    for name, buffer_class in buffers.available():
+        failures = conformance(name, buffer_class)
+        if failures:
+            failed = True
+            print "{:s}: FAILED conformance".format(name)
+            for failure in failures:
+                print "  " + failure
+            continue
+        speed, lost = throughput(buffer_class, args.megabytes)
+        print "{:s}: {:.1f} MB/s, {:d} bytes lost".format(name, speed, lost)
+    print "Loaded by default: {:s}".format(buffers.Buffer.__module__)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""A stand-in for the admin interface of an icecast server.
+
+Answers `/admin/listclients` with a fixed client list over keep-alive
+HTTP/1.1 connections and counts requests and connections, so the proxy's
+passthrough can be exercised without a real icecast. Also used by
+`tests/test_adminclient.py`. Run from the repository root::
+
+    python -m benchmarks.fake_icecast --port 8000
+"""
+import argparse
+import socket
+import sys
+import threading
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+LISTCLIENTS = """<?xml version="1.0"?>
+<icestats><source mount="{mount:s}"><Listeners>{count:d}</Listeners>{listeners:s}</source></icestats>"""
+LISTENER = """<listener id="{id:d}"><IP>127.0.0.{id:d}</IP><UserAgent>fake</UserAgent><Connected>{id:d}</Connected></listener>"""
+
+
+class FakeAdminHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        url = urlparse.urlparse(self.path)
+        if url.path != '/admin/listclients':
+            self.send_error(404)
+            return
+        if self.headers.get('Authorization') is None:
+            self.send_response(401)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.server.delay:
+            threading.Event().wait(self.server.delay)
+        mount = urlparse.parse_qs(url.query).get('mount', ['/main'])[0]
+        body = LISTCLIENTS.format(mount=mount, count=self.server.listeners,
+                                  listeners=''.join(LISTENER.format(id=i)
+                                      for i in range(self.server.listeners)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.drop_idle:
+            # Like a server timing out an idle keep-alive connection, the
+            # client only notices on its next request.
+            self.close_connection = 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeIcecast(ThreadingMixIn, HTTPServer):
+    """Serves on `port` of localhost, 0 picks a free one, see
+    :attr:`port`. Every request takes `delay` seconds. With `drop_idle` set
+    connections are closed after every response without telling the
+    client."""
+    daemon_threads = True
+
+    def __init__(self, port=0, listeners=10, delay=0.0, drop_idle=False):
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeAdminHandler)
+        self.port = self.server_address[1]
+        self.listeners = listeners
+        self.delay = delay
+        self.drop_idle = drop_idle
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def start(self):
+        """Serves from a background thread until :meth:`shutdown`."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up waiting on a delayed response hang up.
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--listeners', type=int, default=10)
+    parser.add_argument('--delay', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeIcecast(args.port, args.listeners, args.delay)
+    print "Serving on port {:d}".format(server.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print "{:d} requests over {:d} connections".format(server.requests,
+                                                      server.connections)
+
+
+if __name__ == '__main__':
+    main()
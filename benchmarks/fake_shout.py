@@ -0,0 +1,130 @@
+"""An in-process stand-in for :mod:`pylibshout` that records what it gets.
+
+Install it with :func:`install` before anything imports :mod:`audio`, every
+:class:`Shout` then adds what is sent to it to the :class:`Sink` of its
+mount in :data:`sinks` instead of talking to an icecast server.
+"""
+import sys
+import struct
+import threading
+import time
+
+
+SHOUTERR_SUCCESS = 0
+SHOUTERR_INSANE = -1
+SHOUTERR_NOCONNECT = -2
+SHOUTERR_NOLOGIN = -3
+SHOUTERR_SOCKET = -4
+SHOUTERR_MALLOC = -5
+SHOUTERR_METADATA = -6
+SHOUTERR_CONNECTED = -7
+SHOUTERR_UNCONNECTED = -8
+SHOUTERR_UNSUPPORTED = -9
+SHOUTERR_BUSY = -10
+
+#: Marks a timestamp in the audio, see :func:`stamp`.
+MAGIC = b'\x00LOADTS\x00'
+STAMP_SIZE = len(MAGIC) + 8
+
+
+class ShoutException(Exception):
+    pass
+
+
+def stamp(when=None):
+    """Returns the bytes :class:`Sink` recognizes as the time `when` some
+    audio was sent, put them in the data part of a frame."""
+    return MAGIC + struct.pack('!d', time.time() if when is None else when)
+
+
+class Sink(object):
+    """Everything sent to one mount."""
+    def __init__(self, mount):
+        super(Sink, self).__init__()
+        self.mount = mount
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.sends = 0
+        self.first = None
+        self.last = None
+        # : Seconds between a :func:`stamp` and its arrival here.
+        self.latencies = []
+        self.metadata = []
+        self.connects = 0
+        # : Tail of the previous send, a stamp can be split over two.
+        self._tail = b''
+
+    def receive(self, data):
+        now = time.time()
+        with self.lock:
+            self.bytes += len(data)
+            self.sends += 1
+            if self.first is None:
+                self.first = now
+            self.last = now
+            data = self._tail + data
+            offset = data.find(MAGIC)
+            while offset != -1 and offset + STAMP_SIZE <= len(data):
+                sent, = struct.unpack('!d', data[offset + len(MAGIC):
+                                                 offset + STAMP_SIZE])
+                self.latencies.append(now - sent)
+                offset = data.find(MAGIC, offset + STAMP_SIZE)
+            self._tail = data[-(STAMP_SIZE - 1):]
+
+
+#: Mapping of mount to :class:`Sink`.
+sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def sink(mount):
+    with _sinks_lock:
+        if mount not in sinks:
+            sinks[mount] = Sink(mount)
+        return sinks[mount]
+
+
+class Shout(object):
+    def __init__(self, tag_fix=False):
+        super(Shout, self).__init__()
+        self.__dict__['_connected'] = False
+        self.__dict__['mount'] = None
+
+    def __setattr__(self, name, value):
+        if name == 'metadata':
+            if not self._connected:
+                raise ShoutException(SHOUTERR_UNCONNECTED, "Not connected")
+            sink(self.mount).metadata.append((time.time(), value))
+        self.__dict__[name] = value
+
+    def open(self):
+        if self._connected:
+            raise ShoutException(SHOUTERR_CONNECTED, "Already connected")
+        self.__dict__['_connected'] = True
+        target = sink(self.mount)
+        with target.lock:
+            target.connects += 1
+
+    def close(self):
+        if not self._connected:
+            raise ShoutException(SHOUTERR_UNCONNECTED, "Not connected")
+        self.__dict__['_connected'] = False
+
+    def connected(self):
+        return SHOUTERR_CONNECTED if self._connected else SHOUTERR_UNCONNECTED
+
+    def send(self, data):
+        if not self._connected:
+            raise ShoutException(SHOUTERR_UNCONNECTED, "Not connected")
+        sink(self.mount).receive(data)
+
+    def sync(self):
+        pass
+
+
+def install():
+    """Makes `import pylibshout` give this module, also from within the
+    :mod:`audio` package. Has to happen before :mod:`audio` is imported."""
+    module = sys.modules[__name__]
+    sys.modules['pylibshout'] = module
+    sys.modules['audio.pylibshout'] = module
@@ -0,0 +1,111 @@
+"""Measures how long starting the proxy takes, and which imports it spends
+that on, like `python -X importtime` does on newer Pythons.
+
+Every measurement runs in a fresh interpreter with `example_config.py` as
+config. It times `import server` and :func:`server.setup` and lists the
+slowest modules loaded, by cumulative and by self time. Exits with status 1
+when startup takes longer than `--budget` seconds.
+
+Run from the repository root::
+
+    python -m benchmarks.import_time --runs 5 --budget 1.0
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: Runs in the fresh interpreter, prints the results as JSON.
+CHILD = r'''
+import __builtin__, imp, json, os, sys, time
+root = sys.argv[1]
+sys.path.insert(0, root)
+imp.load_source('config', os.path.join(root, 'example_config.py'))
+
+real_import = __builtin__.__import__
+# Stack of [name, start, time spent in nested imports], one per import.
+stack = []
+records = []
+
+def timed_import(name, *args, **kwargs):
+    loaded = len(sys.modules)
+    stack.append([name, time.time(), 0.0])
+    try:
+        return real_import(name, *args, **kwargs)
+    finally:
+        name, start, nested = stack.pop()
+        total = time.time() - start
+        if stack:
+            stack[-1][2] += total
+        if len(sys.modules) > loaded:
+            records.append((name, len(stack), total - nested, total))
+
+__builtin__.__import__ = timed_import
+start = time.time()
+import server
+imported = time.time()
+__builtin__.__import__ = real_import
+server.setup()
+done = time.time()
+print json.dumps({'import': imported - start, 'setup': done - imported,
+                  'modules': records,
+                  'heavy': sorted(name for name in sys.argv[2:]
+                                  if name in sys.modules)})
+'''
+
+#: Modules that shouldn't be needed to start.
+HEAVY = ('bcrypt', 'MySQLdb', 'pylibshout', 'urllib2', 'cgi', 'httplib',
+         'multiprocessing.pool')
+
+
+def measure():
+    """Returns the results of starting once in a new interpreter."""
+    output = subprocess.check_output([sys.executable, '-c', CHILD, ROOT] +
+                                     list(HEAVY), cwd=ROOT)
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15,
+                        help="amount of modules to list")
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help="seconds startup may take at most")
+    args = parser.parse_args()
+
+    results = [measure() for i in xrange(args.runs)]
+    # Leave out the first run, it pays for cold disk caches.
+    steady = results[1:] or results
+    best = min(steady, key=lambda result: result['import'] + result['setup'])
+    worst = max(result['import'] + result['setup'] for result in steady)
+
+    print "import server: {:.1f} ms, setup(): {:.1f} ms (best of {:d})".format(
+            best['import'] * 1000, best['setup'] * 1000, len(steady))
+    print "  worst startup: {:.1f} ms, first run: {:.1f} ms".format(
+            worst * 1000, (results[0]['import'] + results[0]['setup']) * 1000)
+    print "  modules loaded by the import: {:d}".format(len(best['modules']))
+    if best['heavy']:
+        print "  loaded at startup but shouldn't be: {:s}".format(
+                ', '.join(best['heavy']))
+
+    for title, column in (('cumulative', 3), ('self', 2)):
+        print "slowest by {:s} time (self, cumulative):".format(title)
+        for record in sorted(best['modules'], key=lambda record: record[column],
+                             reverse=True)[:args.top]:
+            name, depth, own, total = record
+            print "  {:8.2f} ms {:8.2f} ms  {:s}{:s}".format(
+                    own * 1000, total * 1000, '  ' * depth, name)
+
+    if worst > args.budget:
+        print "Startup took longer than the budget of {:.1f} s.".format(
+                args.budget)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
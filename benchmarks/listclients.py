@@ -0,0 +1,56 @@
+"""Measures how many upstream requests and connections the listclients
+passthrough makes when many clients ask at once.
+
+Runs against :mod:`benchmarks.fake_icecast`, from the repository root::
+
+    python -m benchmarks.listclients --clients 16 --requests 50
+"""
+import argparse
+import threading
+import time
+from adminclient import AdminClient
+from benchmarks.fake_icecast import FakeIcecast
+
+
+def measure(clients=16, requests=50, delay=0.01, ttl=1.0, size=4):
+    """Has `clients` threads do `requests` listclients calls each, returns
+    the fake server, the client and the seconds it took."""
+    upstream = FakeIcecast(delay=delay).start()
+    admin = AdminClient('127.0.0.1', upstream.port, 'hackme',
+                        size=size, ttl=ttl)
+
+    def client():
+        for i in xrange(requests):
+            admin.get('/admin/listclients?mount=/main')
+
+    threads = [threading.Thread(target=client) for i in xrange(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    admin.close()
+    upstream.shutdown()
+    return upstream, admin, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--delay', type=float, default=0.01,
+                        help="seconds the fake server takes per request")
+    parser.add_argument('--ttl', type=float, default=1.0)
+    parser.add_argument('--pool-size', type=int, default=4)
+    args = parser.parse_args()
+
+    upstream, admin, elapsed = measure(args.clients, args.requests,
+                                       args.delay, args.ttl, args.pool_size)
+    print "{:d} requests in {:.3f} s".format(admin.requests, elapsed)
+    print "  upstream requests: {:d}".format(upstream.requests)
+    print "  upstream connections: {:d}".format(upstream.connections)
+
+
+if __name__ == '__main__':
+    main()
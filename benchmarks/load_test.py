@@ -0,0 +1,263 @@
+"""Runs the whole proxy against simulated sources and a fake icecast.
+
+Starts :func:`server.run` on localhost with :mod:`benchmarks.fake_shout`
+in place of libshout and logins that always succeed, then connects SOURCE
+clients sending MP3 at real time to a number of mounts while others send
+metadata updates and poll `/proxy`. The clients run in a separate process
+so the CPU use reported is that of the proxy alone.
+
+Run from the repository root, with the proxy's dependencies installed::
+
+    python -m benchmarks.load_test --mounts 8 --sources 2 --duration 20
+"""
+import argparse
+import base64
+import imp
+import multiprocessing
+import os
+import resource
+import socket
+import threading
+import time
+import urllib
+
+from benchmarks import fake_shout
+
+
+#: Bitrate index of MPEG 1 layer 3 frame headers, in kbps.
+BITRATES = {32: 1, 40: 2, 48: 3, 56: 4, 64: 5, 80: 6, 96: 7, 112: 8,
+            128: 9, 160: 10, 192: 11, 224: 12, 256: 13, 320: 14}
+FRAME_DURATION = 1152 / 44100.0
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(int(len(values) * fraction), len(values) - 1)
+    return values[index]
+
+
+def frame_size(bitrate):
+    return 144 * bitrate * 1000 // 44100
+
+
+def make_frame(bitrate):
+    """Returns a mono 44.1kHz MP3 frame of `bitrate` kbps, with a
+    :func:`fake_shout.stamp` in it."""
+    header = b'\xff\xfb' + chr(BITRATES[bitrate] << 4) + b'\xc4'
+    data = fake_shout.stamp()
+    return header + data + b'\x00' * (frame_size(bitrate) - 4 - len(data))
+
+
+def load_config(overrides):
+    """Makes `import config` give `example_config.py` with `overrides`."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = imp.load_source('config', os.path.join(root, 'example_config.py'))
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return config
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def auth(user):
+    return 'Basic ' + base64.b64encode('{:s}:hackme'.format(user))
+
+
+# Client side, runs in its own process.
+
+def source_client(port, mount, user, bitrate, duration, counts, lock):
+    """Sends `duration` seconds of MP3 frames at real time to `mount`."""
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall('SOURCE {:s} ICE/1.0\r\nAuthorization: {:s}\r\n'
+                 'ice-name: load test\r\nUser-Agent: load_test\r\n\r\n'
+                 .format(mount, auth(user)))
+    if not sock.recv(4096).startswith('HTTP/1.0 200'):
+        with lock:
+            counts['failed'] += 1
+        return
+    start = time.time()
+    frames = 0
+    try:
+        while time.time() - start < duration:
+            # Send a tenth of a second worth of frames at a time.
+            due = start + frames * FRAME_DURATION
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            chunk = b''.join(make_frame(bitrate) for i in range(4))
+            sock.sendall(chunk)
+            with lock:
+                counts['sent'] += len(chunk)
+            frames += 4
+    except socket.error:
+        with lock:
+            counts['failed'] += 1
+    finally:
+        sock.close()
+
+
+def http_get(port, path, user):
+    sock = socket.create_connection(('127.0.0.1', port))
+    try:
+        sock.sendall('GET {:s} HTTP/1.0\r\nAuthorization: {:s}\r\n\r\n'
+                     .format(path, auth(user)))
+        response = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            response.append(data)
+        return b''.join(response)
+    finally:
+        sock.close()
+
+
+def repeat(interval, duration, function, latencies, *args):
+    """Calls `function(*args)` every `interval` seconds for `duration`
+    seconds, recording how long each call took."""
+    end = time.time() + duration
+    while time.time() < end:
+        start = time.time()
+        try:
+            function(*args)
+        except socket.error:
+            pass
+        else:
+            latencies.append(time.time() - start)
+        time.sleep(max(0, interval - (time.time() - start)))
+
+
+def run_clients(port, args, results):
+    counts = {'sent': 0, 'failed': 0}
+    lock = threading.Lock()
+    metadata_latencies = []
+    proxy_latencies = []
+    threads = []
+    for mount in range(args.mounts):
+        for source in range(args.sources):
+            threads.append(threading.Thread(
+                    target=source_client,
+                    args=(port, '/load{:d}'.format(mount),
+                          'dj{:d}'.format(source), args.bitrate,
+                          args.duration, counts, lock)))
+        if args.metadata_interval:
+            path = '/admin/metadata?' + urllib.urlencode(
+                    {'mode': 'updinfo', 'mount': '/load{:d}'.format(mount),
+                     'song': 'load test {:d}'.format(mount)})
+            threads.append(threading.Thread(
+                    target=repeat,
+                    args=(args.metadata_interval, args.duration, http_get,
+                          metadata_latencies, port, path, 'dj0')))
+    for i in range(args.pollers):
+        threads.append(threading.Thread(
+                target=repeat,
+                args=(args.poll_interval, args.duration, http_get,
+                      proxy_latencies, port, '/proxy', 'admin')))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((counts, metadata_latencies, proxy_latencies))
+
+
+# Proxy side.
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mounts', type=int, default=4)
+    parser.add_argument('--sources', type=int, default=1,
+                        help="sources per mount, only the first one is live")
+    parser.add_argument('--bitrate', type=int, default=128,
+                        choices=sorted(BITRATES))
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--metadata-interval', type=float, default=1.0,
+                        help="seconds between metadata updates per mount, "
+                             "0 to send none")
+    parser.add_argument('--pollers', type=int, default=2,
+                        help="clients polling /proxy")
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--server-mode', default='threaded',
+                        choices=('threaded', 'eventloop'))
+    parser.add_argument('--pacing-lead', type=float, default=None,
+                        help="seconds icecast may be sent ahead of real "
+                             "time, leave out to send without pacing")
+    args = parser.parse_args()
+
+    port = free_port()
+    load_config({'server_address': '127.0.0.1', 'server_port': port,
+                 'server_mode': args.server_mode,
+                 'icecast_host': '127.0.0.1', 'icecast_format': 1,
+                 'pacing_lead': args.pacing_lead})
+    fake_shout.install()
+    import manager
+    import server
+    manager.IcyManager._check_login = lambda self, user, password, privilege: True
+    # Remember every source buffer to count what they dropped.
+    buffers = []
+    register_source = manager.IcyManager.register_source
+    def register(self, client):
+        buffers.append(client.buffer)
+        register_source(self, client)
+    manager.IcyManager.register_source = register
+
+    stop = threading.Event()
+    thread = threading.Thread(target=server.run,
+                              kwargs={'continue_running': stop})
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+    results = multiprocessing.Queue()
+    clients = multiprocessing.Process(target=run_clients,
+                                      args=(port, args, results))
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    clients.start()
+    counts, metadata_latencies, proxy_latencies = results.get()
+    elapsed = time.time() - start
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    clients.join()
+
+    dropped = sum(getattr(buffer, 'dropped_bytes', 0) for buffer in buffers)
+    stop.set()
+    thread.join(5.0)
+
+    received = sum(sink.bytes for sink in fake_shout.sinks.values())
+    latencies = []
+    for sink in fake_shout.sinks.values():
+        latencies.extend(sink.latencies)
+    cpu = (end_usage.ru_utime - usage.ru_utime +
+           end_usage.ru_stime - usage.ru_stime)
+    streams = args.mounts * args.sources
+
+    print "{:d} mounts, {:d} sources at {:d} kbps for {:.1f} s ({:s})".format(
+            args.mounts, streams, args.bitrate, elapsed, args.server_mode)
+    print "  sent: {:.1f} kB/s, received upstream: {:.1f} kB/s".format(
+            counts['sent'] / elapsed / 1024, received / elapsed / 1024)
+    print "  failed sources: {:d}, dropped bytes: {:d}".format(
+            counts['failed'], dropped)
+    print "  cpu: {:.1f}% total, {:.2f}% per stream".format(
+            cpu / elapsed * 100, cpu / elapsed * 100 / max(streams, 1))
+    for name, values in (('end to end', latencies),
+                         ('metadata request', metadata_latencies),
+                         ('/proxy request', proxy_latencies)):
+        if not values:
+            print "  {:s}: no samples".format(name)
+            continue
+        print "  {:s} ({:d}): p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms, " \
+              "max {:.1f} ms".format(name, len(values),
+                                     percentile(values, 0.50) * 1000,
+                                     percentile(values, 0.95) * 1000,
+                                     percentile(values, 0.99) * 1000,
+                                     max(values) * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,84 @@
-try:
-    from carray_buffer import Buffer
-except ImportError:
-    from jericho import Buffer
-    
-    
-__all__ = ['Buffer']
\ No newline at end of file
+"""Audio buffer implementations.
+
+:class:`Buffer` is the first implementation in :data:`PREFERENCE` that
+can be imported, the environment variable `ICECAST_PROXY_BUFFER` can be
+set to one of the names in there or in :data:`OPT_IN` to force a specific
+one. Run `python -m benchmarks.buffer_throughput` to compare them.
+"""
+import os
+import logging
+from overflow import BufferOverflow, DROP, BLOCK, DISCONNECT
+
+
+logger = logging.getLogger('buffers')
+
+#: Implementation module names, in order of preference.
+#: jericho measures faster than ring in `benchmarks.buffer_throughput`.
+PREFERENCE = ('jericho', 'ring')
+#: Implementations only used when forced with `ICECAST_PROXY_BUFFER`.
+#: carray_buffer polls while reading and has no `write_from`.
+OPT_IN = ('carray_buffer',)
+
+
+def load(name):
+    """Returns the :class:`Buffer` class of the implementation `name`,
+    raises :class:`ImportError` if it isn't available."""
+    if name not in PREFERENCE + OPT_IN:
+        raise ImportError("Unknown buffer implementation '{:s}'.".format(name))
+    module = __import__(name, globals(), locals(), ['Buffer'], 1)
+    return module.Buffer
+
+
+def available():
+    """Returns a list of `(name, Buffer)` tuples of all implementations
+    that can be imported."""
+    implementations = []
+    for name in PREFERENCE + OPT_IN:
+        try:
+            implementations.append((name, load(name)))
+        except ImportError:
+            pass
+    return implementations
+
+
+def _select():
+    forced = os.environ.get('ICECAST_PROXY_BUFFER')
+    if forced:
+        return load(forced)
+    # Not :func:`available`, that would import all of them.
+    for name in PREFERENCE:
+        try:
+            buffer_class = load(name)
+        except ImportError:
+            continue
+        logger.debug("Using '%s' buffer implementation.", name)
+        return buffer_class
+    raise ImportError("No buffer implementation available.")
+
+
+Buffer = _select()
+# Maps overflow policies :class:`Buffer` lacks to the class used instead.
+_fallbacks = {}
+
+
+def buffer_class(policy):
+    """Returns :class:`Buffer` if it supports the overflow policy `policy`,
+    otherwise the first implementation in :data:`PREFERENCE` that does."""
+    if policy in Buffer.overflow_policies:
+        return Buffer
+    if policy not in _fallbacks:
+        for name, implementation in available():
+            if name in PREFERENCE and policy in implementation.overflow_policies:
+                logger.warning("The '%s' buffer doesn't support the '%s' "
+                               "overflow policy, using '%s' instead.",
+                               Buffer.__module__, policy, name)
+                _fallbacks[policy] = implementation
+                break
+        else:
+            raise ValueError("No buffer implementation supports the '{!s}' "
+                             "overflow policy.".format(policy))
+    return _fallbacks[policy]
+
+
+__all__ = ['Buffer', 'buffer_class', 'BufferOverflow', 'DROP', 'BLOCK',
+           'DISCONNECT']
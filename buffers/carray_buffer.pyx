@@ -1,23 +1,48 @@
 from libc.stdlib cimport malloc, free
 from libc.string cimport memcpy
 from posix.unistd cimport usleep
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
 cimport openmp
 
 
+cdef double monotonic() nogil:
+    cdef timespec now
+    clock_gettime(CLOCK_MONOTONIC, &now)
+    return now.tv_sec + now.tv_nsec / 1000000000.0
+
+
 cdef class Buffer:
     cdef unsigned char * read_ptr, * write_ptr
     cdef int max_size, length
-    cdef int eof
+    cdef int _eof
     cdef unsigned char * buffer
     cdef unsigned char * out_buffer
     
     cdef openmp.omp_lock_t write_lock
     cdef openmp.omp_lock_t read_lock
     cdef openmp.omp_lock_t length_lock
-    def __cinit__(Buffer self, unsigned int max_size):
+
+    #: Amount of times a write didn't fit in the buffer.
+    cdef public long overflows
+    #: Amount of bytes overwritten because of overflows.
+    cdef public long dropped_bytes
+
+    #: Overflow policies we support, see `buffers.buffer_class`.
+    overflow_policies = ('drop',)
+
+    def __cinit__(Buffer self, unsigned int max_size, unsigned int deques=5,
+                  overflow='drop', boundary=None):
+        # Only the 'drop' policy of `buffers.overflow` is supported, and it
+        # drops at byte granularity so `boundary` is ignored.
+        if overflow != 'drop':
+            raise ValueError("carray_buffer only supports the 'drop' overflow policy.")
+        # Keep the same total capacity as the pure python buffers.
+        max_size = max_size * deques
         self.max_size = max_size
+        self.overflows = 0
+        self.dropped_bytes = 0
         self.length = 0
-        self.eof = 0
+        self._eof = 0
         
         cdef unsigned char * buffer = <unsigned char *>malloc(max_size * sizeof(char))
         self.buffer = buffer
@@ -40,6 +65,7 @@ cdef class Buffer:
         cdef unsigned int write_pos
         with nogil:
             if data_length > self.max_size:
+                self.dropped_bytes += data_length - self.max_size
                 data += data_length - self.max_size
                 data_length = self.max_size
                 
@@ -77,6 +103,9 @@ cdef class Buffer:
                 # The buffer is overflowing with data so we have to push the
                 # reader forwards. (and thus need to lock it)
                 openmp.omp_set_lock(&self.read_lock)
+
+                self.overflows += 1
+                self.dropped_bytes += self.length + data_length - self.max_size
                 
                 self.read_ptr = self.write_ptr
                 
@@ -97,25 +126,41 @@ cdef class Buffer:
             # end thread safety
             
             
-    def read(self, size):
-        if size > self.max_size:
+    def read(self, size=-1, timeout=None):
+        """Reads `size` bytes, blocking until they are available, the buffer
+        is closed or `timeout` seconds passed. A negative size reads at most
+        the whole buffer."""
+        cdef double wait = -1.0 if timeout is None else timeout
+        if size < 0 or size > self.max_size:
             size = self.max_size
-        return self.cread(size)
-        
-    cdef bytes cread(Buffer self, unsigned int size):
+        return self.cread(size, wait)
+
+    def read_into(self, buf, timeout=None):
+        """Reads into the writable buffer `buf` like :meth:`read` and returns
+        the amount of bytes copied."""
+        data = self.read(len(buf), timeout)
+        buf[0:len(data)] = data
+        return len(data)
+
+    cdef bytes cread(Buffer self, unsigned int size, double timeout):
         cdef unsigned int available_data = 0
         cdef unsigned int read_pos
         cdef unsigned char * out_buffer = self.out_buffer
-        if self.eof and self.length == 0:
+        cdef double deadline = 0.0
+        if self._eof and self.length == 0:
             # Quick fail here if we are already at end of file.
             return b''
-            
+
         with nogil:
-            while (self.length < size) and (not self.eof):
+            if timeout >= 0:
+                deadline = monotonic() + timeout
+            while (self.length < size) and (not self._eof):
+                if timeout >= 0 and monotonic() >= deadline:
+                    break
                 usleep(100)
-                
+
             if self.length < size:
-                # This means we got closed.
+                # This means we got closed or timed out.
                 # Reset ourself to the length so we don't go out of bounds.
                 size = self.length
             # thread safety
@@ -159,13 +204,17 @@ cdef class Buffer:
             
     def __len__(Buffer self):
         return self.length
+
+    property eof:
+        def __get__(Buffer self):
+            return self._eof != 0
         
     def __repr__(Buffer self):
         return "<Buffer size='{:d}' max_length='{:d}'>".format(self.length,
                                                                self.max_size)
         
     cpdef object close(Buffer self):
-        self.eof = 1
+        self._eof = 1
         
     def __dealloc__(Buffer self):
         free(<void *>self.buffer)
@@ -5,25 +5,59 @@ try:
 except ImportError:
     from StringIO import StringIO
 from collections import deque
-from time import sleep
-from . import chunks
+from time import time
+from . import overflow as policies
 
 
 MAX_BUFFER = 1024**2*16
 
+
+def chunks(iterable, size):
+    """Yields strings of at most `size` characters from `iterable`."""
+    iterator = iter(iterable)
+    while True:
+        chunk = ''.join(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 class Buffer(object):
-    def __init__(self, max_size=MAX_BUFFER, deques=5):
-        self.buffers = deque(maxlen=deques)
+    #: Overflow policies we support.
+    overflow_policies = policies.POLICIES
+
+    def __init__(self, max_size=MAX_BUFFER, deques=5,
+                 overflow=policies.DROP, boundary=None):
+        self.buffers = deque()
         self.max_size = max_size
+        # : Total amount of bytes we hold before `overflow` kicks in.
+        self.capacity = max_size * deques
+        self.overflow = policies.check_policy(overflow)
+        self.boundary = boundary
         self.lock = threading.Lock()
+        # : Notified whenever data is written or the buffer is closed.
+        self.not_empty = threading.Condition(self.lock)
+        # : Notified whenever data is read or the buffer is closed.
+        self.not_full = threading.Condition(self.lock)
         self.closing = False
         self.eof = False
         self.read_pos = 0
         self.write_pos = 0
+        self.length = 0
+
+        # : Amount of times a write didn't fit in the buffer.
+        self.overflows = 0
+        # : Amount of bytes dropped or refused because of overflows.
+        self.dropped_bytes = 0
+        # : Seconds writers spent waiting for room in the buffer.
+        self.blocked_time = 0.0
 
     def write(self, data):
-        self.lock.acquire()
-        try:
+        with self.not_empty:
+            if self.length + len(data) > self.capacity:
+                data = self._make_room(data)
+                if not data:
+                    return
             if not self.buffers:
                 self.buffers.append(StringIO())
                 self.write_pos = 0
@@ -34,56 +68,129 @@ class Buffer(object):
                 buffer = StringIO()
                 self.buffers.append(buffer)
             self.write_pos = buffer.tell()
-        finally:
-            self.lock.release()
+            self.length += len(data)
+            self.not_empty.notify_all()
+
+    def read(self, length=-1, timeout=None):
+        """Reads `length` bytes from the buffer, blocking until enough data
+        was written, the buffer got closed or `timeout` seconds passed.
 
-    def read(self, length=-1):
+        Returns less than `length` bytes on close or timeout, and an empty
+        string if nothing could be read at all. Check :attr:`eof` to tell
+        a timeout apart from the end of the stream.
+        """
         read_buf = StringIO()
         remaining = length
-        while True:
-            if not self.buffers and not self.eof:
-                sleep(0.5)
-            elif not self.buffers and self.eof:
-                return ''
-            else:
-                with self.lock:
-                    buffer = self.buffers[0]
-                    buffer.seek(self.read_pos)
-                    read_buf.write(buffer.read(remaining))
-                    self.read_pos = buffer.tell()
-                    if length == -1:
-                        # we did not limit the read, we exhausted the buffer, so delete it.
+        deadline = None if timeout is None else time() + timeout
+        with self.not_empty:
+            while True:
+                if not self.buffers:
+                    if self.eof:
+                        break
+                    if deadline is None:
+                        self.not_empty.wait()
+                    else:
+                        wait_time = deadline - time()
+                        if wait_time <= 0:
+                            break
+                        self.not_empty.wait(wait_time)
+                    continue
+                buffer = self.buffers[0]
+                buffer.seek(self.read_pos)
+                data = buffer.read(remaining)
+                read_buf.write(data)
+                self.length -= len(data)
+                self.not_full.notify_all()
+                self.read_pos = buffer.tell()
+                if length == -1:
+                    # we did not limit the read, we exhausted the buffer, so delete it.
+                    # keep reading from remaining buffers.
+                    del self.buffers[0]
+                    self.read_pos = 0
+                else:
+                    #we limited the read so either we exhausted the buffer or not:
+                    remaining = length - read_buf.tell()
+                    if remaining > 0:
+                        # exhausted, remove buffer, read more.
                         # keep reading from remaining buffers.
                         del self.buffers[0]
                         self.read_pos = 0
                     else:
-                        #we limited the read so either we exhausted the buffer or not:
-                        remaining = length - read_buf.tell()
-                        if remaining > 0:
-                            # exhausted, remove buffer, read more.
-                            # keep reading from remaining buffers.
-                            del self.buffers[0]
-                            self.read_pos = 0
-                        else:
-                            # did not exhaust buffer, but read all that was requested.
-                            # break to stop reading and return data of requested length.
-                            break
+                        # did not exhaust buffer, but read all that was requested.
+                        # break to stop reading and return data of requested length.
+                        break
         return read_buf.getvalue()
 
+    def read_into(self, buf, timeout=None):
+        """Reads into the writable buffer `buf` like :meth:`read` and returns
+        the amount of bytes copied."""
+        data = self.read(len(buf), timeout)
+        buf[0:len(data)] = data
+        return len(data)
+
     def __len__(self):
-        len = 0
-        with self.lock:
-            for buffer in self.buffers:
-                buffer.seek(0, 2)
-                if buffer == self.buffers[0]:
-                    len += buffer.tell() - self.read_pos
-                else:
-                    len += buffer.tell()
-            return len
+        return self.length
 
     def close(self):
-        self.eof = True
-        
+        with self.not_empty:
+            self.eof = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+    def _make_room(self, data):
+        """Internal method, should be called with :attr:`lock` held.
+
+        Applies the overflow policy for writing `data` and returns the
+        part of it that should still be written.
+        """
+        self.overflows += 1
+        if self.overflow == policies.BLOCK:
+            start = time()
+            while (self.length and not self.eof and
+                   self.length + len(data) > self.capacity):
+                self.not_full.wait()
+            self.blocked_time += time() - start
+            return '' if self.eof else data
+        elif self.overflow == policies.DISCONNECT:
+            self.dropped_bytes += len(data)
+            raise policies.BufferOverflow("Buffer overflow, refused to "
+                                          "write {:d} bytes.".format(len(data)))
+        if len(data) > self.capacity:
+            # Only the tail would survive anyway.
+            self.dropped_bytes += len(data) - self.capacity
+            data = data[len(data) - self.capacity:]
+        dropped = self._skip(self.length + len(data) - self.capacity)
+        if self.boundary is not None and self.buffers:
+            head = self.buffers[0].getvalue()
+            window = head[self.read_pos:self.read_pos + self.max_size]
+            dropped += self._skip(policies.boundary_offset(window,
+                                                           self.boundary))
+        self.dropped_bytes += dropped
+        return data
+
+    def _skip(self, size):
+        """Internal method, should be called with :attr:`lock` held.
+
+        Forgets the oldest `size` bytes and returns how many were dropped.
+        """
+        skipped = 0
+        while size > 0 and self.buffers:
+            buffer = self.buffers[0]
+            buffer.seek(0, 2)
+            available = buffer.tell() - self.read_pos
+            if available > size:
+                self.read_pos += size
+                skipped += size
+                break
+            del self.buffers[0]
+            self.read_pos = 0
+            size -= available
+            skipped += available
+        self.length -= skipped
+        if skipped:
+            self.not_full.notify_all()
+        return skipped
+
 class ChunkBuffer(object):
     def __init__(self, chunk_size=1024):
         super(ChunkBuffer, self).__init__()
@@ -0,0 +1,37 @@
+"""Overflow policies shared by the buffer implementations.
+
+A buffer overflows when its writer (a source client) is further ahead of
+its reader (the upstream icecast connection) than the buffer can hold.
+"""
+
+
+#: Drop the oldest data, on a frame boundary if the format is known.
+DROP = 'drop'
+#: Block the writer until the reader made room again.
+BLOCK = 'block'
+#: Refuse the write by raising :class:`BufferOverflow`.
+DISCONNECT = 'disconnect'
+
+POLICIES = (DROP, BLOCK, DISCONNECT)
+
+
+class BufferOverflow(IOError):
+    pass
+
+
+def check_policy(policy):
+    if policy not in POLICIES:
+        raise ValueError("Unknown overflow policy '{!s}'.".format(policy))
+    return policy
+
+
+def boundary_offset(data, boundary):
+    """Returns how many bytes at the start of `data` should be skipped to
+    land on the next frame boundary, 0 when `boundary` is :const:`None` or
+    no boundary could be found.
+
+    `boundary` is called with `data` and returns the offset of the first
+    boundary in it or -1, like :func:`audio.frames.find_boundary`."""
+    if boundary is None:
+        return 0
+    return max(boundary(data), 0)
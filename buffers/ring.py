@@ -0,0 +1,240 @@
+import threading
+from time import time
+from . import overflow as policies
+
+
+#: The ring is allocated up front, unlike jericho that only allocates what
+#: it holds, so the default is far below jericho's 16 MiB per deque.
+MAX_BUFFER = 64 * 1024
+
+
+class Buffer(object):
+    """A fixed capacity ring buffer backed by a single preallocated
+    :class:`bytearray`.
+
+    Has the same `write`, `read`, `close` and `__len__` interface as
+    :class:`buffers.jericho.Buffer` and holds up to `max_size * deques`
+    bytes. What happens when a write doesn't fit is decided by `overflow`,
+    one of the policies in :mod:`buffers.overflow`. `boundary` finds frame
+    boundaries, see :func:`buffers.overflow.boundary_offset`, so dropping
+    can happen on them, :const:`None` drops at any byte.
+    """
+    #: Overflow policies we support.
+    overflow_policies = policies.POLICIES
+
+    def __init__(self, max_size=MAX_BUFFER, deques=5,
+                 overflow=policies.DROP, boundary=None):
+        self.max_size = max_size
+        self.overflow = policies.check_policy(overflow)
+        self.boundary = boundary
+        self.capacity = max(max_size * deques, 1)
+        self.storage = bytearray(self.capacity)
+        self.view = memoryview(self.storage)
+        self.lock = threading.Lock()
+        # : Notified whenever data is written or the buffer is closed.
+        self.not_empty = threading.Condition(self.lock)
+        # : Notified whenever data is read or the buffer is closed.
+        self.not_full = threading.Condition(self.lock)
+        self.eof = False
+        # : Index in :attr:`storage` of the first unread byte.
+        self.read_pos = 0
+        # : Amount of unread bytes in :attr:`storage`.
+        self.length = 0
+
+        # : Amount of times a write didn't fit in the buffer.
+        self.overflows = 0
+        # : Amount of bytes dropped or refused because of overflows.
+        self.dropped_bytes = 0
+        # : Seconds writers spent waiting for room in the buffer.
+        self.blocked_time = 0.0
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return "<Buffer size='{:d}' capacity='{:d}'>".format(self.length,
+                                                              self.capacity)
+
+    def write(self, data):
+        """Copies `data`, which can be any object supporting the buffer
+        interface, into the ring."""
+        data = memoryview(data)
+        with self.not_empty:
+            if len(data) > self.capacity and self.overflow == policies.DROP:
+                # Only the tail would survive anyway.
+                self.overflows += 1
+                self.dropped_bytes += len(data) - self.capacity
+                data = data[len(data) - self.capacity:]
+            while len(data):
+                size = self._reserve(len(data))
+                if not size:
+                    # We got closed while blocking, nobody will read it.
+                    break
+                self._put(data[:size])
+                data = data[size:]
+                self.not_empty.notify_all()
+
+    def write_from(self, readinto, size=None):
+        """Lets `readinto` fill the ring directly, `readinto` is called with
+        a writable :class:`memoryview` of at most `size` bytes and should
+        return the amount of bytes it wrote, like :meth:`socket.recv_into`.
+
+        `size` is capped at the free space, the overflow policy only
+        applies when there is no room at all, since we can't know how much
+        `readinto` will write.
+
+        Returns the amount of bytes written. Only a single writer is
+        supported since the ring isn't locked while `readinto` runs.
+        """
+        with self.lock:
+            if size is None:
+                size = self.max_size
+            size = max(min(size, self.capacity), 1)
+            free = self.capacity - self.length
+            if free:
+                size = min(size, free)
+            size = self._reserve(size)
+            if not size:
+                return 0
+            write_pos = (self.read_pos + self.length) % self.capacity
+            size = min(size, self.capacity - write_pos)
+            region = self.view[write_pos:write_pos + size]
+
+        written = readinto(region) or 0
+
+        with self.not_empty:
+            if written:
+                # A reader can only have moved the read position forwards
+                # which doesn't touch the region we just wrote into.
+                self.length += written
+                self.not_empty.notify_all()
+        return written
+
+    def read(self, length=-1, timeout=None):
+        """Reads `length` bytes from the buffer, blocking until enough data
+        was written, the buffer got closed or `timeout` seconds passed.
+
+        Returns less than `length` bytes on close or timeout, and an empty
+        string if nothing could be read at all. Check :attr:`eof` to tell
+        a timeout apart from the end of the stream.
+        """
+        with self.not_empty:
+            size = self._wait_for(length, timeout)
+            data = self._peek(size)
+            self._discard(size)
+        return data
+
+    def read_into(self, buf, timeout=None):
+        """Reads into the writable buffer `buf`, blocking like :meth:`read`
+        until `len(buf)` bytes are available.
+
+        Returns the amount of bytes copied into `buf`.
+        """
+        buf = memoryview(buf)
+        with self.not_empty:
+            size = self._wait_for(len(buf), timeout)
+            start = self.read_pos
+            first = min(size, self.capacity - start)
+            buf[0:first] = self.view[start:start + first]
+            if first < size:
+                buf[first:size] = self.view[0:size - first]
+            self._discard(size)
+        return size
+
+    def close(self):
+        with self.not_empty:
+            self.eof = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+    def _wait_for(self, length, timeout):
+        """Internal method, should be called with :attr:`lock` held.
+
+        Waits until `length` bytes are available and returns the amount of
+        bytes that can be read, -1 waits for the buffer to be closed.
+        """
+        deadline = None if timeout is None else time() + timeout
+        while length < 0 or self.length < length:
+            if self.eof:
+                break
+            if deadline is None:
+                self.not_empty.wait()
+            else:
+                wait_time = deadline - time()
+                if wait_time <= 0:
+                    break
+                self.not_empty.wait(wait_time)
+        if length < 0:
+            return self.length
+        return min(length, self.length)
+
+    def _put(self, data):
+        """Internal method, should be called with :attr:`lock` held.
+
+        Copies `data` behind the unread data, it has to fit.
+        """
+        size = len(data)
+        write_pos = (self.read_pos + self.length) % self.capacity
+        first = min(size, self.capacity - write_pos)
+        self.view[write_pos:write_pos + first] = data[:first]
+        if first < size:
+            self.view[0:size - first] = data[first:]
+        self.length += size
+
+    def _reserve(self, size):
+        """Internal method, should be called with :attr:`lock` held.
+
+        Makes room for `size` bytes according to the overflow policy and
+        returns how many bytes can be written right now, 0 if the buffer
+        was closed while waiting for room.
+        """
+        free = self.capacity - self.length
+        if size <= free:
+            return size
+        self.overflows += 1
+        if self.overflow == policies.BLOCK:
+            start = time()
+            while self.length == self.capacity and not self.eof:
+                self.not_full.wait()
+            self.blocked_time += time() - start
+            if self.eof:
+                return 0
+            return min(size, self.capacity - self.length)
+        elif self.overflow == policies.DISCONNECT:
+            self.dropped_bytes += size
+            raise policies.BufferOverflow("Buffer overflow, refused to "
+                                          "write {:d} bytes.".format(size))
+        size = min(size, self.capacity)
+        dropped = size - free
+        self._discard(dropped)
+        if self.boundary is not None and self.length:
+            skip = policies.boundary_offset(self._peek(self.max_size),
+                                            self.boundary)
+            self._discard(skip)
+            dropped += skip
+        self.dropped_bytes += dropped
+        return size
+
+    def _peek(self, size):
+        """Internal method, should be called with :attr:`lock` held.
+
+        Returns a copy of at most `size` unread bytes without consuming them.
+        """
+        size = min(size, self.length)
+        start = self.read_pos
+        first = min(size, self.capacity - start)
+        data = self.view[start:start + first].tobytes()
+        if first < size:
+            data += self.view[0:size - first].tobytes()
+        return data
+
+    def _discard(self, size):
+        """Internal method, should be called with :attr:`lock` held.
+
+        Forgets the oldest `size` bytes of the buffer.
+        """
+        size = min(size, self.length)
+        self.read_pos = (self.read_pos + size) % self.capacity
+        self.length -= size
+        if size:
+            self.not_full.notify_all()
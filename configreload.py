@@ -0,0 +1,72 @@
+"""Reads :mod:`config` again while running, on SIGHUP.
+
+:func:`reload_config` updates the module in place and returns what changed,
+:func:`server.reconfigure` hands that to whatever uses the settings. Most
+settings are looked up when they are used and need nothing more, those in
+:data:`RESTART` are only read on startup.
+"""
+import os
+import imp
+import types
+import logging
+import config
+
+
+logger = logging.getLogger('server.configreload')
+
+#: Settings that only take effect after a restart.
+RESTART = frozenset(['server_mode', 'server_workers', 'server_processes',
+                     'icecast_workers', 'db_pool_size', 'db_pool_timeout',
+                     'db_pool_idle_timeout', 'db_pool_ping_interval',
+                     'align_frames', 'fallback_file', 'listener_buffer',
+                     'listener_burst', 'icecast_format'])
+
+
+def settings(module):
+    """Returns the settings in `module` as a dict."""
+    return dict((name, value) for name, value in vars(module).iteritems()
+                if not name.startswith('_') and
+                not isinstance(value, (types.ModuleType, types.FunctionType,
+                                       type)))
+
+
+def reload_config(log=True):
+    """Reads the config file again and updates :mod:`config` with it,
+    logging which settings changed if `log` is True.
+
+    Returns a dict mapping the name of every setting that changed to a
+    tuple of its old and new value, :const:`None` for a setting that was
+    added or removed. Nothing changes if the file fails to load."""
+    path = os.path.splitext(config.__file__)[0] + '.py'
+    # Loaded into a module of its own first, so nobody sees a half read
+    # config in the meantime.
+    fresh = imp.new_module('config')
+    fresh.__file__ = path
+    try:
+        execfile(path, vars(fresh))
+    except Exception:
+        logger.exception("Failed reloading %s, keeping the old config.", path)
+        return {}
+
+    old, new = settings(config), settings(fresh)
+    changes = {}
+    for name in set(old) | set(new):
+        if name not in new:
+            delattr(config, name)
+        elif name in old and old[name] == new[name]:
+            continue
+        else:
+            setattr(config, name, new[name])
+        changes[name] = (old.get(name), new.get(name))
+
+    if not log:
+        return changes
+    # Only names, the values include passwords.
+    for name in sorted(changes):
+        if name in RESTART:
+            logger.warning("config: %s changed, this takes a restart.", name)
+        else:
+            logger.info("config: %s changed.", name)
+    if not changes:
+        logger.info("config: Nothing changed.")
+    return changes
@@ -1,40 +1,231 @@
 import MySQLdb
 import MySQLdb.cursors
 import config
-from threading import current_thread
+import metrics
+import time
+import logging
+import threading
+import collections
+
+
+logger = logging.getLogger('server.database')
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """A bounded pool of MySQL connections.
+
+    At most `size` connections are open at once, :meth:`acquire` waits up to
+    `timeout` seconds for one to be returned when all are in use. Idle
+    connections are closed after `idle_timeout` seconds and pinged before
+    reuse if they weren't used for `ping_interval` seconds.
+    """
+    def __init__(self, size=4, timeout=5.0, idle_timeout=300.0,
+                 ping_interval=30.0):
+        super(ConnectionPool, self).__init__()
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+
+        self.lock = threading.Condition()
+        # : Deque of (connection, last used time), most recently used last.
+        self.idle = collections.deque()
+        # : Amount of connections open, both idle and checked out.
+        self.opened = 0
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.exhausted = 0
+        self.created = 0
+        self.reaped = 0
+        self.broken = 0
+
+    def connect(self):
+        return MySQLdb.connect(host=config.dbhost,
+                               user=config.dbuser,
+                               passwd=config.dbpassword,
+                               db=config.dbtable,
+                               charset='utf8',
+                               use_unicode=True)
+
+    def acquire(self):
+        """Checks out a connection, which should be given back with
+        :meth:`release`. Raises :class:`PoolExhausted` on timeout."""
+        start = time.time()
+        deadline = start + self.timeout
+        connection = None
+        with self.lock:
+            expired = self._reap()
+        # Closing can take a while on a bad network, don't hold the lock.
+        self._close_all(expired)
+        with self.lock:
+            while True:
+                if self.idle:
+                    connection, last_used = self.idle.pop()
+                    break
+                if self.opened < self.size:
+                    self.opened += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.exhausted += 1
+                    raise PoolExhausted("No database connection available "
+                                        "after {:.1f} seconds.".format(self.timeout))
+                self.lock.wait(remaining)
+            waited = time.time() - start
+            self.checkouts += 1
+            if waited > 0.001:
+                self.waits += 1
+                self.wait_time += waited
+
+        if connection is not None and time.time() - last_used > self.ping_interval:
+            try:
+                connection.ping()
+            except MySQLdb.Error:
+                logger.info("Discarding dead database connection.")
+                self._close(connection)
+                connection = None
+        if connection is None:
+            try:
+                connection = self.connect()
+            except:
+                with self.lock:
+                    self.opened -= 1
+                    self.lock.notify()
+                raise
+            with self.lock:
+                self.created += 1
+        return connection
+
+    def release(self, connection, broken=False):
+        """Returns a connection to the pool, a `broken` one is closed."""
+        if broken:
+            self._close(connection)
+            with self.lock:
+                self.opened -= 1
+                self.broken += 1
+                self.lock.notify()
+            return
+        with self.lock:
+            self.idle.append((connection, time.time()))
+            self.lock.notify()
+
+    def stats(self):
+        with self.lock:
+            return {'size': self.size,
+                    'open': self.opened,
+                    'idle': len(self.idle),
+                    'checkouts': self.checkouts,
+                    'waits': self.waits,
+                    'wait_time': self.wait_time,
+                    'exhausted': self.exhausted,
+                    'created': self.created,
+                    'reaped': self.reaped,
+                    'broken': self.broken}
+
+    def _reap(self):
+        """Internal method, should be called with :attr:`lock` held.
+
+        Removes connections that have been idle for too long from the pool
+        and returns them, to be closed with :meth:`_close_all` once the
+        lock is released."""
+        expired = []
+        cutoff = time.time() - self.idle_timeout
+        while self.idle and self.idle[0][1] < cutoff:
+            connection, _ = self.idle.popleft()
+            expired.append(connection)
+            self.opened -= 1
+            self.reaped += 1
+        return expired
+
+    def _close_all(self, connections):
+        for connection in connections:
+            self._close(connection)
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except MySQLdb.Error:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the :class:`ConnectionPool` shared by all cursors, it is
+    created from the config on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                    size=getattr(config, 'db_pool_size', 4),
+                    timeout=getattr(config, 'db_pool_timeout', 5.0),
+                    idle_timeout=getattr(config, 'db_pool_idle_timeout', 300.0),
+                    ping_interval=getattr(config, 'db_pool_ping_interval', 30.0))
+        return _pool
+
+
+def collect_metrics():
+    """Returns connection pool metrics for :mod:`metrics`."""
+    if _pool is None:
+        return []
+    stats = metrics.Gauge('icecast_proxy_db_pool',
+                          'Database connection pool statistics.', ('stat',))
+    for stat, value in _pool.stats().items():
+        stats.set(value, stat=stat)
+    return [stats]
+
+metrics.registry.add_collector(collect_metrics)
+
 
 class MySQLCursor:
-    """Return a connected MySQLdb cursor object"""
-    counter = 0
-    cache = {}
+    """Return a connected MySQLdb cursor object, the connection is checked
+    out of the shared :class:`ConnectionPool` for the duration of the
+    with statement."""
     def __init__(self, cursortype=MySQLdb.cursors.DictCursor, lock=None):
-        threadid = current_thread().ident
-        if (threadid in self.cache):
-            self.conn = self.cache[threadid]
-            self.conn.ping(True)
-        else:
-            self.conn = MySQLdb.connect(host=config.dbhost,
-                                user=config.dbuser,
-                                passwd=config.dbpassword,
-                                db=config.dbtable,
-                                charset='utf8',
-                                use_unicode=True)
-            self.cache[threadid] = self.conn
+        self.pool = get_pool()
         self.curtype = cursortype
         self.lock = lock
+
     def __enter__(self):
         if (self.lock != None):
             self.lock.acquire()
-        self.cur = self.conn.cursor(self.curtype)
+        try:
+            self.conn = self.pool.acquire()
+            try:
+                self.cur = self.conn.cursor(self.curtype)
+            except:
+                self.pool.release(self.conn, broken=True)
+                raise
+        except:
+            if (self.lock != None):
+                self.lock.release()
+            raise
         return self.cur
-        
+
     def __exit__(self, type, value, traceback):
-        self.cur.close()
-        self.conn.commit()
-        if (self.lock != None):
-            self.lock.release()
+        broken = type is not None and issubclass(type, MySQLdb.OperationalError)
+        try:
+            self.cur.close()
+            if type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        except MySQLdb.Error:
+            broken = True
+        finally:
+            self.pool.release(self.conn, broken=broken)
+            if (self.lock != None):
+                self.lock.release()
         return
-    
+
 class Log(object):
     def __init__(self, client):
         super(Log, self).__init__()
@@ -0,0 +1,111 @@
+"""A minimal single threaded event loop on top of :func:`select.poll`.
+
+Python 2 has neither :mod:`asyncio` nor :mod:`selectors`, this covers the
+little we need: readable callbacks, timers and waking the loop up from
+other threads.
+"""
+import os
+import fcntl
+import heapq
+import select
+import logging
+import itertools
+import collections
+import time
+import errno
+
+
+logger = logging.getLogger('eventloop')
+
+
+class EventLoop(object):
+    def __init__(self):
+        super(EventLoop, self).__init__()
+        self.poller = select.poll()
+        # : Mapping of file descriptor to the callback to run when readable.
+        self.handlers = {}
+        # : Heap of (deadline, sequence, callback, args) tuples.
+        self.timers = []
+        self.sequence = itertools.count()
+        # : Callbacks queued from other threads, see :meth:`call_soon_threadsafe`.
+        self.ready = collections.deque()
+
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        for fd in (self._wakeup_read, self._wakeup_write):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.add_reader(self._wakeup_read, self._drain_wakeup)
+
+    def add_reader(self, fd, callback):
+        """Calls `callback` without arguments whenever `fd` is readable.
+
+        Should only be called from the loop thread."""
+        self.handlers[fd] = callback
+        self.poller.register(fd, select.POLLIN | select.POLLPRI)
+
+    def remove_reader(self, fd):
+        """Stops watching `fd`. Should only be called from the loop thread."""
+        if self.handlers.pop(fd, None) is not None:
+            self.poller.unregister(fd)
+
+    def call_later(self, delay, callback, *args):
+        """Calls `callback(*args)` after `delay` seconds. Should only be
+        called from the loop thread."""
+        heapq.heappush(self.timers, (time.time() + delay,
+                                     next(self.sequence), callback, args))
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Calls `callback(*args)` on the loop thread as soon as possible,
+        this is safe to call from any thread."""
+        self.ready.append((callback, args))
+        try:
+            os.write(self._wakeup_write, b'\x00')
+        except OSError as err:
+            if err.errno != errno.EAGAIN:
+                raise
+
+    def run_once(self, timeout=None):
+        """Waits at most `timeout` seconds for events and dispatches them."""
+        if self.ready:
+            timeout = 0
+        elif self.timers:
+            until_timer = max(self.timers[0][0] - time.time(), 0)
+            timeout = until_timer if timeout is None else min(timeout, until_timer)
+
+        try:
+            events = self.poller.poll(None if timeout is None else timeout * 1000)
+        except select.error as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            events = []
+
+        for fd, event in events:
+            callback = self.handlers.get(fd)
+            if callback is not None:
+                self._run(callback, ())
+
+        while self.ready:
+            callback, args = self.ready.popleft()
+            self._run(callback, args)
+
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self.timers)
+            self._run(callback, args)
+
+    def close(self):
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+
+    def _run(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception("Exception in event loop callback.")
+
+    def _drain_wakeup(self):
+        try:
+            os.read(self._wakeup_read, 4096)
+        except OSError as err:
+            if err.errno != errno.EAGAIN:
+                raise
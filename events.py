@@ -0,0 +1,79 @@
+"""Broadcast of source and metadata changes to status consumers.
+
+Every change is published once to an :class:`EventLog`, consumers either
+wait on it from their own thread or register a listener to be called for
+each event. Recent events are kept so a consumer that reconnects with the
+id of the last event it saw doesn't miss anything.
+"""
+import json
+import time
+import threading
+import collections
+import logging
+
+
+logger = logging.getLogger('events')
+
+Event = collections.namedtuple('Event', ['id', 'type', 'data', 'time'])
+
+
+class EventLog(object):
+    def __init__(self, size=256):
+        super(EventLog, self).__init__()
+        self.condition = threading.Condition()
+        # : The last `size` events, oldest first.
+        self.events = collections.deque(maxlen=size)
+        self.last_id = 0
+        # : Callables that get each event, called from the publishing thread.
+        self.listeners = []
+
+    def publish(self, type, **data):
+        """Records an event of `type` with `data` and wakes up everyone
+        waiting for it. Returns the :class:`Event`."""
+        with self.condition:
+            self.last_id += 1
+            event = Event(self.last_id, type, data, time.time())
+            self.events.append(event)
+            self.condition.notify_all()
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Exception in event listener.")
+        return event
+
+    def since(self, last_id):
+        """Returns the kept events newer than `last_id`."""
+        with self.condition:
+            return [event for event in self.events if event.id > last_id]
+
+    def wait(self, last_id, timeout=None):
+        """Returns the events newer than `last_id`, waiting up to `timeout`
+        seconds for one if there are none yet."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.last_id <= last_id:
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return []
+                    self.condition.wait(remaining)
+            return self.since(last_id)
+
+    def add_listener(self, listener):
+        with self.condition:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.condition:
+            self.listeners.remove(listener)
+
+
+def format_sse(event):
+    """Returns `event` as a Server-Sent Events message."""
+    data = json.dumps(dict(event.data, time=event.time))
+    return 'id: {:d}\nevent: {:s}\ndata: {:s}\n\n'.format(event.id,
+                                                          event.type, data)
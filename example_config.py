@@ -7,24 +7,113 @@ dbuser = ''
 dbpassword = ''
 #: Database table to use as string
 dbtable = ''
+#: Maximum amount of open database connections
+db_pool_size = 4
+#: Seconds to wait for a free database connection
+db_pool_timeout = 5.0
+#: Seconds after which an unused database connection is closed
+db_pool_idle_timeout = 300.0
+#: Seconds of not being used after which a connection is pinged before use
+db_pool_ping_interval = 30.0
+
+#: Amount of login results to keep cached
+auth_cache_size = 1024
+#: Seconds a successful login is cached
+auth_cache_ttl = 300.0
+#: Seconds a failed login is cached
+auth_cache_negative_ttl = 10.0
+#: Amount of failed logins to keep cached, apart from the successful ones
+auth_cache_negative_size = 256
 
 
 #: Address to bind our listening socket on
 server_address = '0.0.0.0'
 #: Port to bind our listening socket on
 server_port = 1337
+#: How to handle connections, 'threaded' starts a thread per connection and
+#: 'eventloop' reads all sources on one thread and handles requests on a
+#: fixed pool of `server_workers` threads.
+server_mode = 'threaded'
+#: Amount of worker threads used by the 'eventloop' server mode.
+server_workers = 16
+#: Amount of processes when started with `python workers.py` instead of
+#: `python server.py`, the mounts are spread over them.
+server_processes = 4
+#: Level of the server and audio logs, like 'DEBUG' or 'INFO'
+logging_level = 'INFO'
 
 #: Icecast format this can either be 0 (for OGG) or 1 (for MP3)
 icecast_format = 1
 #: Icecast protocol to use can either be 0 (for HTTP), 1 (for XAUDIOCAST)
 #: or 2 (for ICY) (HTTP is the default icecast protocol)
 icecast_protocol = 0
+#: What to do when a source sends faster than icecast accepts and the buffer
+#: fills up. 'drop' drops the oldest audio on a frame boundary, 'block' stops
+#: reading from the source until there is room and 'disconnect' kicks the
+#: source.
+buffer_overflow = 'drop'
 #: Icecast password to use as string.
 icecast_pass = ''
 #: Icecast hostname as string
 icecast_host = 'stream.r-a-d.io'
 #: Icecast port as string
 icecast_port = 1130
+#: Other icecast servers or relays to send every mount to as well. Each is a
+#: dict with the `host`, `port`, `password`, `protocol` or `mount` that
+#: differ from the main server above, e.g. [{'host': 'backup.r-a-d.io'}].
+icecast_relays = []
+#: Bytes a relay may fall behind the others before it starts losing audio.
+relay_backlog = 512 * 1024
+#: Amount of idle keep-alive connections to the icecast admin interface,
+#: used to pass /admin/listclients through.
+admin_pool_size = 4
+#: Seconds to wait for the icecast admin interface.
+admin_timeout = 5.0
+#: Seconds that identical admin requests share one result.
+admin_cache_ttl = 1.0
+
+#: Only send whole MP3 frames or Ogg pages to icecast so switching between
+#: sources doesn't cut a frame in half.
+align_frames = True
+#: Seconds of audio we may send to icecast ahead of real time. A source that
+#: reconnects with a backlog is sent at real time speed after this instead of
+#: all at once. None sends everything as soon as it arrives.
+pacing_lead = None
+#: Seconds to keep the icecast connection open after the last source of a
+#: mount disconnected, a source connecting within that time continues the
+#: stream without icecast noticing. 0 disconnects right away.
+source_grace_period = 0
+#: MP3 or Ogg file (matching `icecast_format`) to loop during the grace
+#: period. If None MP3 mounts get silence and Ogg mounts get nothing.
+fallback_file = None
+#: Number of threads shared by the icecast connections of all mounts. Each
+#: connection is then nonblocking and only takes a thread while it has work
+#: to do. 0 gives every mount a thread of its own.
+icecast_workers = 0
+#: Bytes of audio kept per mount for listeners connecting to the proxy
+#: directly with a GET on the mount, 0 turns that off. Anyone who can reach
+#: the proxy can then listen, without logging in. Listeners falling further
+#: behind skip ahead, 1024 * 1024 is a good size.
+listener_buffer = 0
+#: Bytes of audio new listeners get right away so their player starts
+#: quickly.
+listener_burst = 64 * 1024
+#: Bytes of audio between ICY metadata blocks for listeners asking for them.
+listener_metaint = 16000
+#: Seconds to wait after a metadata update before sending it to icecast,
+#: updates arriving in the meantime replace it.
+metadata_debounce = 0.5
+#: Seconds to wait before reconnecting to icecast after a failure. Every
+#: next failure doubles it, up to `icecast_reconnect_max_delay`.
+icecast_reconnect_delay = 1.0
+icecast_reconnect_max_delay = 60.0
+#: Fraction of the reconnect delay that is randomly taken off, so mounts
+#: don't all reconnect at the same time.
+icecast_reconnect_jitter = 0.5
+#: Number of failed connects in a row after which we stop trying for
+#: `icecast_circuit_reset` seconds. 0 keeps trying forever.
+icecast_circuit_failures = 10
+icecast_circuit_reset = 300.0
 
 #: URL to send to icecast when connecting ourself.
 meta_url = 'https://r-a-d.io'
@@ -1,16 +1,24 @@
 import threading
+import time
 import config
 import collections
 import logging
-import bcrypt
+import metrics
 from buffers import Buffer
-from audio import icecast
-from database import MySQLCursor
+from audio import filler, frames, scheduler, backoff, fanout, broadcast, pacing
+from authcache import AuthCache
+import events
 
 
 logger = logging.getLogger('server.manager')
 STuple = collections.namedtuple('STuple', ['buffer', 'info'])
 ITuple = collections.namedtuple('ITuple', ['user', 'useragent', 'stream_name'])
+# : Snapshot of the mounts with sources at version `version`, see
+# : :meth:`IcyManager.snapshot`.
+Snapshot = collections.namedtuple('Snapshot', ['version', 'mounts'])
+MountState = collections.namedtuple('MountState', ['mount', 'sources'])
+SourceState = collections.namedtuple('SourceState', ['user', 'useragent',
+                                                     'stream_name', 'metadata'])
 
 
 def generate_info(mount):
@@ -25,15 +33,65 @@ def generate_info(mount):
             'mount': mount}
 
 
+#: Seconds without source audio for a mount that count as an underrun.
+UNDERRUN_GAP = 1.0
+
+#: Settings used by :func:`create_backoff`.
+BACKOFF_SETTINGS = ('icecast_reconnect_delay', 'icecast_reconnect_max_delay',
+                    'icecast_reconnect_jitter', 'icecast_circuit_failures',
+                    'icecast_circuit_reset')
+
+
+def create_backoff():
+    """Returns a :class:`audio.backoff.Backoff` set up from the config."""
+    return backoff.Backoff(
+            initial=getattr(config, 'icecast_reconnect_delay', 1.0),
+            maximum=getattr(config, 'icecast_reconnect_max_delay', 60.0),
+            jitter=getattr(config, 'icecast_reconnect_jitter', 0.5),
+            failures=getattr(config, 'icecast_circuit_failures', 10),
+            reset=getattr(config, 'icecast_circuit_reset', 300.0))
+
 
 class IcyManager(object):
     def __init__(self):
         super(IcyManager, self).__init__()
 
-        # : Lock to acquire when fetching a context object.
+        # : Lock to acquire when adding a context object. The dict itself is
+        # : never changed, a new one replaces it, so lookups need no lock.
         self.context_lock = threading.RLock()
         self.context = {}
 
+        # : Cache of recent login results, see :meth:`login`.
+        self.login_cache = AuthCache(
+                size=getattr(config, 'auth_cache_size', 1024),
+                ttl=getattr(config, 'auth_cache_ttl', 300.0),
+                negative_ttl=getattr(config, 'auth_cache_negative_ttl', 10.0),
+                negative_size=getattr(config, 'auth_cache_negative_size', 256))
+        metrics.registry.add_collector(self.collect_metrics)
+        # : Dropped bytes of every source buffer already added to
+        # : :data:`metrics.buffer_dropped_bytes`, see :meth:`count_dropped`.
+        self.counted_drops = {}
+        self.drops_lock = threading.Lock()
+
+        # : Source switches and metadata changes of all mounts.
+        self.events = events.EventLog()
+
+        # : Incremented whenever sources or their metadata change.
+        self.version = 0
+        self.version_lock = threading.Lock()
+        self._snapshot = None
+
+        # : The other worker processes, see :mod:`workers`, :const:`None`
+        # : when we're on our own.
+        self.peers = None
+
+        # : Shared by the upstream connections of all mounts, if configured
+        # : to, instead of a thread per mount.
+        self.scheduler = None
+        workers = getattr(config, 'icecast_workers', 0)
+        if workers > 0:
+            self.scheduler = scheduler.Scheduler(workers)
+
     def login(self, user=None, password=None, privilege=1):
         if user is None or password is None:
             return False
@@ -42,6 +100,21 @@ class IcyManager(object):
                 user, password = password.split('|')
             except ValueError as err:
                 return False
+        start = time.time()
+        result = self.login_cache.get(user, password, privilege)
+        cached = result is not None
+        if not cached:
+            result = self._check_login(user, password, privilege)
+            self.login_cache.put(user, password, privilege, result)
+        metrics.login_seconds.observe(time.time() - start,
+                                      cached='yes' if cached else 'no')
+        return result
+
+    def _check_login(self, user, password, privilege):
+        # Imported here so starting up doesn't wait for them, and nothing
+        # needs them before the first login that isn't cached.
+        import bcrypt
+        from database import MySQLCursor
         with MySQLCursor() as cur:
             cur.execute(("SELECT * FROM users WHERE user=%s "
                          "AND privileges>%s LIMIT 1;"),
@@ -52,37 +125,161 @@ class IcyManager(object):
                     return True
             return False
 
+    def invalidate_login(self, user=None):
+        """Forgets cached logins of `user`, or of everyone if `user` is
+        :const:`None`. Call this after changing passwords or privileges."""
+        self.login_cache.invalidate(user)
+        if self.peers is not None:
+            self.peers.share_invalidate(user)
+
+    def reconfigure(self, changes):
+        """Applies the settings in `changes`, a dict as returned by
+        :func:`configreload.reload_config`, to the login cache and all
+        mounts."""
+        cache = self.login_cache
+        cache.size = getattr(config, 'auth_cache_size', 1024)
+        cache.ttl = getattr(config, 'auth_cache_ttl', 300.0)
+        cache.negative_ttl = getattr(config, 'auth_cache_negative_ttl', 10.0)
+        cache.negative_size = getattr(config, 'auth_cache_negative_size', 256)
+        for context in self.context.values():
+            with context:
+                context.reconfigure(changes)
+
+    def collect_metrics(self):
+        """Returns buffer and login cache metrics for :mod:`metrics`."""
+        fill = metrics.Gauge('icecast_proxy_buffer_bytes',
+                             'Unread bytes in a source buffer.',
+                             ('mount', 'user'))
+        for context in self.context.values():
+            for source in context.sources:
+                fill.set(len(source.buffer), mount=context.mount,
+                         user=source.info.user)
+                self.count_dropped(context.mount, source.buffer)
+
+        listeners = metrics.Gauge('icecast_proxy_listeners',
+                                  'Listeners connected to the proxy itself.',
+                                  ('mount',))
+        for context in self.context.values():
+            if context.broadcast is not None:
+                listeners.set(context.broadcast.listeners, mount=context.mount)
+
+        cache = metrics.Gauge('icecast_proxy_login_cache',
+                              'Login cache statistics.', ('stat',))
+        for stat, value in self.login_cache.stats().items():
+            cache.set(value, stat=stat)
+        return [fill, listeners, cache]
+
+    def count_dropped(self, mount, buffer, gone=False):
+        """Adds what `buffer` dropped since the last call to
+        :data:`metrics.buffer_dropped_bytes`, so the counter keeps the drops
+        of sources that left. `gone` forgets the buffer afterwards."""
+        with self.drops_lock:
+            if buffer not in self.counted_drops:
+                # Removed in the meantime, that counted everything.
+                return
+            dropped = getattr(buffer, 'dropped_bytes', 0)
+            counted = self.counted_drops[buffer]
+            if gone:
+                del self.counted_drops[buffer]
+            else:
+                self.counted_drops[buffer] = dropped
+        if dropped > counted:
+            metrics.buffer_dropped_bytes.inc(dropped - counted, mount=mount)
+
+    def changed(self):
+        """Marks the current :meth:`snapshot` as outdated."""
+        with self.version_lock:
+            self.version += 1
+        if self.peers is not None:
+            self.peers.changed()
+
+    def snapshot(self):
+        """Returns a :class:`Snapshot` of the mounts that have sources,
+        including those of :attr:`peers`."""
+        snapshot = self.local_snapshot()
+        if self.peers is not None:
+            snapshot = self.peers.merge(snapshot)
+        return snapshot
+
+    def local_snapshot(self):
+        """Returns a :class:`Snapshot` of the mounts of this process that
+        have sources, it is only rebuilt after :meth:`changed` was called."""
+        snapshot = self._snapshot
+        version = self.version
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        mounts = []
+        for mount, context in sorted(self.context.items()):
+            sources = tuple(SourceState(source.info.user,
+                                        source.info.useragent,
+                                        source.info.stream_name,
+                                        context.saved_metadata.get(source, u''))
+                            for source in context.sources)
+            if sources:
+                mounts.append(MountState(mount, sources))
+        # Tagged with the version from before we looked, a change while we
+        # were busy makes the next call build a new one.
+        snapshot = Snapshot(version, tuple(mounts))
+        self._snapshot = snapshot
+        return snapshot
+
+    def mount_format(self, mount):
+        """Returns the `icecast_format` of `mount`, that of the config if
+        we don't have the mount yet."""
+        context = self.context.get(mount)
+        if context is None:
+            return config.icecast_format
+        return context.format
+
     def register_source(self, client):
         """Register a connected icecast source to be used for streaming to
         the main server."""
-        with self.context_lock:
-            try:
-                context = self.context[client.mount]
-            except KeyError:
-                context = IcyContext(client.mount)
-                self.context[client.mount] = context
+        context = self.context.get(client.mount)
+        if context is None:
+            with self.context_lock:
+                context = self.context.get(client.mount)
+                if context is None:
+                    context = IcyContext(client.mount, self.scheduler,
+                                         self.events)
+                    contexts = dict(self.context)
+                    contexts[client.mount] = context
+                    self.context = contexts
+        with self.drops_lock:
+            self.counted_drops[client.buffer] = 0
         with context:
             context.append(client)
-            if not context.icecast.connected():
+            self.changed()
+            if not context.icecast_running():
                 context.start_icecast()
 
     def remove_source(self, client):
         """Removes a connected icecast source from the list of tracked
         sources to be used for streaming."""
-        with self.context_lock:
-            try:
-                context = self.context[client.mount]
-            except KeyError:
-                # We can be sure there is no source when the mount is unknown
-                return
+        try:
+            context = self.context[client.mount]
+        except KeyError:
+            # We can be sure there is no source when the mount is unknown
+            return
         with context:
+            remaining = [source for source in context.sources
+                         if source.buffer is not client.buffer]
+            grace = (not remaining and context.grace_period > 0 and
+                     context.icecast_connected())
+            if grace:
+                # Keep the upstream connection for a bit so a reconnecting
+                # source can pick up where it left. This has to happen
+                # before the source is gone or the feed could see an EOF.
+                context.start_grace()
             try:
                 context.remove(client)
+                self.count_dropped(client.mount, client.buffer, gone=True)
             except ValueError:
                 # Source isn't in the sources list?
                 logger.warning('An unknown source tried to be removed. Logic error')
             finally:
-                if not context.sources:
+                self.changed()
+                if not context.sources and not grace:
                     context.stop_icecast()
 
     def send_metadata(self, metadata, client):
@@ -90,6 +287,7 @@ class IcyManager(object):
         :class:`IcyContext`: class."""
         try:
             self.context[client.mount].send_metadata(metadata, client)
+            self.changed()
         except KeyError:
             logger.info("Received metadata for non-existant mountpoint %s",
                         client.mount)
@@ -97,12 +295,15 @@ class IcyManager(object):
 
 class IcyContext(object):
     """A class that is the context of a single icecast mountpoint."""
-    def __init__(self, mount):
+    def __init__(self, mount, scheduler=None, events=None):
         super(IcyContext, self).__init__()
+        # : :class:`events.EventLog` told about source and metadata changes.
+        self.events = events
         # : Set to last value returned by :attr:`source`:
         self.current_source = None
 
-        # Threading sync lock
+        # Threading sync lock, held while changing :attr:`sources` and
+        # starting or stopping icecast. Readers don't need it.
         self.lock = threading.RLock()
 
         # Create a buffer that always returns an empty string (EOF)
@@ -110,14 +311,137 @@ class IcyContext(object):
         self.eof_buffer.close()
 
         self.mount = mount
-        # : Deque of tuples of the format STuple(source, ITuple(user, useragent, stream_name))
-        self.sources = collections.deque()
-
-        self.icecast_info = generate_info(mount)
-        self.icecast = icecast.Icecast(self, self.icecast_info)
+        # : The `icecast_format` of the mount, it keeps the one it was
+        # : created with until a restart.
+        self.format = config.icecast_format
+        # : Tuple of tuples of the format STuple(source, ITuple(user, useragent, stream_name))
+        # : it is replaced instead of changed, so a reference to it is a
+        # : consistent snapshot of the sources.
+        self.sources = ()
+
+        self.scheduler = scheduler
+        # : Shares our audio between the upstreams when there are several,
+        # : :const:`None` otherwise.
+        self.fanout = None
+        # : One :class:`icecast.Icecast` per upstream server, the first one
+        # : is the main server.
+        self.icecasts = []
+        self.create_upstreams()
+        # : Set when the relays changed while we were streaming, the
+        # : upstreams are created again on the next start.
+        self.stale_upstreams = False
+
+        # : What we send upstream, for listeners connecting to us directly,
+        # : :const:`None` if disabled.
+        self.broadcast = None
+        size = getattr(config, 'listener_buffer', 0)
+        if size > 0:
+            self.broadcast = broadcast.Broadcast(
+                                    mount, size,
+                                    getattr(config, 'listener_burst', 64 * 1024),
+                                    self.format)
 
         self.saved_metadata = {}
 
+        # : Splits the current source into whole frames so that switching
+        # : sources never cuts a frame in half, :const:`None` if disabled.
+        self.scanner = None
+        if getattr(config, 'align_frames', True):
+            self.scanner = frames.FrameScanner(self.format)
+        # : Time :meth:`read` last got audio from a source, and whether the
+        # : gap since then was counted as an underrun already.
+        self.last_audio = None
+        self.starved = False
+
+        # : Seconds to keep the upstream connection after the last source left.
+        self.grace_period = getattr(config, 'source_grace_period', 0)
+        # : Filler audio sent during the grace period, can be :const:`None`.
+        self.fallback = None
+        if self.grace_period > 0:
+            self.fallback = filler.create_feed(
+                                    getattr(config, 'fallback_file', None),
+                                    self.format, self.scanner)
+        # : Time at which the current grace period ends, if any.
+        self.grace_until = None
+        # : Notified when a source is appended.
+        self.source_added = threading.Condition()
+
+    def upstream_infos(self):
+        """Returns the settings of the main server and every relay in the
+        config, in that order."""
+        main = generate_info(self.mount)
+        main['format'] = self.format
+        infos = [main]
+        for relay in getattr(config, 'icecast_relays', None) or []:
+            info = dict(main)
+            info.update(relay)
+            infos.append(info)
+        return infos
+
+    def create_upstreams(self):
+        """Creates :attr:`icecasts` and :attr:`fanout` from the config,
+        should only be called while they aren't running."""
+        # Imported here so pylibshout isn't loaded before the first source.
+        from audio import icecast
+
+        infos = self.upstream_infos()
+        self.icecast_info = infos[0]
+        self.fanout = None
+        if len(infos) > 1:
+            self.fanout = fanout.FanOut(self,
+                                        getattr(config, 'relay_backlog', 512 * 1024))
+        icecasts = []
+        for info in infos:
+            if self.fanout is None:
+                source = self
+            else:
+                source = self.fanout.branch('{:s}:{:d}'.format(info['host'],
+                                                               info['port']))
+            icecasts.append(icecast.Icecast(source, info,
+                                       pacing_lead=getattr(config, 'pacing_lead', None),
+                                       scheduler=self.scheduler,
+                                       backoff=create_backoff(),
+                                       metadata_debounce=getattr(config, 'metadata_debounce', 0.5)))
+        self.icecasts = icecasts
+        self.icecast = icecasts[0]
+
+    def reconfigure(self, changes):
+        """Applies the settings in `changes`, a dict as returned by
+        :func:`configreload.reload_config`, with :attr:`lock` held.
+
+        Only upstreams whose connection settings changed reconnect. Adding
+        or removing relays waits until the mount is idle."""
+        if 'source_grace_period' in changes:
+            self.grace_period = getattr(config, 'source_grace_period', 0)
+            if self.grace_period > 0 and self.fallback is None:
+                self.fallback = filler.create_feed(
+                                        getattr(config, 'fallback_file', None),
+                                        self.format, self.scanner)
+        infos = self.upstream_infos()
+        if len(infos) != len(self.icecasts) or 'relay_backlog' in changes:
+            if self.icecast_running():
+                logger.info("%s: Relays changed, they are updated once the "
+                            "mount is idle.", self.mount)
+                self.stale_upstreams = True
+            else:
+                self.create_upstreams()
+                return
+        new_backoff = any(name in changes for name in BACKOFF_SETTINGS)
+        lead = getattr(config, 'pacing_lead', None)
+        for upstream, info in zip(self.icecasts, infos):
+            if info != upstream.config:
+                upstream.reconfigure(info)
+            upstream.metadata.debounce = getattr(config, 'metadata_debounce', 0.5)
+            if lead is None:
+                upstream.pacer = None
+            elif upstream.pacer is None:
+                upstream.pacer = pacing.Pacer(self.format, lead=lead)
+            else:
+                upstream.pacer.lead = lead
+            if new_backoff:
+                upstream.backoff = create_backoff()
+        self.icecast_info = infos[0]
+
     def __enter__(self):
         self.lock.acquire()
 
@@ -131,7 +455,8 @@ class IcyContext(object):
                                                                 )
 
     def append(self, source):
-        """Append a source client to the list of sources for this context."""
+        """Append a source client to the list of sources for this context,
+        with :attr:`lock` held."""
         source_tuple = STuple(source.buffer, ITuple(source.user,
                                                     source.useragent,
                                                     source.stream_name))
@@ -139,13 +464,17 @@ class IcyContext(object):
                                            source=repr(source_tuple),
                                            context=repr(self),
                                            ))
-        self.sources.append(source_tuple)
+        self.sources = self.sources + (source_tuple,)
         logger.debug("Current sources are '{sources:s}'.".format(
                                               sources=repr(self.sources))
                                               )
+        with self.source_added:
+            self.grace_until = None
+            self.source_added.notify_all()
 
     def remove(self, source):
-        """Remove a source client of the list of sources for this context."""
+        """Remove a source client of the list of sources for this context,
+        with :attr:`lock` held."""
         source_tuple = STuple(source.buffer, ITuple(source.user,
                                                     source.useragent,
                                                     source.stream_name))
@@ -153,7 +482,11 @@ class IcyContext(object):
                                            source=repr(source_tuple),
                                            context=repr(self),
                                            ))
-        self.sources.remove(source_tuple)
+        if source_tuple not in self.sources:
+            raise ValueError("Unknown source.")
+        self.sources = tuple(source for source in self.sources
+                             if source != source_tuple)
+        self.saved_metadata.pop(source_tuple, None)
         logger.debug("Current sources are '{sources:s}'.".format(
                                               sources=repr(self.sources))
                                               )
@@ -163,9 +496,12 @@ class IcyContext(object):
 
     @property
     def source(self):
-        """Returns the first source in the :attr:`sources` deque.
+        """Returns the first source in the :attr:`sources` tuple.
         
         If :attr:`sources` is empty it returns :const:`None` instead
+
+        This is only used by whoever feeds icecast, which is the only one
+        changing :attr:`current_source` while it runs.
         """
         try:
             source = self.sources[0]
@@ -174,6 +510,11 @@ class IcyContext(object):
             return None
         else:
             if not self.current_source is source:
+                metrics.source_switches.inc(mount=self.mount)
+                if self.scanner is not None:
+                    # Drop the partial frame of the old source, if any, and
+                    # look for the first frame boundary of the new one.
+                    self.scanner.reset()
                 logger.info("%s: Changing source from '%s' to '%s'.",
                             self.mount, 'None' if self.current_source is None \
                                         else self.current_source.info.user,
@@ -181,31 +522,141 @@ class IcyContext(object):
                 # We changed source sir. Send saved metadata if any.
                 if source in self.saved_metadata:
                     metadata = self.saved_metadata[source]
-                    self.icecast.set_metadata(metadata)
                 else:
                     # No saved metadata, send an empty one
-                    self.icecast.set_metadata(u'')
+                    metadata = u''
+                self.set_metadata(metadata)
+                if self.events is not None:
+                    self.events.publish('source', mount=self.mount,
+                                        user=source.info.user,
+                                        stream_name=source.info.stream_name,
+                                        metadata=metadata)
             self.current_source = source
             return source.buffer
 
+    def set_metadata(self, metadata):
+        """Passes `metadata` on to our upstreams and listeners."""
+        for upstream in self.icecasts:
+            upstream.set_metadata(metadata)
+        if self.broadcast is not None:
+            self.broadcast.set_metadata(metadata)
+
     def read(self, size=4096, timeout=None):
-        """Reads at most :obj:`size`: of bytes from the first source in the
-        :attr:`sources`: deque. 
-        
-        :obj:`timeout`: is unused in this implementation."""
+        """Reads about :obj:`size`: of bytes from the first source in the
+        :attr:`sources`: tuple. With :attr:`scanner` enabled this returns
+        whole MP3 frames or Ogg pages only, so it can be a bit more or
+        less than :obj:`size`.
+
+        :obj:`timeout`: is the amount of seconds to wait for data before
+        giving up, :const:`None` waits until data or EOF arrives. An empty
+        string is returned when the timeout expires without any data.
+
+        When the last source left less than :attr:`grace_period` seconds ago
+        this returns :attr:`fallback` audio, or waits for a new source if
+        there is none, instead of EOF.
+
+        Whatever this returns goes to :attr:`broadcast` as well."""
+        data = self._read(size, timeout)
+        self._check_underrun(bool(data) and bool(self.sources))
+        if self.broadcast is not None:
+            if data:
+                self.broadcast.write(data)
+            elif self.eof:
+                self.broadcast.close()
+        return data
+
+    def _check_underrun(self, live):
+        """Internal method
+
+        Counts an underrun once per gap of more than :data:`UNDERRUN_GAP`
+        seconds between reads that got audio from a source, `live` tells
+        if the last one did. Filler audio doesn't count, a mount without
+        sources and grace period has ended and isn't starving."""
+        now = time.time()
+        gap = (self.last_audio is not None and
+               now - self.last_audio > UNDERRUN_GAP)
+        if live:
+            if gap and not self.starved:
+                # A blocking read that only noticed when the data came.
+                metrics.underruns.inc(mount=self.mount)
+            self.last_audio = now
+            self.starved = False
+        elif self.eof:
+            self.last_audio = None
+            self.starved = False
+        elif gap and not self.starved:
+            metrics.underruns.inc(mount=self.mount)
+            self.starved = True
+
+    def _read(self, size, timeout):
+        """Internal method
+
+        Does the reading for :meth:`read`."""
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            data = self._read_sources(size, deadline)
+            if data or self.sources:
+                return data
+            # We have no sources left, see if we're in a grace period.
+            with self.source_added:
+                grace_until = self.grace_until
+                if grace_until is None or grace_until <= time.time():
+                    if grace_until is not None:
+                        logger.info("%s: Grace period over.", self.mount)
+                        self.grace_until = None
+                    return b''
+                if self.fallback is None:
+                    # Nothing to fill the gap with, wait for a source.
+                    wait_until = grace_until
+                    if deadline is not None:
+                        wait_until = min(wait_until, deadline)
+                    self.source_added.wait(max(wait_until - time.time(), 0))
+            if self.fallback is not None:
+                if deadline is None:
+                    return self.fallback.read(size)
+                return self.fallback.read(size,
+                                          max(deadline - time.time(), 0))
+            if deadline is not None and deadline <= time.time():
+                return b''
 
+    @property
+    def eof(self):
+        """True when :meth:`read` has reached the end of the stream, so an
+        empty string from it means EOF instead of a timeout."""
+        if self.sources:
+            return False
+        with self.source_added:
+            return self.grace_until is None or self.grace_until <= time.time()
+
+    def _read_sources(self, size, deadline):
+        """Internal method
+
+        Reads from the sources as described in :meth:`read`."""
         # Acquire source once, then use that one return everywhere else.
         # Classic example of not-being-thread-safe in the old method.
         source = self.source
         while source is not None:
+            if deadline is None:
+                remaining = None
+            else:
+                remaining = max(deadline - time.time(), 0)
             # Read data from the returned buffer
-            data = source.read(size)
+            data = source.read(size, timeout=remaining)
+            if data and self.scanner is not None:
+                # Only hand out whole frames, this has to happen before we
+                # refresh the source since that can reset the scanner.
+                data = self.scanner.feed(data)
             # Refresh our source variable to point to the top source
             source = self.source
 
             if data == b'':
+                if remaining is not None and deadline <= time.time():
+                    # We timed out waiting for data.
+                    return b''
                 # If we got an EOF from the read it means we should check if
                 # there is another source available and continue the loop.
+                # This also happens when we only got part of a frame.
                 continue
             else:
                 # Else we can just return the data we found from the source.
@@ -214,23 +665,56 @@ class IcyContext(object):
         # more sources left to read from. So we can return an EOF.
         return b''
 
+    def start_grace(self):
+        """Keeps :meth:`read` from returning EOF for :attr:`grace_period`
+        seconds, sending :attr:`fallback` audio in the meantime."""
+        logger.info("%s: No sources left, waiting %s seconds for one.",
+                    self.mount, self.grace_period)
+        with self.source_added:
+            self.grace_until = time.time() + self.grace_period
+
+    def icecast_running(self):
+        """Returns True if any of our upstreams is being fed."""
+        return any(upstream.running() for upstream in self.icecasts)
+
+    def icecast_connected(self):
+        """Returns True if any of our upstreams is connected."""
+        return any(upstream.connected() for upstream in self.icecasts)
+
     def start_icecast(self):
         """Calls the :class:`icecast.Icecast`: :meth:`icecast.Icecast.start`:
-        method of this context."""
-        self.icecast.start()
+        method of our upstreams."""
+        if self.stale_upstreams:
+            self.stale_upstreams = False
+            self.create_upstreams()
+        if self.fanout is not None:
+            self.fanout.reset()
+        for upstream in self.icecasts:
+            upstream.start()
 
     def stop_icecast(self):
         """Calls the :class:`icecast.Icecast`: :meth:`icecast.Icecast.close`:
-        method of this context."""
-        self.icecast.close()
+        method of our upstreams."""
+        from audio.icecast import IcecastError
+        for upstream in self.icecasts:
+            try:
+                upstream.close()
+            except IcecastError:
+                logger.exception("%s: Failed closing upstream.", self.mount)
+        if self.current_source is not None and self.events is not None:
+            self.events.publish('source', mount=self.mount, user=None,
+                                stream_name=None, metadata=None)
         self.current_source = None
+        if self.broadcast is not None:
+            self.broadcast.close()
 
     def send_metadata(self, metadata, client):
         """Checks if client is the currently active source on this mountpoint
         and then sends the metadata. If the client is not the active source
         the metadata is saved for if the current source drops out."""
+        sources = self.sources
         try:
-            source = self.sources[0]
+            source = sources[0]
         except IndexError:
             # No source, why are we even getting metadata ignore it
             # By Vin:
@@ -243,9 +727,12 @@ class IcyContext(object):
             # Current source send metadata to us! yay
             logger.info("%s:metadata.update: %s", self.mount, metadata)
             self.saved_metadata[source] = metadata
-            self.icecast.set_metadata(metadata)  # Lol consistent naming (not)
+            self.set_metadata(metadata)  # Lol consistent naming (not)
+            if self.events is not None:
+                self.events.publish('metadata', mount=self.mount,
+                                    user=source.info.user, metadata=metadata)
         else:
-            for source in self.sources:
+            for source in sources:
                 if (source.info.user == client.user):
                     # Save the metadata
                     logger.info("%s:metadata.save: %s", self.mount, metadata)
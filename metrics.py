@@ -0,0 +1,210 @@
+"""Counters, gauges and histograms rendered in the Prometheus text format.
+
+Metrics are created on the module level :data:`registry` and served on
+the `/metrics` path of the proxy. Values that already live elsewhere, such
+as buffer fill levels, are exported through collector callbacks instead
+of being copied into a metric on every change.
+"""
+import threading
+import bisect
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{:s}="{:s}"'.format(
+        name, unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+                            .replace('\n', '\\n').encode('utf-8'))
+        for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        super(Metric, self).__init__()
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        # : Mapping of label value tuples to the metric value.
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def remove(self, **labels):
+        """Forgets the values of the given label combination."""
+        with self.lock:
+            self.values.pop(self._key(labels), None)
+
+    def samples(self):
+        """Returns a list of (suffix, label values, extra labels, value)."""
+        with self.lock:
+            return [('', key, (), value) for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1,
+                       0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, help, labelnames=(), buckets=None):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(buckets or self.default_buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            try:
+                counts, total = self.values[key]
+            except KeyError:
+                counts, total = [0] * len(self.buckets), 0.0
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(('_bucket', key,
+                                    (('le', _format_value(bound)),),
+                                    cumulative))
+                samples.append(('_sum', key, (), total))
+                samples.append(('_count', key, (), cumulative))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        super(Registry, self).__init__()
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.collectors = []
+
+    def _add(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=None):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """Adds a callable that returns an iterable of freshly filled in
+        :class:`Metric` objects every time the registry is rendered."""
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics)
+            collectors = list(self.collectors)
+        for collector in collectors:
+            metrics.extend(collector())
+
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {:s} {:s}'.format(metric.name, metric.help))
+            lines.append('# TYPE {:s} {:s}'.format(metric.name, metric.type))
+            for suffix, key, extra, value in metric.samples():
+                lines.append('{:s}{:s}{:s} {:s}'.format(
+                    metric.name, suffix,
+                    _format_labels(metric.labelnames, key, extra),
+                    _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+#: The registry served on `/metrics`.
+registry = Registry()
+
+source_bytes = registry.counter(
+    'icecast_proxy_source_bytes_total',
+    'Bytes received from source clients.', ('mount',))
+upstream_bytes = registry.counter(
+    'icecast_proxy_upstream_bytes_total',
+    'Bytes sent to the upstream icecast server.', ('mount', 'upstream'))
+upstream_send_seconds = registry.histogram(
+    'icecast_proxy_upstream_send_seconds',
+    'Time spent in libshout send calls.', ('mount', 'upstream'))
+upstream_reconnects = registry.counter(
+    'icecast_proxy_upstream_reconnects_total',
+    'Reconnect attempts to the upstream icecast server.',
+    ('mount', 'upstream'))
+upstream_connect_failures = registry.counter(
+    'icecast_proxy_upstream_connect_failures_total',
+    'Failed or lost connections to the upstream icecast server.',
+    ('mount', 'upstream'))
+upstream_connect_seconds = registry.histogram(
+    'icecast_proxy_upstream_connect_seconds',
+    'Time spent opening connections to the upstream icecast server.',
+    ('mount', 'upstream'))
+upstream_circuit_open = registry.gauge(
+    'icecast_proxy_upstream_circuit_open',
+    'Whether we stopped reconnecting to the upstream icecast server.',
+    ('mount', 'upstream'))
+upstream_lag_bytes = registry.gauge(
+    'icecast_proxy_upstream_lag_bytes',
+    'Bytes waiting for a relay that is behind the others.',
+    ('mount', 'upstream'))
+upstream_dropped_bytes = registry.counter(
+    'icecast_proxy_upstream_dropped_bytes_total',
+    'Bytes a relay missed because it fell too far behind.',
+    ('mount', 'upstream'))
+buffer_dropped_bytes = registry.counter(
+    'icecast_proxy_buffer_dropped_bytes_total',
+    'Bytes dropped or refused by a full source buffer.', ('mount',))
+listener_bytes = registry.counter(
+    'icecast_proxy_listener_bytes_total',
+    'Bytes sent to listeners connected to the proxy.', ('mount',))
+listener_dropped_bytes = registry.counter(
+    'icecast_proxy_listener_dropped_bytes_total',
+    'Bytes listeners skipped because they fell too far behind.', ('mount',))
+underruns = registry.counter(
+    'icecast_proxy_underruns_total',
+    'Gaps of over a second in the source audio of a mount.',
+    ('mount',))
+source_switches = registry.counter(
+    'icecast_proxy_source_switches_total',
+    'Changes of the active source of a mount.', ('mount',))
+metadata_updates = registry.counter(
+    'icecast_proxy_metadata_updates_total',
+    'Metadata updates by what happened to them.', ('mount', 'result'))
+login_seconds = registry.histogram(
+    'icecast_proxy_login_seconds',
+    'Time spent checking logins.', ('cached',))
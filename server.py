@@ -6,19 +6,39 @@ import logging
 import manager
 import threading
 import config
-import urllib2
 import signal
 import collections
-from cgi import escape as esc
+import metrics
+import errno
+import time
+import json
+import functools
+import configreload
 from BaseHTTPandICEServer import HTTPServer, BaseHTTPRequestHandler
 from SocketServer import ThreadingMixIn, BaseServer
-from buffers import Buffer
+from buffers import BufferOverflow, BLOCK, buffer_class
+from audio import frames
+from eventloop import EventLoop
+from events import format_sse
+from adminclient import AdminClient, AdminError
 
 
 socket.setdefaulttimeout(5.0)
 MAX_BUFFER = 24*1024*2 # Go about 192kbps (24kB/s) times two for a 2 second buffer
 #MAX_DEQUES = 4
 logger = logging.getLogger('server')
+#: Part of our ETags that changes on restart, since versions start over.
+INSTANCE = '{:x}'.format(int(time.time()))
+#: Seconds between keepalive comments on idle event streams.
+EVENT_KEEPALIVE = 15.0
+#: Most bytes of request line and headers the event loop server reads
+#: before giving up on a request.
+MAX_REQUEST_HEAD = 65536
+#: Set on SIGHUP, :func:`run` reloads the config when it sees it.
+reload_requested = threading.Event()
+#: Settings used by :func:`create_admin`.
+ADMIN_SETTINGS = ('icecast_host', 'icecast_port', 'icecast_pass',
+                  'admin_pool_size', 'admin_timeout', 'admin_cache_ttl')
 
 
 class IcyClient(object):
@@ -79,8 +99,72 @@ client_html = u"""
 """
 
 
+def render_admin(snapshot, disabled):
+    """Returns the `/proxy` page for a :class:`manager.Snapshot` as utf-8."""
+    # Imported here, :mod:`cgi` pulls in a lot we don't need at startup.
+    from cgi import escape as esc
+    send_buf = []
+    send_buf.append(server_header)
+
+    for mount in snapshot.mounts:
+        send_buf.append(mount_header.format(mount=esc(mount.mount)))
+        for i, source in enumerate(mount.sources):
+            send_buf.append(client_html.format(\
+                user=esc(source.user),
+                meta=esc(source.metadata),
+                agent=esc(source.useragent),
+                stream_name=esc(source.stream_name),
+                mount=esc(mount.mount, True),
+                num=i,
+                disabled=disabled))
+        send_buf.append('</table>\n')
+    send_buf.append('</body>\n</html>')
+    send_buf = u''.join(send_buf)
+    return send_buf.encode('utf-8', 'replace')
+
+
+def render_status(snapshot):
+    """Returns the `/proxy/status.json` document for a
+    :class:`manager.Snapshot`. The first source of a mount is the live one."""
+    mounts = []
+    for mount in snapshot.mounts:
+        sources = [source._asdict() for source in mount.sources]
+        mounts.append({'mount': mount.mount,
+                       'live': sources[0]['user'],
+                       'metadata': sources[0]['metadata'],
+                       'sources': sources})
+    return json.dumps({'version': snapshot.version, 'mounts': mounts})
+
+
+def etag_matches(header, etag):
+    """Returns True if an If-None-Match `header` matches `etag`."""
+    if not header:
+        return False
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag or tag == '*':
+            return True
+    return False
+
+
 class IcyRequestHandler(BaseHTTPRequestHandler):
-    manager = manager.IcyManager()
+    #: The :class:`manager.IcyManager` and :class:`AdminClient` shared by
+    #: all requests, created by :func:`setup` when the server starts.
+    manager = None
+    admin = None
+    #: Mapping of page name to the (version, etag, body) it was last
+    #: rendered as, see :meth:`_serve_cached`.
+    page_cache = {}
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # The event loop server reads the request head before handing us
+        # the connection.
+        read_ahead = getattr(self.server, 'read_ahead', None)
+        if read_ahead is not None:
+            self.rfile._rbuf.write(read_ahead(self.request))
+
     def _get_login(self):
         try:
             login = self.headers['Authorization'].split()[1]
@@ -95,36 +179,136 @@ class IcyRequestHandler(BaseHTTPRequestHandler):
         # disabled = u'disabled' if not is_admin else None
         disabled = u'disabled'
         # TODO kicking. maybe.
-        send_buf = []
-        send_buf.append(server_header)
-
-        for mount in self.manager.context:
-            if self.manager.context[mount].sources:  # only include if there is a source on there
-                send_buf.append(mount_header.format(mount=esc(mount)))
-                for i, source in enumerate(self.manager.context[mount].sources):
-                    metadata = self.manager.context[mount].saved_metadata.get(source, u'')
-                    send_buf.append(client_html.format(\
-                        user=esc(source.info.user),
-                        meta=esc(metadata),
-                        agent=esc(source.info.useragent),
-                        stream_name=esc(source.info.stream_name),
-                        mount=esc(mount, True),
-                        num=i,
-                        disabled=disabled))
-                send_buf.append('</table>\n')
-        send_buf.append('</body>\n</html>')
-        send_buf = u''.join(send_buf)
-        send_buf = send_buf.encode('utf-8', 'replace')
+        self._serve_cached('admin', 'text/html',
+                           lambda snapshot: render_admin(snapshot, disabled))
+
+    def _serve_status(self):
+        # Read before the snapshot so we never claim to be newer than it.
+        last_event = self.manager.events.last_id
+        self._serve_cached('status', 'application/json', render_status,
+                           (('X-Last-Event-ID', str(last_event)),))
+
+    def _serve_cached(self, name, content_type, render, headers=()):
+        """Sends the page `name` as rendered by `render` from the current
+        :meth:`manager.IcyManager.snapshot`, rendering it only when that
+        changed. Supports conditional requests with If-None-Match."""
+        snapshot = self.manager.snapshot()
+        page = self.page_cache.get(name)
+        if page is None or page[0] != snapshot.version:
+            etag = '"{:s}-{:s}-{:d}"'.format(INSTANCE, name, snapshot.version)
+            page = (snapshot.version, etag, render(snapshot))
+            self.page_cache[name] = page
+        version, etag, send_buf = page
+
         try:
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
             self.send_response(200)
-            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Type", content_type)
             self.send_header("Content-Length", len(send_buf))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            for header, value in headers:
+                self.send_header(header, value)
             self.end_headers()
 
             self.wfile.write(send_buf)
         except IOError as err:
             logger.exception("Error in request handler")
 
+    def _serve_events(self, query):
+        """Streams :mod:`events` as Server-Sent Events, starting after the
+        id in the Last-Event-ID header or `since` query parameter."""
+        log = self.manager.events
+        last_id = self.headers.get('Last-Event-ID') or query.get('since', [''])[0]
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            last_id = log.last_id
+        # EventSource sends the id it saw last on every reconnect, after a
+        # restart that can be ahead of our ids which start at 0 again.
+        last_id = min(last_id, log.last_id)
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+        except IOError as err:
+            return
+        self.close_connection = 1
+        if getattr(self.server, 'event_loop', None) is not None:
+            # Leave the writing to the event loop, one broadcast for all.
+            self.detached = True
+            self.server.add_event_stream(self.connection, log, last_id)
+            return
+        try:
+            while not self.server.closing:
+                events = log.wait(last_id, EVENT_KEEPALIVE)
+                if not events:
+                    self.wfile.write(': keepalive\n\n')
+                    continue
+                self.wfile.write(''.join(format_sse(event) for event in events))
+                last_id = events[-1].id
+        except (IOError, socket.error) as err:
+            pass
+
+    def _serve_metrics(self):
+        send_buf = metrics.registry.render()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", len(send_buf))
+            self.end_headers()
+
+            self.wfile.write(send_buf)
+        except IOError as err:
+            logger.exception("Error in request handler")
+
+    def _serve_listener(self, context):
+        """Sends the audio of the mount of `context` to a listener, with
+        ICY metadata if asked for like icecast does."""
+        if context.eof:
+            self.send_error(404)
+            return
+        metaint = 0
+        if self.headers.get('Icy-MetaData', '0').strip() == '1':
+            metaint = getattr(config, 'listener_metaint', 16000)
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg"
+                             if context.format == 1 else "application/ogg")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("icy-name", config.meta_name)
+            self.send_header("icy-genre", config.meta_genre)
+            self.send_header("icy-url", config.meta_url)
+            if metaint:
+                self.send_header("icy-metaint", str(metaint))
+            self.end_headers()
+        except IOError as err:
+            return
+        self.close_connection = 1
+        listener = context.broadcast.listener(metaint)
+        if getattr(self.server, 'event_loop', None) is not None:
+            # Leave the writing to the event loop, with the other listeners.
+            self.detached = True
+            self.server.add_listener(self.connection, listener)
+            return
+        try:
+            while not self.server.closing:
+                if not listener.wait(1.0):
+                    if context.eof:
+                        break
+                    continue
+                if not listener.send(self.connection.send):
+                    break
+        except (IOError, socket.error) as err:
+            pass
+        finally:
+            listener.close()
+
     def do_SOURCE(self):
         self.useragent = self.headers.get('User-Agent', None)
         self.mount = self.path  # oh so simple
@@ -154,29 +338,61 @@ class IcyRequestHandler(BaseHTTPRequestHandler):
             self.end_headers()
             return
 
-        self.audio_buffer = Buffer(max_size=MAX_BUFFER)
+        policy = getattr(config, 'buffer_overflow', 'drop')
+        audio_format = self.manager.mount_format(self.mount)
+        self.audio_buffer = buffer_class(policy)(
+                                max_size=MAX_BUFFER, overflow=policy,
+                                boundary=functools.partial(frames.find_boundary,
+                                                           format=audio_format))
         self.icy_client = IcyClient(self.audio_buffer,
                                    self.mount,
                                    user=user,
                                    useragent=self.useragent,
                                    stream_name=self.stream_name)
         self.manager.register_source(self.icy_client)
+        if getattr(self.server, 'event_loop', None) is not None:
+            # The event loop takes over reading the audio from here on.
+            self.detached = True
+            self.close_connection = 1
+            self.server.add_source(self.connection, self.rfile,
+                                   self.icy_client, self.source_closed)
+            return
         try:
+            # Whatever the request parsing read ahead, then straight from
+            # the socket.
+            pending = self.rfile._rbuf.getvalue()
+            if pending:
+                self.audio_buffer.write(pending)
+            read_size = ReadSize()
             while True:
-                data = self.rfile.read(4096)
-                if data == '':
+                amount = ingest(self.connection, self.audio_buffer,
+                                read_size.size)
+                if not amount:
                     break
-                self.audio_buffer.write(data)
+                read_size.update(amount)
+                metrics.source_bytes.inc(amount, mount=self.mount)
+        except BufferOverflow:
+            logger.warning("source: User '%s' overflowed the buffer on %s, "
+                           "disconnecting.", user, self.mount)
         except:
             logger.exception("Timeout occured (most likely)")
         finally:
-            logger.info("source: User '%s' logged off.", user)
-            self.manager.remove_source(self.icy_client)
+            self.source_closed()
+
+    def source_closed(self):
+        """Called when the source connection of this handler is gone."""
+        logger.info("source: User '%s' logged off.", self.icy_client.user)
+        self.manager.remove_source(self.icy_client)
 
     def do_GET(self):
         self.useragent = self.headers.get('User-Agent', None)
         parsed_url = urlparse.urlparse(self.path)
         parsed_query = urlparse.parse_qs(parsed_url.query)
+        context = self.manager.context.get(parsed_url.path)
+        if context is not None and context.broadcast is not None:
+            # Listeners don't log in, just like on icecast.
+            self._serve_listener(context)
+            return
         user, password = self._get_login()
         if user is None and password is None:
             if 'pass' in parsed_query:
@@ -194,6 +410,12 @@ class IcyRequestHandler(BaseHTTPRequestHandler):
                 user, password = password.split('|')
             if parsed_url.path == "/proxy":
                 self._serve_admin(parsed_url, parsed_query, user, password)
+            elif parsed_url.path == "/proxy/status.json":
+                self._serve_status()
+            elif parsed_url.path == "/proxy/events":
+                self._serve_events(parsed_query)
+            elif parsed_url.path == "/metrics":
+                self._serve_metrics()
             elif parsed_url.path == "/admin/metadata":
                 try:
                     mount = parsed_query['mount'][0]
@@ -223,38 +445,26 @@ class IcyRequestHandler(BaseHTTPRequestHandler):
                     else:
                         logger.exception("Error in request handler")
             elif parsed_url.path == "/admin/listclients":
-                auth = "{:s}:{:s}".format('source', config.icecast_pass)
-                auth = auth.encode('base64')
-                url = urlparse.urlparse('http://{:s}:{:d}/'.format(
-                                                                   config.icecast_host,
-                                                                   config.icecast_port)
-                                        )
-                url = url[:2] + parsed_url[2:]
-                url = urlparse.urlunparse(url)
-
-                request = urllib2.Request(url)
-                request.add_header('User-Agent', self.useragent)
-                request.add_header('Authorization', 'Basic {:s}'.format(auth))
-
+                path = parsed_url.path
+                if parsed_url.query:
+                    path += '?' + parsed_url.query
                 try:
-                    result = urllib2.urlopen(request).read()
-                except urllib2.HTTPError as err:
-                    self.send_response(err.code)
+                    result = self.admin.get(path, self.useragent)
+                except AdminError as err:
+                    self.send_response(501)
                     self.end_headers()
                     return
-                except urllib2.URLError as err:
-                    self.send_reponse(501)
+                if result.status != 200:
+                    self.send_response(result.status)
                     self.end_headers()
                     return
 
-                result_length = len(result)
-
                 self.send_response(200)
-                self.send_header('Content-Type', 'text/xml')
-                self.send_header('Content-Length', str(result_length))
+                self.send_header('Content-Type', result.content_type)
+                self.send_header('Content-Length', str(len(result.body)))
                 self.end_headers()
 
-                self.wfile.write(result)
+                self.wfile.write(result.body)
         else:
             self.send_response(401)
             self.send_header('WWW-Authenticate', 'Basic realm="Icecast2 Proxy"')
@@ -296,8 +506,57 @@ def fix_encoding(metadata, encoding):
             return fix_encoding(metadata, 'latin1')
 
 
+def listen_socket(server, address):
+    """Returns a new socket listening on `address`, set up like the one
+    `server` made on creation."""
+    sock = socket.socket(server.address_family, server.socket_type)
+    try:
+        if server.allow_reuse_address:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(server.request_queue_size)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+
+def hand_over(server, old):
+    """Handles the connections still waiting to be accepted on the
+    listening socket `old` and closes it, after `server` switched to a new
+    one. Connections accepted before have sockets of their own and don't
+    notice at all."""
+    old.setblocking(0)
+    while True:
+        try:
+            request, client_address = old.accept()
+        except socket.error:
+            break
+        if server.verify_request(request, client_address):
+            server.process_request(request, client_address)
+        else:
+            server.shutdown_request(request)
+    old.close()
+    logger.info("Listening on %s:%d now.", *server.server_address[:2])
+
+
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     timeout = 0.5
+    #: Set by :meth:`server_close`, tells long running handlers to stop.
+    closing = False
+
+    def server_close(self):
+        self.closing = True
+        HTTPServer.server_close(self)
+
+    def rebind(self, address):
+        """Listens on `address` from now on, see :func:`hand_over`. Should
+        be called from the thread calling :meth:`handle_request`."""
+        old, self.socket = self.socket, listen_socket(self, address)
+        self.server_address = self.socket.getsockname()
+        self.server_port = self.server_address[1]
+        hand_over(self, old)
+
     def finish_request(self, request, client_address):
         """Finish one request by instantiating RequestHandlerClass."""
         try:
@@ -308,18 +567,596 @@ class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
             else:
                 logger.exception("Error in request handler")
 
-def run(server=ThreadedHTTPServer,
+def ingest(sock, buffer, size):
+    """Moves up to `size` bytes from `sock` into `buffer` and returns how
+    many, 0 on EOF or when `buffer` was closed. Buffers that support it get
+    the data :meth:`socket.recv_into` their own storage, saving a copy."""
+    write_from = getattr(buffer, 'write_from', None)
+    if write_from is not None:
+        return write_from(sock.recv_into, size)
+    data = sock.recv(size)
+    if data:
+        buffer.write(data)
+    return len(data)
+
+
+class ReadSize(object):
+    """Picks source read sizes covering about `interval` seconds of audio
+    at the rate a source sends, between `minimum` and `maximum` bytes.
+
+    Reads that fill the whole size mean we're behind, those double it until
+    the next rate measurement."""
+    def __init__(self, minimum=4096, maximum=65536, interval=0.25):
+        super(ReadSize, self).__init__()
+        self.minimum = minimum
+        self.maximum = maximum
+        self.interval = interval
+        self.size = minimum
+        # : Bytes per second, :const:`None` until measured.
+        self.rate = None
+        self._window_start = time.time()
+        self._window_bytes = 0
+
+    def update(self, amount):
+        """Records a read of `amount` bytes."""
+        now = time.time()
+        self._window_bytes += amount
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            rate = self._window_bytes / elapsed
+            self.rate = rate if self.rate is None else (self.rate + rate) / 2
+            self._window_start = now
+            self._window_bytes = 0
+            size = int(self.rate * self.interval + 4095) // 4096 * 4096
+            self.size = max(self.minimum, min(self.maximum, size))
+        elif amount >= self.size:
+            self.size = min(self.maximum, self.size * 2)
+
+
+class RequestHead(object):
+    """Reads the request line and headers of a new connection on the event
+    loop of an :class:`EventLoopHTTPServer`, so its workers only get
+    requests they can parse without waiting on the client."""
+    def __init__(self, server, sock, client_address):
+        super(RequestHead, self).__init__()
+        self.server = server
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.client_address = client_address
+        # : What we read so far, the head and possibly some of the body.
+        self.data = ''
+        self.started = time.time()
+        self.closed = False
+
+    def start(self):
+        self.sock.setblocking(0)
+        self.server.event_loop.add_reader(self.fd, self.on_readable)
+
+    def on_readable(self):
+        try:
+            data = self.sock.recv(4096)
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ''
+        if data == '':
+            self.close()
+            return
+        # Only look at what's new, and the end of what came before.
+        start = max(len(self.data) - 3, 0)
+        self.data += data
+        end = self.data.find('\n\n', start)
+        if end == -1:
+            end = self.data.find('\n\r\n', start)
+        if end != -1:
+            self.detach()
+            self.server.process_head(self)
+        elif len(self.data) > MAX_REQUEST_HEAD:
+            logger.info("Request head too large, disconnecting.")
+            self.close()
+
+    def detach(self):
+        """Stops reading, leaving the socket open and blocking again."""
+        self.closed = True
+        self.server.event_loop.remove_reader(self.fd)
+        self.server.heads.discard(self)
+        self.sock.settimeout(socket.getdefaulttimeout())
+
+    def close(self):
+        if self.closed:
+            return
+        self.detach()
+        self.server.shutdown_request(self.sock)
+
+
+class SourceIngest(object):
+    """Reads the audio of a single source connection on the event loop of an
+    :class:`EventLoopHTTPServer` and writes it into the source buffer."""
+
+    def __init__(self, server, sock, client, on_close):
+        super(SourceIngest, self).__init__()
+        self.server = server
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.client = client
+        self.buffer = client.buffer
+        self.on_close = on_close
+        self.last_read = time.time()
+        self.read_size = ReadSize()
+        self.closed = False
+
+    def start(self):
+        self.sock.setblocking(0)
+        self.server.event_loop.add_reader(self.fd, self.on_readable)
+
+    def on_readable(self):
+        size = self.read_size.size
+        if getattr(self.buffer, 'overflow', None) == BLOCK:
+            # Never read more than fits, a full buffer would block the loop.
+            size = min(size, self.buffer.capacity - len(self.buffer))
+            if size <= 0:
+                # Leave the data in the socket so the source gets
+                # backpressure, and stop polling it for a bit so we don't
+                # spin.
+                self.server.event_loop.remove_reader(self.fd)
+                self.server.event_loop.call_later(0.05, self.resume)
+                return
+        try:
+            amount = ingest(self.sock, self.buffer, size)
+        except BufferOverflow:
+            logger.warning("source: Overflowed the buffer, disconnecting.")
+            self.close()
+            return
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            logger.warning("source: Connection error %s", err)
+            self.close()
+            return
+        if not amount:
+            self.close()
+            return
+        self.last_read = time.time()
+        self.read_size.update(amount)
+        metrics.source_bytes.inc(amount, mount=self.client.mount)
+
+    def resume(self):
+        if not self.closed:
+            self.server.event_loop.add_reader(self.fd, self.on_readable)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.server.event_loop.remove_reader(self.fd)
+        self.server.sources.discard(self)
+        self.server.shutdown_request(self.sock)
+        # Removing a source can join the icecast thread, keep it off the loop.
+        self.server.offload(self.on_close)
+
+
+class EventStream(object):
+    """A `/proxy/events` connection written to from the event loop of an
+    :class:`EventLoopHTTPServer`."""
+    def __init__(self, server, sock, last_id):
+        super(EventStream, self).__init__()
+        self.server = server
+        self.sock = sock
+        self.fd = sock.fileno()
+        # : Id of the last event sent, later ones are skipped.
+        self.last_id = last_id
+        self.closed = False
+
+    def start(self, log):
+        self.sock.setblocking(0)
+        # We don't expect anything from the client, but it tells us when
+        # the connection is gone.
+        self.server.event_loop.add_reader(self.fd, self.on_readable)
+        for event in log.since(self.last_id):
+            self.send_event(event)
+
+    def on_readable(self):
+        try:
+            data = self.sock.recv(4096)
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ''
+        if data == '':
+            self.close()
+
+    def send_event(self, event, data=None):
+        """Sends `event` unless we did already, `data` is the event as
+        formatted by :func:`events.format_sse` if known."""
+        if event.id <= self.last_id:
+            return
+        self.last_id = event.id
+        self.send(data if data is not None else format_sse(event))
+
+    def send(self, data):
+        """Writes `data` without blocking, a client that can't keep up with
+        the few bytes we send is dropped."""
+        if self.closed:
+            return
+        try:
+            sent = self.sock.send(data)
+        except socket.error as err:
+            sent = 0
+        if sent < len(data):
+            logger.info("events: Client is too slow or gone, disconnecting.")
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.server.event_loop.remove_reader(self.fd)
+        self.server.event_streams.discard(self)
+        self.server.shutdown_request(self.sock)
+
+
+class ListenerStream(object):
+    """A listener connection written to from the event loop of an
+    :class:`EventLoopHTTPServer`."""
+    def __init__(self, server, sock, listener):
+        super(ListenerStream, self).__init__()
+        self.server = server
+        self.sock = sock
+        self.fd = sock.fileno()
+        # : The :class:`audio.broadcast.Listener` we send from.
+        self.listener = listener
+        self.closed = False
+
+    def start(self):
+        self.sock.setblocking(0)
+        # Listeners don't send anything, but it tells us when they're gone.
+        self.server.event_loop.add_reader(self.fd, self.on_readable)
+        self.pump()
+
+    def on_readable(self):
+        try:
+            data = self.sock.recv(4096)
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ''
+        if data == '':
+            self.close()
+
+    def pump(self):
+        """Sends as much as the socket takes without blocking, the rest
+        waits in the broadcast for the next time."""
+        if self.closed:
+            return
+        try:
+            if not self.listener.send(self._send):
+                self.close()
+        except socket.error as err:
+            self.close()
+
+    def _send(self, data):
+        try:
+            return self.sock.send(data)
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            raise
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.server.event_loop.remove_reader(self.fd)
+        self.server.listeners.get(self.listener.broadcast, set()).discard(self)
+        self.listener.close()
+        self.server.shutdown_request(self.sock)
+
+
+class EventLoopHTTPServer(HTTPServer):
+    """HTTP server that accepts connections and reads all source audio on a
+    single event loop thread.
+
+    The loop reads the head of each request, which is then parsed and
+    handled on a fixed size pool of worker threads, so login checks don't
+    stall the loop, a flood of connections can't create more than `workers`
+    threads and clients that are slow to send their request don't keep the
+    workers from handling the others.
+    """
+    timeout = 0.5
+
+    def __init__(self, server_address, RequestHandlerClass, workers=16):
+        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+        self.event_loop = EventLoop()
+        from multiprocessing.pool import ThreadPool
+        self.pool = ThreadPool(workers)
+        # : Set of :class:`RequestHead` instances still being read.
+        self.heads = set()
+        # : Mapping of socket to what was read of it before a worker got it,
+        # : see :meth:`read_ahead`.
+        self._read_ahead = {}
+        # : Set of active :class:`SourceIngest` instances.
+        self.sources = set()
+        # : Set of active :class:`EventStream` instances.
+        self.event_streams = set()
+        self._event_logs = set()
+        # : Mapping of :class:`audio.broadcast.Broadcast` to the set of
+        # : :class:`ListenerStream` instances following it.
+        self.listeners = {}
+        self._broadcast_callbacks = {}
+        self.event_loop.add_reader(self.fileno(), self._accept)
+        self.event_loop.call_later(1.0, self._check_idle)
+
+    def handle_request(self):
+        """Runs one iteration of the event loop."""
+        self.event_loop.run_once(self.timeout)
+
+    def process_request(self, request, client_address):
+        head = RequestHead(self, request, client_address)
+        self.heads.add(head)
+        head.start()
+
+    def process_head(self, head):
+        """Hands the request of the complete :class:`RequestHead` `head` to
+        a worker."""
+        self._read_ahead[head.sock] = head.data
+        self.pool.apply_async(self._process_request_worker,
+                              (head.sock, head.client_address))
+
+    def read_ahead(self, request):
+        """Returns what was read of `request` before it was handed to a
+        worker, for the request handler to parse first."""
+        return self._read_ahead.pop(request, '')
+
+    def offload(self, function, *args):
+        """Runs `function(*args)` on the worker pool, logging exceptions."""
+        self.pool.apply_async(self._offloaded, (function, args))
+
+    def finish_request(self, request, client_address):
+        """Finish one request by instantiating RequestHandlerClass and
+        return the handler instance."""
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def add_source(self, sock, rfile, client, on_close):
+        """Hands a source connection over to the event loop. `rfile` is the
+        file object the headers were read through, anything it buffered
+        already is written into the buffer of `client` first. Called from
+        a worker."""
+        pending = rfile._rbuf.getvalue()
+        if pending:
+            client.buffer.write(pending)
+        ingest = SourceIngest(self, sock, client, on_close)
+        self.event_loop.call_soon_threadsafe(self._start_source, ingest)
+
+    def add_event_stream(self, sock, log, last_id):
+        """Hands an event stream connection over to the event loop, it gets
+        the events of the :class:`events.EventLog` `log` after `last_id`.
+        Called from a worker."""
+        stream = EventStream(self, sock, last_id)
+        self.event_loop.call_soon_threadsafe(self._start_event_stream,
+                                             stream, log)
+
+    def add_listener(self, sock, listener):
+        """Hands a listener connection over to the event loop, it gets sent
+        what the :class:`audio.broadcast.Listener` `listener` has. Called
+        from a worker."""
+        stream = ListenerStream(self, sock, listener)
+        self.event_loop.call_soon_threadsafe(self._start_listener, stream)
+
+    def rebind(self, address):
+        """Listens on `address` from now on, see :func:`hand_over`. Should
+        be called from the loop thread."""
+        sock = listen_socket(self, address)
+        self.event_loop.remove_reader(self.fileno())
+        old, self.socket = self.socket, sock
+        self.server_address = sock.getsockname()
+        self.server_port = self.server_address[1]
+        self.event_loop.add_reader(self.fileno(), self._accept)
+        hand_over(self, old)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        for broadcast, callback in self._broadcast_callbacks.items():
+            broadcast.callbacks.remove(callback)
+        for streams in self.listeners.values():
+            for stream in list(streams):
+                stream.close()
+        for log in self._event_logs:
+            log.remove_listener(self._on_event)
+        for ingest in list(self.sources):
+            ingest.close()
+        for stream in list(self.event_streams):
+            stream.close()
+        for head in list(self.heads):
+            head.close()
+        self.pool.close()
+        self.event_loop.close()
+
+    def _start_source(self, ingest):
+        self.sources.add(ingest)
+        ingest.start()
+
+    def _start_event_stream(self, stream, log):
+        if log not in self._event_logs:
+            self._event_logs.add(log)
+            log.add_listener(self._on_event)
+            self.event_loop.call_later(EVENT_KEEPALIVE, self._keepalive)
+        self.event_streams.add(stream)
+        stream.start(log)
+
+    def _start_listener(self, stream):
+        broadcast = stream.listener.broadcast
+        if broadcast not in self._broadcast_callbacks:
+            # Called from whichever thread feeds the broadcast.
+            callback = lambda: self.event_loop.call_soon_threadsafe(
+                                            self._pump_listeners, broadcast)
+            self._broadcast_callbacks[broadcast] = callback
+            broadcast.callbacks.append(callback)
+            self.listeners[broadcast] = set()
+        self.listeners[broadcast].add(stream)
+        stream.start()
+
+    def _pump_listeners(self, broadcast):
+        for stream in list(self.listeners.get(broadcast, ())):
+            stream.pump()
+
+    def _on_event(self, event):
+        """Listener of the event logs, called from any thread."""
+        self.event_loop.call_soon_threadsafe(self._broadcast, event)
+
+    def _broadcast(self, event):
+        data = format_sse(event)
+        for stream in list(self.event_streams):
+            stream.send_event(event, data)
+
+    def _keepalive(self):
+        for stream in list(self.event_streams):
+            stream.send(': keepalive\n\n')
+        self.event_loop.call_later(EVENT_KEEPALIVE, self._keepalive)
+
+    def _accept(self):
+        try:
+            request, client_address = self.get_request()
+        except socket.error:
+            return
+        if self.verify_request(request, client_address):
+            self.process_request(request, client_address)
+        else:
+            self.shutdown_request(request)
+
+    def _process_request_worker(self, request, client_address):
+        detached = False
+        try:
+            handler = self.finish_request(request, client_address)
+            detached = getattr(handler, 'detached', False)
+        except (IOError) as err:
+            if hasattr(err, 'errno') and err.errno == 32:
+                logger.warning("Broken pipe exception, ignoring")
+            else:
+                logger.exception("Error in request handler")
+        except Exception:
+            logger.exception("Error in request handler")
+        finally:
+            self._read_ahead.pop(request, None)
+            if not detached:
+                self.shutdown_request(request)
+
+    def _offloaded(self, function, args):
+        try:
+            function(*args)
+        except Exception:
+            logger.exception("Exception in offloaded call.")
+
+    def _check_idle(self):
+        """Disconnects sources that didn't send anything, and clients that
+        didn't send their request, for longer than the default socket
+        timeout, like the threaded server does."""
+        timeout = socket.getdefaulttimeout()
+        now = time.time()
+        for ingest in list(self.sources):
+            if now - ingest.last_read > timeout:
+                logger.info("source: Timeout occured, disconnecting.")
+                ingest.close()
+        for head in list(self.heads):
+            if now - head.started > timeout:
+                logger.info("Timeout reading the request, disconnecting.")
+                head.close()
+        self.event_loop.call_later(1.0, self._check_idle)
+
+
+def create_server(address, handler, mixin=None):
+    """Creates the server type configured by `server_mode`, with `mixin`
+    mixed in if given."""
+    if getattr(config, 'server_mode', 'threaded') == 'eventloop':
+        cls = EventLoopHTTPServer
+        kwargs = {'workers': getattr(config, 'server_workers', 16)}
+    else:
+        cls = ThreadedHTTPServer
+        kwargs = {}
+    if mixin is not None:
+        # Old style classes, like those of SocketServer, have their own type.
+        cls = type(cls)(cls.__name__, (mixin, cls), {})
+    return cls(address, handler, **kwargs)
+
+
+def setup(handler=IcyRequestHandler):
+    """Creates the state shared by the requests of `handler`, unless it
+    has that already. Not done on import, so importing this module is
+    cheap and doesn't start anything."""
+    if handler.manager is None:
+        handler.manager = manager.IcyManager()
+    if handler.admin is None:
+        handler.admin = create_admin()
+
+
+def create_admin():
+    """Returns an :class:`adminclient.AdminClient` set up from the
+    config."""
+    return AdminClient(config.icecast_host, config.icecast_port,
+                       config.icecast_pass,
+                       size=getattr(config, 'admin_pool_size', 4),
+                       timeout=getattr(config, 'admin_timeout', 5.0),
+                       ttl=getattr(config, 'admin_cache_ttl', 1.0))
+
+
+def set_log_level(level):
+    """Sets the level of our loggers, those of the server and the audio
+    package."""
+    for name in ('server', 'audio'):
+        logging.getLogger(name).setLevel(level)
+
+
+def reconfigure(icy, changes, handler=IcyRequestHandler):
+    """Applies the settings in `changes`, a dict as returned by
+    :func:`configreload.reload_config`, to the running server `icy` and the
+    state shared by the requests of `handler`."""
+    if 'logging_level' in changes:
+        set_log_level(config.logging_level)
+    if any(name in changes for name in ADMIN_SETTINGS):
+        old, handler.admin = handler.admin, create_admin()
+        if old is not None:
+            old.close()
+    if handler.manager is not None:
+        handler.manager.reconfigure(changes)
+    if 'server_address' in changes or 'server_port' in changes:
+        address = (config.server_address, config.server_port)
+        try:
+            icy.rebind(address)
+        except socket.error:
+            logger.exception("Failed to listen on %s:%d, staying on the "
+                             "old address.", *address)
+
+
+def handle_reload(icy, handler=IcyRequestHandler):
+    """Reloads the config and applies it to `icy`, see
+    :func:`reconfigure`. Cached logins are forgotten either way, so a
+    SIGHUP is how changed passwords or privileges take effect."""
+    handler.manager.invalidate_login()
+    changes = configreload.reload_config()
+    if not changes:
+        return
+    try:
+        reconfigure(icy, changes, handler)
+    except Exception:
+        logger.exception("Failed applying the reloaded config.")
+
+
+def run(server=create_server,
         handler=IcyRequestHandler,
         continue_running=threading.Event()):
+    setup(handler)
     address = (config.server_address, config.server_port)
     icy = server(address, handler)
     while not continue_running.is_set():
         icy.handle_request()
-    icy.shutdown()
+        if reload_requested.is_set():
+            reload_requested.clear()
+            handle_reload(icy, handler)
+    icy.server_close()
 
 
 def start():
     global _server_event, _server_thread
+    setup()
     _server_event = threading.Event()
     _server_thread = threading.Thread(target=run, kwargs={'continue_running':
                                                           _server_event})
@@ -348,13 +1185,11 @@ if __name__ == "__main__":
     logger.addHandler(stream)
     logger.addHandler(logfile)
 
-    logger.setLevel(config.logging_level)
-
     # Don't forget the audio package logger
     audio_log = logging.getLogger('audio')
     audio_log.addHandler(stream)
     audio_log.addHandler(logfile)
-    audio_log.setLevel(config.logging_level)
+    set_log_level(config.logging_level)
 
     import time
     killed = threading.Event()
@@ -364,6 +1199,8 @@ if __name__ == "__main__":
     start()
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGHUP,
+                  lambda signum, frame: reload_requested.set())
     while not killed.is_set():
         time.sleep(5)
-
+
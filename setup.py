@@ -2,19 +2,11 @@ from distutils.core import setup
 from distutils.extension import Extension
 from Cython.Distutils import build_ext
 
+# Build with `python setup.py build_ext --inplace` so the module ends up
+# next to its source as `buffers.carray_buffer`.
 setup(
     cmdclass = {'build_ext': build_ext},
-    ext_modules = [Extension("carray_buffer", ["buffers/carray_buffer.pyx"],
+    ext_modules = [Extension("buffers.carray_buffer", ["buffers/carray_buffer.pyx"],
                         extra_compile_args=['-fopenmp'],
                         extra_link_args=['-fopenmp'])]
 )
-
-import os
-
-filename = 'carray_buffer.so'
-filepath = os.path.join(os.getcwd(), filename)
-if os.path.exists(filepath):
-    # We got installed --inplace
-    destination = os.path.join(os.getcwd(), 'buffers')
-    if os.path.exists(destination):
-        os.rename(filepath, os.path.join(destination, filename))
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""Tests of :class:`adminclient.AdminClient` against
+:class:`benchmarks.fake_icecast.FakeIcecast`."""
+import logging
+import socket
+import threading
+import time
+import unittest
+from adminclient import AdminClient, AdminError
+from benchmarks.fake_icecast import FakeIcecast
+
+logging.getLogger('server.adminclient').addHandler(logging.NullHandler())
+
+
+class AdminClientTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def serve(self, **kwargs):
+        server = FakeIcecast(**kwargs).start()
+        self.servers.append(server)
+        return server
+
+    def client(self, server, **kwargs):
+        client = AdminClient('127.0.0.1', server.port, 'hackme', **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_get(self):
+        server = self.serve(listeners=2)
+        response = self.client(server).get('/admin/listclients?mount=/main')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.content_type, 'text/xml')
+        self.assertIn('<Listeners>2</Listeners>', response.body)
+
+    def test_coalescing(self):
+        server = self.serve(delay=0.2)
+        client = self.client(server)
+        responses = []
+        def get():
+            responses.append(client.get('/admin/listclients?mount=/main'))
+        threads = [threading.Thread(target=get) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5.0)
+        self.assertEqual(len(responses), 5)
+        self.assertEqual(server.requests, 1,
+                         "concurrent requests should share one fetch")
+        self.assertEqual(len(set(id(response) for response in responses)), 1)
+
+    def test_ttl(self):
+        server = self.serve()
+        client = self.client(server, ttl=0.2)
+        client.get('/admin/listclients?mount=/main')
+        client.get('/admin/listclients?mount=/main')
+        self.assertEqual(server.requests, 1, "result should be reused")
+        client.get('/admin/listclients?mount=/other')
+        self.assertEqual(server.requests, 2, "other paths are fetched")
+        time.sleep(0.3)
+        client.get('/admin/listclients?mount=/main')
+        self.assertEqual(server.requests, 3, "expired result was reused")
+
+    def test_connection_error(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        client = AdminClient('127.0.0.1', port, 'hackme', timeout=1.0)
+        self.assertRaises(AdminError, client.get, '/admin/listclients')
+        self.assertEqual(client.fetches, {},
+                         "a failed fetch shouldn't be kept")
+
+    def test_timeout(self):
+        server = self.serve(delay=1.0)
+        client = self.client(server, timeout=0.2)
+        start = time.time()
+        self.assertRaises(AdminError, client.get, '/admin/listclients')
+        self.assertLess(time.time() - start, 1.0)
+        # The next caller tries again instead of getting the old error.
+        server.delay = 0.0
+        self.assertEqual(client.get('/admin/listclients').status, 200)
+
+    def test_stale_keepalive_retried(self):
+        server = self.serve(drop_idle=True)
+        client = self.client(server, ttl=0.0)
+        client.get('/admin/listclients')
+        time.sleep(0.1)
+        response = client.get('/admin/listclients')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(server.requests, 2)
+        self.assertEqual(client.connections, 2,
+                         "the closed connection should be replaced")
+
+    def test_keepalive_reused(self):
+        server = self.serve()
+        client = self.client(server, ttl=0.0)
+        for i in range(3):
+            client.get('/admin/listclients')
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(server.connections, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
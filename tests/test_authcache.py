@@ -0,0 +1,92 @@
+"""Tests of :class:`authcache.AuthCache`."""
+import time
+import unittest
+from authcache import AuthCache
+
+
+class AuthCacheTest(unittest.TestCase):
+    def test_hit_and_miss(self):
+        cache = AuthCache()
+        self.assertIsNone(cache.get('dj', 'secret', 3))
+        cache.put('dj', 'secret', 3, True)
+        self.assertTrue(cache.get('dj', 'secret', 3))
+        self.assertIsNone(cache.get('dj', 'wrong', 3),
+                          "another password shouldn't match")
+        self.assertIsNone(cache.get('dj', 'secret', 4),
+                          "another privilege shouldn't match")
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 3)
+
+    def test_password_not_kept(self):
+        cache = AuthCache()
+        cache.put('dj', u'secret\u2603', 3, True)
+        self.assertTrue(cache.get('dj', u'secret\u2603', 3))
+        for user, digest, privilege in cache.entries:
+            self.assertNotIn(u'secret\u2603'.encode('utf-8'), digest)
+
+    def test_ttl(self):
+        cache = AuthCache(ttl=0.1)
+        cache.put('dj', 'secret', 3, True)
+        self.assertTrue(cache.get('dj', 'secret', 3))
+        time.sleep(0.15)
+        self.assertIsNone(cache.get('dj', 'secret', 3),
+                          "expired entries shouldn't be used")
+        self.assertEqual(cache.stats()['size'], 0,
+                         "expired entries should be removed")
+
+    def test_lru(self):
+        cache = AuthCache(size=2)
+        cache.put('a', 'pw', 3, True)
+        cache.put('b', 'pw', 3, True)
+        # Using a makes b the least recently used.
+        cache.get('a', 'pw', 3)
+        cache.put('c', 'pw', 3, True)
+        self.assertTrue(cache.get('a', 'pw', 3))
+        self.assertIsNone(cache.get('b', 'pw', 3), "b should be evicted")
+        self.assertTrue(cache.get('c', 'pw', 3))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_negative(self):
+        cache = AuthCache(ttl=10.0, negative_ttl=0.1)
+        cache.put('dj', 'wrong', 3, False)
+        self.assertIs(cache.get('dj', 'wrong', 3), False,
+                      "failed logins should be cached")
+        cache.put('dj', 'secret', 3, True)
+        time.sleep(0.15)
+        self.assertIsNone(cache.get('dj', 'wrong', 3),
+                          "failed logins should expire sooner")
+        self.assertTrue(cache.get('dj', 'secret', 3))
+
+    def test_negative_kept_apart(self):
+        cache = AuthCache(size=2, negative_size=2)
+        cache.put('dj', 'secret', 3, True)
+        for i in range(10):
+            cache.put('dj', 'wrong{:d}'.format(i), 3, False)
+        self.assertTrue(cache.get('dj', 'secret', 3),
+                        "failed logins shouldn't push out good ones")
+        stats = cache.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['negative_size'], 2)
+
+    def test_result_replaced(self):
+        cache = AuthCache()
+        cache.put('dj', 'secret', 3, False)
+        cache.put('dj', 'secret', 3, True)
+        self.assertTrue(cache.get('dj', 'secret', 3))
+        self.assertEqual(cache.stats()['negative_size'], 0)
+
+    def test_invalidate(self):
+        cache = AuthCache()
+        cache.put('a', 'pw', 3, True)
+        cache.put('a', 'bad', 3, False)
+        cache.put('b', 'pw', 3, True)
+        cache.invalidate('a')
+        self.assertIsNone(cache.get('a', 'pw', 3))
+        self.assertIsNone(cache.get('a', 'bad', 3))
+        self.assertTrue(cache.get('b', 'pw', 3))
+        cache.invalidate()
+        self.assertIsNone(cache.get('b', 'pw', 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""Tests of :class:`audio.broadcast.Broadcast` and its listeners: the burst
+a new listener starts with, skipping ahead when lapped and interleaving
+ICY metadata every `icy-metaint` bytes."""
+import struct
+import unittest
+from audio import broadcast
+
+
+def chunk(index, size=100):
+    """Returns a chunk of `size` bytes telling which one it is."""
+    return chr(ord('a') + index) * size
+
+
+class Sink(object):
+    """A :meth:`socket.socket.send` taking at most `limit` bytes a call."""
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.data = b''
+
+    def __call__(self, data):
+        if self.limit is not None:
+            data = data[:self.limit]
+        self.data += bytes(data)
+        return len(data)
+
+
+def parse_icy(data, metaint):
+    """Splits a stream with ICY metadata into its audio and the list of
+    metadata blocks, without padding."""
+    audio, blocks = [], []
+    position = 0
+    while position < len(data):
+        audio.append(data[position:position + metaint])
+        position += metaint
+        if position >= len(data):
+            break
+        length = struct.unpack('B', data[position])[0] * 16
+        blocks.append(data[position + 1:position + 1 + length].rstrip(b'\x00'))
+        position += 1 + length
+    return b''.join(audio), blocks
+
+
+class BroadcastTest(unittest.TestCase):
+    def make(self, capacity=1000, burst=300):
+        return broadcast.Broadcast('/main', capacity, burst)
+
+    def test_burst(self):
+        cast = self.make()
+        for i in range(8):
+            cast.write(chunk(i))
+        listener = cast.listener()
+        sink = Sink()
+        self.assertTrue(listener.send(sink))
+        self.assertEqual(sink.data, chunk(5) + chunk(6) + chunk(7),
+                         "should start `burst` bytes back")
+
+    def test_burst_on_chunk_start(self):
+        cast = self.make()
+        for i in range(4):
+            cast.write(chunk(i, 120))
+        sink = Sink()
+        cast.listener().send(sink)
+        self.assertEqual(sink.data, chunk(1, 120) + chunk(2, 120) +
+                         chunk(3, 120),
+                         "should start on the first chunk at least `burst` "
+                         "bytes back")
+
+    def test_follows_writes(self):
+        cast = self.make()
+        cast.write(chunk(0))
+        listener = cast.listener()
+        sink = Sink(limit=30)
+        while len(sink.data) < 100:
+            listener.send(sink)
+        self.assertFalse(listener.wait(0.01), "nothing new to send")
+        cast.write(chunk(1))
+        self.assertTrue(listener.wait(0.01))
+        listener.send(sink)
+        while len(sink.data) < 200:
+            listener.send(sink)
+        self.assertEqual(sink.data, chunk(0) + chunk(1))
+
+    def test_lapped(self):
+        cast = self.make()
+        cast.write(chunk(0))
+        listener = cast.listener()
+        for i in range(1, 15):
+            cast.write(chunk(i))
+        sink = Sink()
+        listener.send(sink)
+        self.assertEqual(sink.data, chunk(12) + chunk(13) + chunk(14),
+                         "a lapped listener should skip to recent audio")
+        self.assertEqual(listener.dropped_bytes, 1200)
+
+    def test_writer_never_waits(self):
+        cast = self.make()
+        listener = cast.listener()
+        for i in range(100):
+            cast.write(chunk(i % 26))
+        self.assertEqual(cast.end, 10000)
+        self.assertEqual(listener.position, 0)
+
+    def test_close_ends_listeners(self):
+        cast = self.make()
+        cast.write(chunk(0))
+        listener = cast.listener()
+        cast.close()
+        self.assertFalse(listener.send(Sink()), "the stream should end")
+        self.assertTrue(listener.ended)
+
+    def test_listener_before_next_stream(self):
+        cast = self.make()
+        cast.write(chunk(0))
+        cast.close()
+        listener = cast.listener()
+        sink = Sink()
+        self.assertTrue(listener.send(sink))
+        self.assertEqual(sink.data, b'', "the old stream is over")
+        cast.write(chunk(1))
+        listener.send(sink)
+        self.assertEqual(sink.data, chunk(1))
+
+    def test_listener_count(self):
+        cast = self.make()
+        first, second = cast.listener(), cast.listener()
+        self.assertEqual(cast.listeners, 2)
+        first.close()
+        first.close()
+        self.assertEqual(cast.listeners, 1)
+
+
+class MetadataTest(unittest.TestCase):
+    def stream(self, metaint, limit, titles):
+        """Sends 10 chunks with `metaint`, changing the title to the next of
+        `titles` before each, through sends of at most `limit` bytes."""
+        cast = broadcast.Broadcast('/main', 10000, 10000)
+        listener = cast.listener(metaint)
+        sink = Sink(limit)
+        audio = b''
+        for i in range(10):
+            cast.set_metadata(titles[i % len(titles)])
+            cast.write(chunk(i))
+            audio += chunk(i)
+            while listener.wait(0):
+                listener.send(sink)
+        return audio, sink.data
+
+    def test_interleave(self):
+        audio, data = self.stream(64, None, [u'song'])
+        received, blocks = parse_icy(data, 64)
+        self.assertEqual(received, audio)
+        self.assertEqual(len(blocks), len(audio) // 64)
+        self.assertEqual(blocks[0], b"StreamTitle='song';")
+        self.assertEqual(set(blocks[1:]), set([b'']),
+                         "an unchanged title should be sent as empty")
+
+    def test_partial_sends(self):
+        audio, data = self.stream(64, 7, [u'song'])
+        received, blocks = parse_icy(data, 64)
+        self.assertEqual(received, audio,
+                         "metadata should land every metaint bytes")
+        self.assertEqual(blocks[0], b"StreamTitle='song';")
+
+    def test_title_changes(self):
+        audio, data = self.stream(100, None, [u'one', u'two \u2603'])
+        received, blocks = parse_icy(data, 100)
+        self.assertEqual(received, audio)
+        titles = [block for block in blocks if block]
+        self.assertEqual(titles[:2], [b"StreamTitle='one';",
+                                      b"StreamTitle='two \xe2\x98\x83';"])
+
+    def test_without_metaint(self):
+        audio, data = self.stream(0, None, [u'song'])
+        self.assertEqual(data, audio)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""Conformance checks every :mod:`buffers` implementation has to pass, an
+implementation failing them shouldn't be loaded by :mod:`buffers`.
+
+A test case is made for each implementation that can be imported. Run from
+the repository root::
+
+    python -m unittest discover tests
+"""
+import threading
+import time
+import unittest
+import buffers
+from buffers import ring, overflow as policies
+
+
+def _delayed(delay, function, *args):
+    timer = threading.Timer(delay, function, args)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class BufferConformance(object):
+    """Mixed into a :class:`unittest.TestCase` per implementation, which
+    sets :attr:`buffer_class`."""
+    buffer_class = None
+
+    def test_roundtrip(self):
+        buffer = self.buffer_class(max_size=16)
+        buffer.write(b'abcdefghij')
+        buffer.write(b'klmnopqrst')
+        self.assertEqual(len(buffer), 20, "len() should count unread bytes")
+        self.assertEqual(buffer.read(15), b'abcdefghijklmno')
+        self.assertEqual(len(buffer), 5, "len() should shrink after reading")
+        self.assertEqual(buffer.read(5), b'pqrst')
+
+    def test_blocking_read(self):
+        buffer = self.buffer_class(max_size=16)
+        buffer.write(b'abc')
+        _delayed(0.05, buffer.write, b'def')
+        self.assertEqual(buffer.read(6), b'abcdef',
+                         "read should wait for all bytes")
+
+    def test_timeout(self):
+        buffer = self.buffer_class(max_size=16)
+        start = time.time()
+        self.assertEqual(buffer.read(4, timeout=0.1), b'',
+                         "timeout should return nothing")
+        self.assertLess(time.time() - start, 1.0, "timeout was not respected")
+        self.assertFalse(buffer.eof, "a timeout is not the end of the stream")
+        buffer.write(b'ab')
+        self.assertEqual(buffer.read(4, timeout=0.1), b'ab',
+                         "timeout drops partial data")
+
+    def test_close(self):
+        buffer = self.buffer_class(max_size=16)
+        buffer.write(b'ab')
+        _delayed(0.05, buffer.close)
+        self.assertEqual(buffer.read(4), b'ab',
+                         "close should return partial data")
+        self.assertTrue(buffer.eof, "eof should be set after close")
+        self.assertEqual(buffer.read(4), b'',
+                         "read after close should return EOF")
+
+    def test_read_into(self):
+        buffer = self.buffer_class(max_size=16)
+        buffer.write(b'abcdef')
+        target = bytearray(4)
+        self.assertEqual(buffer.read_into(target), 4)
+        self.assertEqual(target, bytearray(b'abcd'))
+
+
+class RingWriteFromTest(unittest.TestCase):
+    """:meth:`buffers.ring.Buffer.write_from` only applies the overflow
+    policy to bytes that actually arrive."""
+    def fill(self, overflow):
+        buffer = ring.Buffer(max_size=100, deques=2, overflow=overflow)
+        buffer.write(b'x' * 100)
+        return buffer
+
+    def receive(self, data):
+        def readinto(region):
+            region[:len(data)] = data
+            return len(data)
+        return readinto
+
+    def test_drop_keeps_data_when_there_is_room(self):
+        buffer = self.fill(policies.DROP)
+        self.assertEqual(buffer.write_from(self.receive(b'y' * 10), 4096), 10)
+        self.assertEqual(buffer.dropped_bytes, 0)
+        self.assertEqual(buffer.read(110), b'x' * 100 + b'y' * 10)
+
+    def test_disconnect_only_when_full(self):
+        buffer = self.fill(policies.DISCONNECT)
+        self.assertEqual(buffer.write_from(self.receive(b'y' * 10), 4096), 10)
+        buffer.write(b'z' * 90)
+        self.assertRaises(policies.BufferOverflow, buffer.write_from,
+                          self.receive(b'y'), 4096)
+
+    def test_region_capped_at_free_space(self):
+        buffer = self.fill(policies.DROP)
+        sizes = []
+        def readinto(region):
+            sizes.append(len(region))
+            return 0
+        buffer.write_from(readinto, 4096)
+        self.assertEqual(sizes, [100])
+
+
+def make_case(name, buffer_class):
+    """Returns a :class:`unittest.TestCase` checking `buffer_class`."""
+    return type('{:s}Test'.format(name.title().replace('_', '')),
+                (BufferConformance, unittest.TestCase),
+                {'buffer_class': buffer_class})
+
+
+def conformance(name, buffer_class):
+    """Runs the checks against `buffer_class` and returns a list of failure
+    messages, for :mod:`benchmarks.buffer_throughput`."""
+    result = unittest.TestResult()
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(
+                                                make_case(name, buffer_class))
+    suite.run(result)
+    return ["{:s}: {:s}".format(test.id().rsplit('.', 1)[-1],
+                                trace.strip().splitlines()[-1])
+            for test, trace in result.failures + result.errors]
+
+
+for _name, _buffer_class in buffers.available():
+    _case = make_case(_name, _buffer_class)
+    globals()[_case.__name__] = _case
+del _name, _buffer_class, _case
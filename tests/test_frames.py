@@ -0,0 +1,114 @@
+"""Tests of :class:`audio.frames.FrameScanner` on MP3 and Ogg streams that
+arrive in arbitrary chunks."""
+import struct
+import unittest
+from audio import frames, filler
+
+
+def mp3_frame(header, fill=b'\x00'):
+    """Returns an MP3 frame with the 4 byte `header` and `fill` as audio."""
+    size = frames.parse_mp3_header(header).length - 4
+    return header + (fill * size)[:size]
+
+
+def ogg_page(body, granule=0, serial=1, sequence=0, header_type=0):
+    """Returns an Ogg page holding `body` as a single packet."""
+    lacing = [255] * (len(body) // 255) + [len(body) % 255]
+    return (struct.pack('<4sBBqIIIB', b'OggS', 0, header_type, granule,
+                        serial, sequence, 0, len(lacing)) +
+            bytes(bytearray(lacing)) + body)
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+#: Frames at 128 and 64 kbit/s, with and without padding. The audio has
+#: 0xFF bytes that shouldn't be taken for frame headers.
+MP3_FRAMES = [mp3_frame(b'\xff\xfb\x90\xc4', b'\xff\x00'),
+              mp3_frame(b'\xff\xfb\x52\xc4', b'\x01'),
+              filler.SILENT_MP3_FRAME,
+              mp3_frame(b'\xff\xfb\x92\xc4', b'\x00\xff\xfb')]
+OGG_PAGES = [ogg_page(b'\x01vorbis' + b'\x00' * 23, header_type=0x02),
+             ogg_page(b'a' * 600, granule=1024, sequence=1),
+             ogg_page(b'', granule=1024, sequence=2),
+             ogg_page(b'b' * 255, granule=2048, sequence=3)]
+
+
+class FrameScannerTest(unittest.TestCase):
+    def scan(self, format, chunks):
+        """Feeds `chunks` and returns what came out of every feed."""
+        scanner = frames.FrameScanner(format)
+        return scanner, [scanner.feed(chunk) for chunk in chunks]
+
+    def assertWhole(self, outputs, units):
+        """Checks that every output is a run of whole `units`, and that all
+        of them came out in order."""
+        data = b''.join(units)
+        ends, end = set(), 0
+        for unit in units:
+            end += len(unit)
+            ends.add(end)
+        position = 0
+        for output in outputs:
+            if not output:
+                continue
+            self.assertEqual(output, data[position:position + len(output)])
+            position += len(output)
+            self.assertIn(position, ends, "output should end on a boundary")
+        self.assertEqual(position, len(data), "all frames should come out")
+
+    def test_mp3_chunks(self):
+        stream = b''.join(MP3_FRAMES * 3)
+        for size in (1, 3, 4, 5, 100, 417, 1000, len(stream)):
+            scanner, outputs = self.scan(frames.MP3, chunked(stream, size))
+            self.assertWhole(outputs, MP3_FRAMES * 3)
+            self.assertEqual(scanner.pending, b'')
+            self.assertEqual(scanner.skipped, 0)
+            self.assertEqual(scanner.header, MP3_FRAMES[-1][:4])
+
+    def test_mp3_partial_frame_kept(self):
+        scanner = frames.FrameScanner(frames.MP3)
+        frame = filler.SILENT_MP3_FRAME
+        self.assertEqual(scanner.feed(frame + frame[:100]), frame)
+        self.assertEqual(scanner.pending, frame[:100])
+        self.assertEqual(scanner.feed(frame[100:]), frame)
+
+    def test_mp3_garbage_skipped(self):
+        stream = b'\x00\xff\x12garbage' + b''.join(MP3_FRAMES)
+        scanner, outputs = self.scan(frames.MP3, chunked(stream, 7))
+        self.assertWhole(outputs, MP3_FRAMES)
+        self.assertEqual(scanner.skipped, 10)
+
+    def test_mp3_resync(self):
+        stream = (b''.join(MP3_FRAMES[:2]) + b'\x00' * 50 +
+                  b''.join(MP3_FRAMES[2:]))
+        scanner, outputs = self.scan(frames.MP3, chunked(stream, 64))
+        self.assertWhole(outputs, MP3_FRAMES)
+        self.assertEqual(scanner.skipped, 50)
+
+    def test_reset(self):
+        scanner = frames.FrameScanner(frames.MP3)
+        frame = filler.SILENT_MP3_FRAME
+        scanner.feed(frame[:200])
+        scanner.reset()
+        self.assertEqual(scanner.feed(frame[200:] + frame), frame,
+                         "the old partial frame should be gone")
+
+    def test_ogg_chunks(self):
+        stream = b''.join(OGG_PAGES * 2)
+        for size in (1, 4, 27, 28, 100, len(stream)):
+            scanner, outputs = self.scan(frames.OGG, chunked(stream, size))
+            self.assertWhole(outputs, OGG_PAGES * 2)
+            self.assertEqual(scanner.pending, b'')
+            self.assertEqual(scanner.skipped, 0)
+
+    def test_ogg_garbage_skipped(self):
+        stream = b'Ogg?' + b''.join(OGG_PAGES)
+        scanner, outputs = self.scan(frames.OGG, chunked(stream, 10))
+        self.assertWhole(outputs, OGG_PAGES)
+        self.assertEqual(scanner.skipped, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
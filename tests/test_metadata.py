@@ -0,0 +1,123 @@
+"""Tests of the debouncing and retries of :class:`audio.metadata.MetadataQueue`."""
+import logging
+import threading
+import time
+import unittest
+from audio import metadata
+
+logging.getLogger('audio.metadata').addHandler(logging.NullHandler())
+
+
+class FakeSender(object):
+    """Records what :class:`metadata.MetadataQueue` schedules, the test
+    flushes by hand."""
+    def __init__(self):
+        self.delays = []
+
+    def schedule(self, queue, delay):
+        self.delays.append(delay)
+
+
+class MetadataQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.fail = False
+        self.sender = FakeSender()
+        self.queue = metadata.MetadataQueue(self.send, '/main',
+                                            sender=self.sender, debounce=0.5,
+                                            retry=1.0, max_retry=3.0)
+
+    def send(self, title):
+        if self.fail:
+            raise IOError("icecast is gone")
+        self.sent.append(title)
+
+    def test_burst_coalesced(self):
+        for i in range(5):
+            self.queue.put(u'song {:d}'.format(i))
+        self.assertEqual(self.sender.delays, [0.5],
+                         "a burst should be flushed once, after debounce")
+        self.queue.flush()
+        self.assertEqual(self.sent, [u'song 4'], "only the newest is sent")
+
+    def test_duplicates_skipped(self):
+        self.queue.put(u'song')
+        self.queue.put(u'song')
+        self.queue.flush()
+        self.queue.put(u'song')
+        self.assertEqual(self.sender.delays, [0.5],
+                         "what icecast has already shouldn't be sent")
+        self.queue.put(u'other')
+        self.queue.flush()
+        self.assertEqual(self.sent, [u'song', u'other'])
+
+    def test_back_to_sent_title(self):
+        self.queue.put(u'song')
+        self.queue.flush()
+        self.queue.put(u'other')
+        self.queue.put(u'song')
+        self.queue.flush()
+        self.assertEqual(self.sent, [u'song', u'song'],
+                         "a pending title was replaced, so this is a change")
+
+    def test_retry(self):
+        self.fail = True
+        self.queue.put(u'song')
+        for i in range(4):
+            self.queue.flush()
+        self.assertEqual(self.sender.delays, [0.5, 1.0, 2.0, 3.0, 3.0],
+                         "retries should back off up to max_retry")
+        self.assertEqual(self.queue.pending, u'song')
+        self.fail = False
+        self.queue.put(u'newer')
+        self.assertEqual(len(self.sender.delays), 5,
+                         "a retry is scheduled already")
+        self.queue.flush()
+        self.assertEqual(self.sent, [u'newer'])
+        self.assertEqual(self.queue.failures, 0)
+
+    def test_resend(self):
+        self.queue.resend()
+        self.assertEqual(self.sender.delays, [], "nothing to resend")
+        self.queue.put(u'song')
+        self.queue.flush()
+        self.queue.resend()
+        self.assertEqual(self.sender.delays[-1], 0.0,
+                         "a new connection should get the title right away")
+        self.queue.flush()
+        self.assertEqual(self.sent, [u'song', u'song'])
+
+    def test_clear(self):
+        self.queue.put(u'song')
+        self.queue.flush()
+        self.queue.put(u'other')
+        self.queue.clear()
+        self.queue.flush()
+        self.assertEqual(self.sent, [u'song'])
+        self.queue.put(u'song')
+        self.queue.flush()
+        self.assertEqual(self.sent, [u'song', u'song'],
+                         "after clear nothing counts as sent")
+
+
+class MetadataSenderTest(unittest.TestCase):
+    def test_debounce(self):
+        sent = []
+        done = threading.Event()
+        def send(title):
+            sent.append((time.time(), title))
+            done.set()
+        queue = metadata.MetadataQueue(send, '/main',
+                                       sender=metadata.MetadataSender(),
+                                       debounce=0.1)
+        start = time.time()
+        queue.put(u'a')
+        queue.put(u'b')
+        self.assertTrue(done.wait(2.0))
+        time.sleep(0.15)
+        self.assertEqual([title for _, title in sent], [u'b'])
+        self.assertGreaterEqual(sent[0][0] - start, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""Checks of the overflow policies in :mod:`buffers.overflow`, for every
+:mod:`buffers` implementation that supports them.
+
+Run from the repository root::
+
+    python -m unittest discover tests
+"""
+import functools
+import threading
+import time
+import unittest
+import buffers
+from buffers import overflow as policies
+from audio import frames, filler
+
+
+FRAME = filler.SILENT_MP3_FRAME
+
+
+class OverflowChecks(object):
+    """Mixed into a :class:`unittest.TestCase` per implementation, which
+    sets :attr:`buffer_class`."""
+    buffer_class = None
+
+    def make(self, overflow, max_size=10, deques=2, boundary=None):
+        if overflow not in self.buffer_class.overflow_policies:
+            self.skipTest("'{:s}' isn't supported.".format(overflow))
+        return self.buffer_class(max_size=max_size, deques=deques,
+                                 overflow=overflow, boundary=boundary)
+
+    def test_drop_oldest(self):
+        buffer = self.make(policies.DROP)
+        buffer.write(b'a' * 15)
+        buffer.write(b'b' * 10)
+        self.assertEqual(len(buffer), 20, "the buffer should stay full")
+        self.assertEqual(buffer.dropped_bytes, 5)
+        self.assertEqual(buffer.overflows, 1)
+        self.assertEqual(buffer.read(20), b'a' * 10 + b'b' * 10,
+                         "the oldest bytes should be dropped")
+
+    def test_drop_larger_than_capacity(self):
+        buffer = self.make(policies.DROP)
+        buffer.write(b'a' * 5)
+        buffer.write(b'0123456789' * 5)
+        self.assertEqual(buffer.read(20), b'0123456789' * 2,
+                         "only the tail of the write should be kept")
+        self.assertEqual(buffer.dropped_bytes, 35)
+
+    def test_drop_on_frame_boundary(self):
+        boundary = functools.partial(frames.find_boundary, format=frames.MP3)
+        buffer = self.make(policies.DROP, max_size=len(FRAME) * 2,
+                           boundary=boundary)
+        buffer.write(FRAME * 4)
+        buffer.write(FRAME[:100])
+        # Dropping 100 bytes would cut the first frame, all of it goes.
+        self.assertEqual(buffer.dropped_bytes, len(FRAME))
+        self.assertEqual(len(buffer), len(FRAME) * 3 + 100)
+        data = buffer.read(len(buffer))
+        self.assertEqual(data[:len(FRAME) * 3], FRAME * 3,
+                         "should start on a frame boundary")
+
+    def test_drop_without_boundary(self):
+        buffer = self.make(policies.DROP, max_size=len(FRAME) * 2)
+        buffer.write(FRAME * 4)
+        buffer.write(FRAME[:100])
+        self.assertEqual(buffer.dropped_bytes, 100)
+        self.assertEqual(buffer.read(len(FRAME))[:4], FRAME[100:104])
+
+    def test_block_until_read(self):
+        buffer = self.make(policies.BLOCK)
+        buffer.write(b'a' * 20)
+        done = threading.Event()
+        def write():
+            buffer.write(b'b' * 5)
+            done.set()
+        thread = threading.Thread(target=write)
+        thread.daemon = True
+        thread.start()
+        self.assertFalse(done.wait(0.1), "a full buffer should block")
+        self.assertEqual(buffer.read(10), b'a' * 10)
+        self.assertTrue(done.wait(1.0), "reading should make room")
+        self.assertEqual(buffer.read(15), b'a' * 10 + b'b' * 5)
+        self.assertEqual(buffer.dropped_bytes, 0)
+        self.assertGreater(buffer.blocked_time, 0.05)
+
+    def test_block_released_by_close(self):
+        buffer = self.make(policies.BLOCK)
+        buffer.write(b'a' * 20)
+        thread = threading.Thread(target=buffer.write, args=(b'b' * 5,))
+        thread.daemon = True
+        thread.start()
+        time.sleep(0.05)
+        buffer.close()
+        thread.join(1.0)
+        self.assertFalse(thread.is_alive(),
+                         "close should wake up a blocked writer")
+
+    def test_disconnect(self):
+        buffer = self.make(policies.DISCONNECT)
+        buffer.write(b'a' * 15)
+        self.assertRaises(policies.BufferOverflow, buffer.write, b'b' * 10)
+        self.assertEqual(buffer.dropped_bytes, 10)
+        self.assertEqual(buffer.read(15), b'a' * 15,
+                         "a refused write shouldn't touch what's there")
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, self.buffer_class, max_size=10,
+                          overflow='maybe')
+
+
+def make_case(name, buffer_class):
+    """Returns a :class:`unittest.TestCase` checking `buffer_class`."""
+    return type('{:s}OverflowTest'.format(name.title().replace('_', '')),
+                (OverflowChecks, unittest.TestCase),
+                {'buffer_class': buffer_class})
+
+
+for _name, _buffer_class in buffers.available():
+    _case = make_case(_name, _buffer_class)
+    globals()[_case.__name__] = _case
+del _name, _buffer_class, _case
@@ -0,0 +1,104 @@
+"""Tests of :class:`audio.pacing.Pacer`, against a fake clock."""
+import struct
+import unittest
+from audio import frames, filler, pacing
+
+
+FRAME = filler.SILENT_MP3_FRAME
+FRAME_DURATION = filler.SILENT_MP3_DURATION
+
+
+def ogg_page(body, granule=0, serial=1, header_type=0):
+    """Returns an Ogg page holding `body` as a single packet."""
+    lacing = [255] * (len(body) // 255) + [len(body) % 255]
+    return (struct.pack('<4sBBqIIIB', b'OggS', 0, header_type, granule,
+                        serial, 0, 0, len(lacing)) +
+            bytes(bytearray(lacing)) + body)
+
+
+def vorbis_head(samplerate, serial=1):
+    """Returns the first page of a Vorbis stream at `samplerate`."""
+    return ogg_page(b'\x01vorbis' + struct.pack('<IBI', 0, 2, samplerate) +
+                    b'\x00' * 11, serial=serial, header_type=0x02)
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class PacerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        original, pacing.time = pacing.time, self.clock
+        self.addCleanup(setattr, pacing, 'time', original)
+
+    def test_mp3_duration(self):
+        pacer = pacing.Pacer(frames.MP3)
+        self.assertAlmostEqual(pacer.duration(FRAME * 10), FRAME_DURATION * 10)
+        self.assertEqual(pacer.bitrate, 128000)
+
+    def test_mp3_split_frames(self):
+        pacer = pacing.Pacer(frames.MP3)
+        data = FRAME * 3
+        total = sum(pacer.duration(data[i:i + 100])
+                    for i in range(0, len(data), 100))
+        self.assertAlmostEqual(total, FRAME_DURATION * 3,
+                               msg="split frames should count once")
+        self.assertEqual(pacer.carry, 0)
+
+    def test_mp3_lost_sync(self):
+        pacer = pacing.Pacer(frames.MP3)
+        pacer.duration(FRAME)
+        # 16000 bytes of garbage is a second at 128 kbit/s.
+        duration = pacer.duration(b'\x00' * 16000 + FRAME)
+        self.assertAlmostEqual(duration, 1.0 + FRAME_DURATION)
+
+    def test_ogg_duration(self):
+        pacer = pacing.Pacer(frames.OGG)
+        data = (vorbis_head(44100) + ogg_page(b'a' * 300, granule=44100) +
+                ogg_page(b'b' * 300, granule=88200))
+        self.assertAlmostEqual(pacer.duration(data[:50]), 0.0)
+        self.assertAlmostEqual(pacer.duration(data[50:]), 2.0)
+
+    def test_ogg_streams(self):
+        pacer = pacing.Pacer(frames.OGG)
+        data = (vorbis_head(48000, serial=1) + vorbis_head(24000, serial=2) +
+                ogg_page(b'a', granule=48000, serial=1) +
+                ogg_page(b'b', granule=24000, serial=2))
+        self.assertAlmostEqual(pacer.duration(data), 2.0,
+                               msg="every stream has its own samplerate")
+
+    def test_delay(self):
+        pacer = pacing.Pacer(frames.MP3, lead=1.0)
+        second = FRAME * int(round(1 / FRAME_DURATION))
+        played = len(second) // len(FRAME) * FRAME_DURATION
+        self.assertEqual(pacer.delay(second), 0.0)
+        self.assertEqual(pacer.delay(second), 0.0,
+                         "we may run `lead` seconds ahead")
+        self.assertAlmostEqual(pacer.delay(second), played * 2 - 1.0)
+        self.clock.now += 3.0
+        self.assertEqual(pacer.delay(second), 0.0)
+
+    def test_no_burst_after_lag(self):
+        pacer = pacing.Pacer(frames.MP3, lead=0.0, max_lag=2.0)
+        pacer.delay(FRAME)
+        self.clock.now += 10.0
+        self.assertEqual(pacer.delay(FRAME * 100), 0.0)
+        self.assertAlmostEqual(pacer.delay(FRAME), FRAME_DURATION * 100,
+                               msg="the clock should restart, not catch up")
+
+    def test_reset(self):
+        pacer = pacing.Pacer(frames.MP3, lead=0.0)
+        pacer.delay(FRAME * 100)
+        pacer.duration(FRAME[:100])
+        pacer.reset()
+        self.assertEqual(pacer.carry, 0)
+        self.assertEqual(pacer.delay(FRAME), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
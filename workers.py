@@ -0,0 +1,583 @@
+#!/usr/bin/python
+"""Runs the proxy as several worker processes so mounts don't share a GIL.
+
+The :class:`Supervisor` owns the listening socket and hands every connection
+to a worker picked by the mount it is for, so all sources, listeners and
+metadata updates of a mount end up in the same process. Kernel balancing
+with SO_REUSEPORT can't do that, it doesn't know about mounts. Pages about
+all mounts go to any worker, each knows the status of the others through
+its :class:`Peers`. Cached logins one worker is told to forget are
+forgotten by all of them.
+
+Start it with `python workers.py`, `server_processes` sets the amount of
+workers. `/metrics` is served by the worker in the `worker` query parameter,
+0 by default. `/proxy/events` always goes to worker 0, which gets the events
+of the others as well, so one stream numbers them all. On SIGHUP the supervisor reloads the config, moving its
+listening socket if the address changed, and has every worker do the same.
+"""
+import os
+import zlib
+import time
+import errno
+import signal
+import socket
+import pickle
+import Queue
+import logging
+import urlparse
+import threading
+import multiprocessing
+from multiprocessing import reduction
+import config
+import configreload
+from eventloop import EventLoop
+
+
+logger = logging.getLogger('server.workers')
+
+#: Paths about all mounts, any worker can serve them.
+SHARED_PATHS = frozenset(['/proxy', '/proxy/status.json',
+                          '/admin/listclients'])
+#: Paths served by worker 0 only. Every worker numbers its own events, so
+#: event streams always go to the same one for Last-Event-ID to make sense.
+EVENT_PATHS = frozenset(['/proxy/events'])
+#: Longest request line we wait for before giving up on routing.
+MAX_REQUEST_LINE = 8192
+#: Seconds a new connection gets to send its request line.
+REQUEST_TIMEOUT = 5.0
+#: Messages and connections waiting for a worker before we drop new ones.
+MAX_OUTBOX = 1024
+
+
+def route(line, processes):
+    """Returns the index of the worker for the request line `line`, or
+    :const:`None` if any worker will do."""
+    parts = line.split()
+    if len(parts) < 2:
+        return None
+    method, path = parts[0], parts[1]
+    parsed = urlparse.urlparse(path)
+    if method == 'SOURCE':
+        # The handler uses the whole path as mount.
+        key = path
+    elif parsed.path == '/admin/metadata':
+        key = urlparse.parse_qs(parsed.query).get('mount', [''])[0]
+    elif parsed.path == '/metrics':
+        try:
+            index = int(urlparse.parse_qs(parsed.query).get('worker', ['0'])[0])
+        except ValueError:
+            index = 0
+        return min(max(index, 0), processes - 1)
+    elif parsed.path in EVENT_PATHS:
+        return 0
+    elif parsed.path in SHARED_PATHS:
+        return None
+    else:
+        # Listeners of a mount.
+        key = parsed.path
+    return (zlib.crc32(key) & 0xffffffff) % processes
+
+
+def listen(address):
+    """Returns a nonblocking socket listening on `address`."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(128)
+    except socket.error:
+        sock.close()
+        raise
+    sock.setblocking(0)
+    return sock
+
+
+class Supervisor(object):
+    def __init__(self, address, processes):
+        """Listens on `address` and runs `processes` workers."""
+        super(Supervisor, self).__init__()
+        self.address = address
+        self.processes = processes
+        self.socket = listen(address)
+        # : Shared part of the ETags of all workers.
+        self.instance = '{:x}'.format(int(time.time()))
+        self.event_loop = EventLoop()
+        # : (process, connection, :class:`Outbox`) of each worker,
+        # : :const:`None` while one is being restarted.
+        self.workers = [None] * processes
+        # : Mapping of file descriptor to (socket, address, deadline) of
+        # : connections we don't know the request line of yet.
+        self.pending = {}
+        self.closing = False
+        # : Set on SIGHUP, :meth:`run` calls :meth:`reload` when it sees it.
+        self.reload_requested = threading.Event()
+        self._next = 0
+
+    def start(self):
+        for index in range(self.processes):
+            self.spawn(index)
+        self.event_loop.add_reader(self.socket.fileno(), self._accept)
+        self.event_loop.call_later(1.0, self._check_pending)
+
+    def run(self, continue_running):
+        self.start()
+        while not continue_running.is_set():
+            self.event_loop.run_once(0.5)
+            if self.reload_requested.is_set():
+                self.reload_requested.clear()
+                self.reload()
+        self.close()
+
+    def reload(self):
+        """Reloads the config and has the workers do the same. If the
+        address changed we listen on the new one from now on, connections
+        already handed to workers stay where they are. The workers reload
+        even if nothing changed, that clears their login caches."""
+        changes = configreload.reload_config(log=False)
+        if 'logging_level' in changes:
+            for name in ('server', 'audio'):
+                logging.getLogger(name).setLevel(config.logging_level)
+        if 'server_address' in changes or 'server_port' in changes:
+            address = (config.server_address, config.server_port)
+            try:
+                self.rebind(address)
+            except socket.error:
+                logger.exception("Failed to listen on %s:%d, staying on the "
+                                 "old address.", *address)
+        self._broadcast(None, pickle.dumps(('reload',), 2))
+
+    def rebind(self, address):
+        """Listens on `address` instead, after handing out the connections
+        waiting on the old socket."""
+        sock = listen(address)
+        self.event_loop.remove_reader(self.socket.fileno())
+        old, self.socket = self.socket, sock
+        self.address = address
+        self.event_loop.add_reader(sock.fileno(), self._accept)
+        while self._accept(old):
+            pass
+        old.close()
+        logger.info("Listening on %s:%d now.", *address)
+
+    def spawn(self, index):
+        """Starts worker `index`."""
+        connection, child = multiprocessing.Pipe()
+        # Connections go over a pipe of their own, so handing one over
+        # never waits behind messages.
+        handles, child_handles = multiprocessing.Pipe()
+        # Everything the worker inherits but shouldn't keep open.
+        inherited = [self.socket, connection, handles]
+        for worker in self.workers:
+            if worker is not None:
+                inherited.extend((worker[1], worker[2].handles))
+        inherited.extend(sock for sock, _, _ in self.pending.values())
+        process = multiprocessing.Process(target=run_worker,
+                                          name='Worker {:d}'.format(index),
+                                          args=(index, child, child_handles,
+                                                self.address, self.instance,
+                                                inherited))
+        process.daemon = True
+        process.start()
+        child.close()
+        child_handles.close()
+        self.workers[index] = (process, connection,
+                               Outbox(index, process.pid, connection, handles))
+        self.event_loop.add_reader(connection.fileno(),
+                                   lambda: self._on_message(index))
+        logger.info("Started worker %d with pid %d.", index, process.pid)
+        # Have the others tell the new one what they have.
+        self._broadcast(index, pickle.dumps(('resend',), 2))
+
+    def close(self):
+        self.closing = True
+        self.event_loop.remove_reader(self.socket.fileno())
+        self.socket.close()
+        for sock, _, _ in self.pending.values():
+            sock.close()
+        self.pending.clear()
+        for worker in self.workers:
+            if worker is not None:
+                worker[0].terminate()
+        for worker in self.workers:
+            if worker is not None:
+                worker[0].join(10.0)
+                worker[2].close()
+                worker[1].close()
+        self.event_loop.close()
+
+    def dispatch(self, sock, address, index):
+        """Hands `sock` over to worker `index`, or the next one in turn if
+        :const:`None`."""
+        if index is None:
+            index = self._next
+            self._next = (self._next + 1) % self.processes
+        worker = self.workers[index]
+        if worker is None:
+            # Being restarted, they'll have to try again.
+            sock.close()
+            return
+        worker[2].send_handle(sock, address)
+
+    def _accept(self, listener=None):
+        """Accepts a connection on `listener`, our socket by default.
+        Returns False if there was none."""
+        try:
+            sock, address = (listener or self.socket).accept()
+        except socket.error:
+            return False
+        sock.setblocking(0)
+        self.pending[sock.fileno()] = (sock, address,
+                                       time.time() + REQUEST_TIMEOUT)
+        self._peek(sock.fileno())
+        return True
+
+    def _peek(self, fd):
+        """Dispatches the pending connection `fd` once its request line is
+        in, without taking it out of the socket."""
+        sock, address, deadline = self.pending[fd]
+        self.event_loop.remove_reader(fd)
+        try:
+            data = sock.recv(MAX_REQUEST_LINE, socket.MSG_PEEK)
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self.event_loop.add_reader(fd, lambda: self._peek(fd))
+                return
+            data = ''
+        if not data:
+            del self.pending[fd]
+            sock.close()
+            return
+        if '\n' not in data and len(data) < MAX_REQUEST_LINE:
+            # The data stays in the socket so it would keep polling as
+            # readable, look again in a bit instead.
+            self.event_loop.call_later(0.05, self._peek_again, fd, sock)
+            return
+        del self.pending[fd]
+        sock.setblocking(1)
+        self.dispatch(sock, address,
+                      route(data.split('\n', 1)[0], self.processes))
+
+    def _peek_again(self, fd, sock):
+        if self.pending.get(fd, (None,))[0] is sock:
+            self._peek(fd)
+
+    def _check_pending(self):
+        now = time.time()
+        for fd, (sock, address, deadline) in self.pending.items():
+            if deadline < now:
+                self.event_loop.remove_reader(fd)
+                del self.pending[fd]
+                sock.close()
+        self.event_loop.call_later(1.0, self._check_pending)
+
+    def _on_message(self, index):
+        """Passes what worker `index` tells us on to the other workers."""
+        process, connection, outbox = self.workers[index]
+        try:
+            data = connection.recv_bytes()
+        except (EOFError, IOError) as err:
+            self._lost(index)
+            return
+        self._broadcast(index, data)
+
+    def _broadcast(self, sender, data):
+        for index, worker in enumerate(self.workers):
+            if index == sender or worker is None:
+                continue
+            worker[2].send_bytes(data)
+
+    def _lost(self, index):
+        process, connection, outbox = self.workers[index]
+        self.event_loop.remove_reader(connection.fileno())
+        outbox.close()
+        connection.close()
+        process.join(1.0)
+        self.workers[index] = None
+        self._broadcast(index, pickle.dumps(('status', index, None), 2))
+        if self.closing:
+            return
+        logger.error("Worker %d exited with %s, restarting it.",
+                     index, process.exitcode)
+        self.event_loop.call_later(1.0, self.spawn, index)
+
+
+class Outbox(object):
+    """Sends to worker `index` with pid `pid` from a thread of its own, so
+    a worker that is slow to read never holds up the :class:`Supervisor`
+    loop. Messages go over `connection`, connections to serve over
+    `handles`."""
+    def __init__(self, index, pid, connection, handles):
+        super(Outbox, self).__init__()
+        self.index = index
+        self.pid = pid
+        self.connection = connection
+        self.handles = handles
+        self.queue = Queue.Queue(MAX_OUTBOX)
+        self.closed = False
+        # : Set while the queue is full, so that is logged once.
+        self.dropping = False
+        self.thread = threading.Thread(target=self._run,
+                                       name='Outbox {:d}'.format(index))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send_bytes(self, data):
+        """Sends the pickled message `data` soon."""
+        self._put(('message', data))
+
+    def send_handle(self, sock, address):
+        """Hands `sock`, connected from `address`, over soon. We close our
+        copy of it once it was sent."""
+        self._put(('request', sock, address))
+
+    def close(self):
+        """Stops the thread and closes connections that weren't handed
+        over yet, `connection` is left to the caller."""
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except Queue.Full:
+            # The thread sees :attr:`closed` after the item it's on.
+            pass
+        if self.thread is not threading.current_thread():
+            self.thread.join(5.0)
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except Queue.Full:
+            if not self.dropping:
+                logger.warning("Worker %d is not keeping up, dropping what "
+                               "we have for it.", self.index)
+            self.dropping = True
+            self._discard(item)
+        else:
+            self.dropping = False
+
+    def _discard(self, item):
+        if item is not None and item[0] == 'request':
+            item[1].close()
+
+    def _run(self):
+        while not self.closed:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                if item[0] == 'message':
+                    self.connection.send_bytes(item[1])
+                else:
+                    self.handles.send(item[2])
+                    reduction.send_handle(self.handles, item[1].fileno(),
+                                          self.pid)
+            except (IOError, OSError) as err:
+                logger.warning("Failed talking to worker %d: %s",
+                               self.index, err)
+            finally:
+                self._discard(item)
+        while True:
+            try:
+                self._discard(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        self.handles.close()
+
+
+class Peers(object):
+    """The other workers as seen from a single one, through the
+    connections to the :class:`Supervisor`: messages over `connection`,
+    connections to serve over `handles`."""
+    def __init__(self, connection, handles, index):
+        super(Peers, self).__init__()
+        self.connection = connection
+        self.handles = handles
+        self.index = index
+        self.manager = None
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        # : Mapping of worker index to its last :class:`manager.Snapshot`.
+        self.snapshots = {}
+        # : Set when our snapshot changed and wasn't sent yet.
+        self.dirty = threading.Event()
+        # : Set when the supervisor is gone.
+        self.closed = threading.Event()
+
+    def attach(self, manager):
+        """Shares the state of :class:`manager.IcyManager` `manager` with
+        the other workers from now on."""
+        self.manager = manager
+        manager.events.add_listener(self._on_event)
+        manager.peers = self
+        for target, name in ((self._publish, "Status publisher"),
+                             (self._listen, "Peer listener")):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+        self.dirty.set()
+
+    def fileno(self):
+        return self.handles.fileno()
+
+    def changed(self):
+        """Sends our snapshot to the others soon."""
+        self.dirty.set()
+
+    def merge(self, snapshot):
+        """Returns our :class:`manager.Snapshot` `snapshot` with the mounts
+        of the others added."""
+        with self.lock:
+            others = self.snapshots.values()
+        version = snapshot.version
+        mounts = list(snapshot.mounts)
+        for other in others:
+            version += other.version
+            mounts.extend(other.mounts)
+        mounts.sort()
+        # Versions only go up so the sum changes whenever any does, and
+        # all workers end up at the same one.
+        return snapshot._replace(version=version, mounts=tuple(mounts))
+
+    def share_invalidate(self, user):
+        self.send(('invalidate', user))
+
+    def send(self, message):
+        try:
+            with self.send_lock:
+                self.connection.send(message)
+        except (IOError, OSError) as err:
+            logger.warning("Failed talking to the supervisor: %s", err)
+
+    def receive(self):
+        """Returns the next (socket, address) the supervisor hands us,
+        :class:`socket.error` is raised when it is gone."""
+        try:
+            address = self.handles.recv()
+            fd = reduction.recv_handle(self.handles)
+        except (EOFError, IOError) as err:
+            self.closed.set()
+            raise socket.error(errno.EPIPE, "Supervisor is gone.")
+        # Python 2 gives a bare socket, the handler wants the wrapped one
+        # with its buffered makefile.
+        sock = socket.socket(_sock=socket.fromfd(fd, socket.AF_INET,
+                                                 socket.SOCK_STREAM))
+        os.close(fd)
+        return sock, address
+
+    def handle(self, message):
+        """Acts on a message from the supervisor."""
+        kind = message[0]
+        if kind == 'status':
+            _, index, snapshot = message
+            with self.lock:
+                if snapshot is None:
+                    self.snapshots.pop(index, None)
+                else:
+                    self.snapshots[index] = snapshot
+        elif kind == 'resend':
+            self.dirty.set()
+        elif kind == 'reload':
+            import server
+            server.reload_requested.set()
+        elif kind == 'invalidate':
+            self.manager.login_cache.invalidate(message[1])
+        elif kind == 'event':
+            _, index, type, data = message
+            self.manager.events.publish(type, worker=index, **data)
+
+    def _listen(self):
+        while not self.closed.is_set():
+            try:
+                message = self.connection.recv()
+            except (EOFError, IOError) as err:
+                self.closed.set()
+                return
+            self.handle(message)
+
+    def _on_event(self, event):
+        if 'worker' in event.data:
+            # Came from another worker.
+            return
+        self.send(('event', self.index, event.type, event.data))
+
+    def _publish(self):
+        while not self.closed.is_set():
+            self.dirty.wait()
+            self.dirty.clear()
+            self.send(('status', self.index, self.manager.local_snapshot()))
+
+
+class WorkerMixIn:
+    """Mixed into the server of a worker, which gets its connections from
+    :attr:`peers` instead of a listening socket of its own. An old style
+    class like the mixins of :mod:`SocketServer`."""
+    #: The :class:`Peers` of this process.
+    peers = None
+
+    def server_bind(self):
+        self.server_name, self.server_port = self.server_address[:2]
+
+    def server_activate(self):
+        pass
+
+    def fileno(self):
+        return self.peers.fileno()
+
+    def get_request(self):
+        return self.peers.receive()
+
+    def rebind(self, address):
+        # The supervisor moves the listening socket.
+        pass
+
+
+def run_worker(index, connection, handles, address, instance, inherited):
+    """Runs worker `index` in a new process."""
+    for thing in inherited:
+        thing.close()
+    # The supervisor stops us with SIGTERM, not the SIGINT a terminal sends
+    # to everyone.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Nor SIGHUP, we reload when the supervisor has.
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    peers = Peers(connection, handles, index)
+    signal.signal(signal.SIGTERM, lambda signum, frame: peers.closed.set())
+
+    # Only now, so nothing the parent imported or started is shared.
+    import server
+    server.INSTANCE = instance
+    server.setup()
+    peers.attach(server.IcyRequestHandler.manager)
+    WorkerMixIn.peers = peers
+    server.run(server=lambda address, handler: server.create_server(
+                                                address, handler, WorkerMixIn),
+               continue_running=peers.closed)
+
+
+def main():
+    stream = logging.StreamHandler()
+    logfile = logging.FileHandler(os.path.expanduser('~/logs/proxy.log'),
+                                  encoding='utf-8')
+    formatter = logging.Formatter(
+                      '%(asctime)s:%(processName)s:%(name)s:%(levelname)s: '
+                      '%(message)s')
+    for name in ('server', 'audio'):
+        log = logging.getLogger(name)
+        for handler in (stream, logfile):
+            handler.setFormatter(formatter)
+            log.addHandler(handler)
+        log.setLevel(config.logging_level)
+
+    supervisor = Supervisor((config.server_address, config.server_port),
+                            getattr(config, 'server_processes', 4))
+    killed = threading.Event()
+    def signal_handler(signum, frame):
+        killed.set()
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGHUP,
+                  lambda signum, frame: supervisor.reload_requested.set())
+    supervisor.run(killed)
+
+
+if __name__ == "__main__":
+    main()